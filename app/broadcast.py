@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional
+
+import metrics
+from outbound import RETRY_STATUS, OutboundQueue
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery(NamedTuple):
+    """ チャンネルごとの配信結果 """
+    channel_id: str
+    # HTTP ステータス (接続できなかった場合は None)
+    status: Optional[int]
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and self.status < 400
+
+    @property
+    def retryable(self) -> bool:
+        """ 時間をおいて再送すれば届く見込みがあるか """
+        return self.status is None or self.status in RETRY_STATUS
+
+
+class BroadcastResult:
+    """
+    一斉配信の結果
+
+    チャンネルごとの配信結果を配信先の順に保持する。
+    """
+
+    def __init__(self, deliveries: Iterable[Delivery] = ()):
+        """
+        :param deliveries : チャンネルごとの配信結果
+        """
+        self.deliveries = {delivery.channel_id: delivery
+                           for delivery in deliveries}
+
+    def update(self, other: 'BroadcastResult'):
+        """
+        再送の結果の反映
+
+        :param other : 再送した配信の結果
+        """
+        self.deliveries.update(other.deliveries)
+
+    @property
+    def delivered(self) -> List[str]:
+        """ 配信できたチャンネルID """
+        return [delivery.channel_id for delivery in self.deliveries.values()
+                if delivery.ok]
+
+    @property
+    def failed(self) -> List[Delivery]:
+        """ 配信できなかったチャンネルの結果 """
+        return [delivery for delivery in self.deliveries.values()
+                if not delivery.ok]
+
+    @property
+    def retry_channels(self) -> List[str]:
+        """ 再送の対象とするチャンネルID """
+        return [delivery.channel_id for delivery in self.failed
+                if delivery.retryable]
+
+
+class Broadcaster:
+    """
+    一斉配信
+
+    同じメッセージを多数のチャンネルへ並行して投稿する。
+    同時に送信する数は concurrency 以下に抑え、HTTP セッション(接続プール)は
+    送信スレッド間で共有する。送信レートは OutboundQueue の
+    トークンバケットに従うため、Webhook への返信と合わせて
+    Mattermost のレート制限を超えない。
+    再送はチャンネルごとには行わず、配信できなかったチャンネルへ
+    retry_interval 秒おきに retry_rounds 回までまとめて再送する。
+    """
+
+    def __init__(self, outbound: OutboundQueue, concurrency: int = 16,
+                 retry_rounds: int = 2, retry_interval: float = 5):
+        """
+        :param outbound       : 送信レートを共有する送信キュー
+        :param concurrency    : 同時に送信する最大数
+        :param retry_rounds   : 配信できなかったチャンネルへの再送回数
+        :param retry_interval : 再送までの待ち時間(秒)
+        """
+        self.outbound = outbound
+        self.concurrency = concurrency
+        self.retry_rounds = retry_rounds
+        self.retry_interval = retry_interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """
+        送信スレッドと HTTP セッションの準備
+
+        OutboundQueue と同様に、プロセスごとに作り直す。
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.concurrency)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self._executor = ThreadPoolExecutor(
+                self.concurrency, thread_name_prefix='hirumibot-broadcast'
+            )
+            self._pid = pid
+
+    def _deliver(self, url: str, headers: dict, message: str,
+                 channel_id: str) -> Delivery:
+        """ 一つのチャンネルへの投稿 """
+        data = {
+            "channel_id": channel_id,
+            "message": message,
+        }
+        try:
+            # 再送は broadcast() がまとめて行うため、ここでは一度だけ送る
+            response = self.outbound.send(url, headers, data, self.session,
+                                          max_retries=0)
+        except Exception:
+            logger.exception('failed to broadcast a post to %s', channel_id)
+            response = None
+
+        delivery = Delivery(
+            channel_id, None if response is None else response.status_code
+        )
+        metrics.inc('hirumibot_broadcast_deliveries_total',
+                    result='ok' if delivery.ok else 'failed')
+        return delivery
+
+    def broadcast(self, url: str, headers: dict, message: str,
+                  channel_ids: Iterable[str]) -> BroadcastResult:
+        """
+        メッセージの一斉配信
+
+        全てのチャンネルへの送信(再送を含む)が終わるまで待つ。
+
+        :param url         : 投稿先の URL
+        :param headers     : HTTP ヘッダ
+        :param message     : 投稿するメッセージ
+        :param channel_ids : 投稿先のチャンネルID (重複は一つにまとめる)
+        :return            : チャンネルごとの配信結果
+        """
+        self._start()
+
+        channel_ids = list(dict.fromkeys(channel_ids))
+        with metrics.stage('broadcast'):
+            result = self._deliver_all(url, headers, message, channel_ids)
+            for _ in range(self.retry_rounds):
+                retry_channels = result.retry_channels
+                if not retry_channels:
+                    break
+                time.sleep(self.retry_interval)
+                result.update(self._deliver_all(url, headers, message,
+                                                retry_channels))
+            return result
+
+    def _deliver_all(self, url: str, headers: dict, message: str,
+                     channel_ids: List[str]) -> BroadcastResult:
+        """ 各チャンネルへの一回ずつの並行した投稿 """
+        return BroadcastResult(self._executor.map(
+            lambda channel_id: self._deliver(url, headers, message,
+                                             channel_id),
+            channel_ids
+        ))
@@ -0,0 +1,195 @@
+import importlib.util
+import json
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Set
+
+# 日ごとのフラグ
+HOLIDAY      = 1 << 0   # 祝日
+BUSINESS_DAY = 1 << 1   # 平日かつ祝日でない日
+LAST_FRIDAY  = 1 << 2   # 月末金曜日(プレミアムフライデー)
+LUNCH_DAY    = 1 << 3   # ランチミーティングの開催日(祝日でない水曜日)
+
+# ランチミーティングの開催曜日と受付時間帯
+LUNCH_WEEKDAY        = 2   # 水曜日
+RECEPTION_START_HOUR = 11
+RECEPTION_END_HOUR   = 13
+
+_settings = {
+    'cache_file': None,
+}
+
+
+class YearCalendar:
+    """
+    年間カレンダー
+
+    一年分の祝日・平日・月末金曜日・ランチミーティング開催日を
+    日ごとのフラグとして事前に計算しておき、定数時間で参照できるようにする。
+    """
+
+    def __init__(self, year: int):
+        """
+        :param year : 対象の年
+        """
+        self.year = year
+        self._first_ordinal = date(year, 1, 1).toordinal()
+        days = date(year + 1, 1, 1).toordinal() - self._first_ordinal
+        self._flags = bytearray(days)
+
+        holidays = year_holidays(year)
+
+        for idx in range(days):
+            day = date.fromordinal(self._first_ordinal + idx)
+            flag = 0
+            if day in holidays:
+                flag |= HOLIDAY
+            elif day.weekday() < 5:
+                flag |= BUSINESS_DAY
+                if day.weekday() == LUNCH_WEEKDAY:
+                    flag |= LUNCH_DAY
+            # 翌週の同じ曜日が翌月であれば月末の金曜日
+            if (day.weekday() == 4
+                    and (day + timedelta(days=7)).month != day.month):
+                flag |= LAST_FRIDAY
+            self._flags[idx] = flag
+
+    def flags(self, day: date) -> int:
+        """
+        指定日のフラグ
+
+        :param day : 対象の日付
+        :return    : 日ごとのフラグ
+        """
+        return self._flags[day.toordinal() - self._first_ordinal]
+
+
+def configure(cache_file: Optional[str] = None):
+    """
+    カレンダーの設定
+
+    祝日の計算には一年分で 0.1 秒程度かかるため、結果を cache_file に保存し、
+    次回以降の起動では jpholiday を読み込まずに済ませる。
+    jpholiday が更新された場合は計算し直す。
+
+    :param cache_file : 祝日の一覧を保存するファイル (None なら保存しない)
+    """
+    _settings['cache_file'] = cache_file
+
+def _jpholiday_stamp() -> str:
+    """ インストールされている jpholiday の識別子 (読み込みはしない) """
+    spec = importlib.util.find_spec('jpholiday')
+    if spec is None or not spec.origin:
+        return ''
+    return f'{spec.origin}:{os.stat(spec.origin).st_mtime_ns}'
+
+def year_holidays(year: int) -> Set[date]:
+    """
+    一年分の祝日
+
+    :param year : 対象の年
+    :return     : 祝日の集合
+    """
+    cache_file = _settings['cache_file']
+    if cache_file:
+        stamp = _jpholiday_stamp()
+        try:
+            cache = json.loads(Path(cache_file).read_text())
+        except (OSError, ValueError):
+            cache = {}
+        if not isinstance(cache, dict) or cache.get('jpholiday') != stamp:
+            cache = {'jpholiday': stamp, 'years': {}}
+
+        cached = cache['years'].get(str(year))
+        if cached is not None:
+            return {date.fromisoformat(day) for day in cached}
+
+    # jpholiday は起動時間を短くするため、必要になってから読み込む
+    import jpholiday
+
+    holidays = {holiday[0] for holiday in jpholiday.year_holidays(year)}
+
+    if cache_file:
+        cache['years'][str(year)] = sorted(day.isoformat() for day in holidays)
+        tmp_file = Path(f'{cache_file}.{os.getpid()}.tmp')
+        try:
+            tmp_file.write_text(json.dumps(cache))
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            pass
+
+    return holidays
+
+@lru_cache(maxsize=2)
+def year_calendar(year: int) -> YearCalendar:
+    """
+    年間カレンダーの取得
+
+    初回参照時に一年分を構築してキャッシュする。
+    年が替われば翌年分を構築し、古い年は順に破棄される。
+
+    :param year : 対象の年
+    :return     : 年間カレンダー
+    """
+    return YearCalendar(year)
+
+def day_flags(day: date) -> int:
+    """
+    指定日のフラグ
+
+    :param day : 対象の日付
+    :return    : 日ごとのフラグ
+    """
+    return year_calendar(day.year).flags(day)
+
+def is_holiday(day: date) -> bool:
+    """
+    祝日判定
+
+    :param day : 対象の日付
+    :return    : 祝日判定の結果
+    """
+    return bool(day_flags(day) & HOLIDAY)
+
+def is_business_day(day: date) -> bool:
+    """
+    営業日判定
+
+    :param day : 対象の日付
+    :return    : 平日かつ祝日でないかの判定結果
+    """
+    return bool(day_flags(day) & BUSINESS_DAY)
+
+def is_last_friday(day: date) -> bool:
+    """
+    月末金曜日判定
+
+    :param day : 対象の日付
+    :return    : 月末金曜日判定の結果
+    """
+    return bool(day_flags(day) & LAST_FRIDAY)
+
+def is_reception_possible(posted_datetime: datetime) -> bool:
+    """
+    ランチミーティング受付可能時間帯の判定
+
+    :param posted_datetime : 対象の日時
+    :return                : 祝日でない水曜日の 11:00～13:00 かの判定結果
+    """
+    if not day_flags(posted_datetime.date()) & LUNCH_DAY:
+        return False
+
+    return RECEPTION_START_HOUR <= posted_datetime.hour < RECEPTION_END_HOUR
+
+def warm_up(today: Optional[date] = None):
+    """
+    カレンダーの事前構築
+
+    起動時に今年分を構築しておき、最初の参照で待たないようにする。
+
+    :param today : 基準日 (省略時は実行日)
+    """
+    today = today or date.today()
+    year_calendar(today.year)
@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+from string import Formatter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import database
+import metrics
+from keyword_matcher import KeywordMatcher
+
+logger = logging.getLogger(__name__)
+
+
+def template_fields(template: str) -> set:
+    """
+    テンプレートに埋め込む値の名前
+
+    :param template : format() 形式のテンプレート
+    :return         : 埋め込む値の名前の集合
+    """
+    fields = set()
+    for _, field_name, _, _ in Formatter().parse(template):
+        if field_name is None:
+            continue
+        if not field_name or field_name[0].isdigit():
+            raise ValueError('位置指定の {} は使えません')
+        fields.add(field_name.split('.')[0].split('[')[0])
+    return fields
+
+
+class Catalogue:
+    """
+    キーワードとメッセージのカタログ
+
+    keyword_list と message_template テーブルの内容をプロセスごとに保持する。
+    テーブルが更新されるとトリガーで catalogue_version が進み、
+    各プロセスは check_interval 秒に一度だけバージョンを確認して読み込み直す。
+    メッセージごとにはデータベースを参照しない。
+    """
+
+    def __init__(self, db_file: str, busy_timeout: int,
+                 priority: Sequence[str], defaults: Dict[str, str],
+                 check_interval: float = 1.0, trace: bool = False):
+        """
+        :param db_file        : データベースファイル
+        :param busy_timeout   : ロック解放を待つ最大時間(ミリ秒)
+        :param priority       : キーワードカテゴリの優先順位 (先頭ほど優先)
+        :param defaults       : メッセージ名と既定のテンプレート
+        :param check_interval : 更新を確認する間隔(秒)
+        :param trace          : 実行した SQL 文の数を数えるか
+        """
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.priority = tuple(priority)
+        self.defaults = dict(defaults)
+        self.check_interval = check_interval
+        self.trace = trace
+        # メッセージごとに埋め込める値の名前 (既定のテンプレートから決める)
+        self.fields = {name: template_fields(template)
+                       for name, template in self.defaults.items()}
+
+        self._matcher = None
+        self._templates = {}
+        self._formatters = {}
+        self._version = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        return database.connection(self.db_file, self.busy_timeout,
+                                   self.trace)
+
+    def compile(self, name: str, template: str) -> Callable[[dict], str]:
+        """
+        テンプレートの検証と変換
+
+        :param name     : メッセージ名
+        :param template : format() 形式のテンプレート
+        :return         : 値の辞書からメッセージを作る関数
+        """
+        if name not in self.defaults:
+            raise ValueError(f'{name} というメッセージはありません')
+
+        unknown = template_fields(template) - self.fields[name]
+        if unknown:
+            fields = '、'.join('{' + field + '}' for field in sorted(unknown))
+            raise ValueError(f'{name} では {fields} は使えません')
+        return template.format_map
+
+    def _refresh(self):
+        """
+        カタログの更新確認
+
+        前回の確認から check_interval 秒以上経っていればバージョンを確認し、
+        更新されていればキーワード照合器とテンプレートを作り直す。
+        """
+        if time.monotonic() - self._checked < self.check_interval:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked < self.check_interval:
+                return
+
+            c = self._connection().cursor()
+            c.execute('SELECT version FROM catalogue_version')
+            version = c.fetchall()[0][0]
+            if version != self._version:
+                with metrics.stage('catalogue_load'):
+                    c.execute('SELECT category, keyword FROM keyword_list')
+                    keyword_list = c.fetchall()
+                    c.execute('SELECT name, template FROM message_template')
+                    overrides = c.fetchall()
+                    self._load(keyword_list, overrides)
+                self._version = version
+            self._checked = now
+
+    def _load(self, keyword_list: Iterable[Tuple[str, str]],
+              overrides: Iterable[Tuple[str, str]]):
+        templates = dict(self.defaults)
+        formatters = {name: template.format_map
+                      for name, template in templates.items()}
+        for name, template in overrides:
+            try:
+                formatters[name] = self.compile(name, template)
+            except ValueError as e:
+                logger.error('ignored message template %s: %s', name, e)
+                continue
+            templates[name] = template
+
+        self._matcher = KeywordMatcher(keyword_list, self.priority)
+        self._templates = templates
+        self._formatters = formatters
+
+    def invalidate(self):
+        """ 次の参照時に更新を確認させる """
+        self._checked = float('-inf')
+
+    def matcher(self) -> KeywordMatcher:
+        """
+        キーワード照合器の取得
+
+        :return : キーワード照合器
+        """
+        self._refresh()
+        return self._matcher
+
+    def render(self, name: str, **values) -> str:
+        """
+        メッセージの作成
+
+        :param name   : メッセージ名
+        :param values : テンプレートに埋め込む値
+        :return       : メッセージ
+        """
+        self._refresh()
+        return self._formatters[name](values)
+
+    def formatter(self, name: str) -> Callable[[dict], str]:
+        """
+        メッセージを作る関数の取得
+
+        同じメッセージを繰り返し作る場合に、更新の確認を一度で済ませる。
+
+        :param name : メッセージ名
+        :return     : 値の辞書からメッセージを作る関数
+        """
+        self._refresh()
+        return self._formatters[name]
+
+    def template(self, name: str) -> Optional[str]:
+        """
+        現在のテンプレート
+
+        :param name : メッセージ名
+        :return     : テンプレート (存在しなければ None)
+        """
+        self._refresh()
+        return self._templates.get(name)
+
+    def names(self) -> List[str]:
+        """ メッセージ名の一覧 """
+        return sorted(self.defaults)
+
+    def add_keyword(self, category: str, keyword: str):
+        """
+        キーワードの登録
+
+        登録済みのキーワードであればカテゴリを変更する。
+
+        :param category : カテゴリ
+        :param keyword  : キーワード
+        """
+        if category not in self.priority:
+            raise ValueError(f'{category} というカテゴリはありません')
+
+        self._connection().execute(
+            'INSERT INTO keyword_list(category, keyword) VALUES(?, ?) '
+            'ON CONFLICT(keyword) DO UPDATE SET category = excluded.category',
+            (category, keyword)
+        )
+        self.invalidate()
+
+    def remove_keyword(self, keyword: str) -> bool:
+        """
+        キーワードの削除
+
+        :param keyword : キーワード
+        :return        : 削除したかどうか
+        """
+        c = self._connection().cursor()
+        c.execute('DELETE FROM keyword_list WHERE keyword = ?', (keyword,))
+        self.invalidate()
+        return c.rowcount > 0
+
+    def set_message(self, name: str, template: str):
+        """
+        メッセージの変更
+
+        :param name     : メッセージ名
+        :param template : format() 形式のテンプレート
+        """
+        self.compile(name, template)
+        self._connection().execute(
+            'INSERT INTO message_template(name, template) VALUES(?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET template = excluded.template',
+            (name, template)
+        )
+        self.invalidate()
+
+    def reset_message(self, name: str) -> bool:
+        """
+        メッセージを既定に戻す
+
+        :param name : メッセージ名
+        :return     : 変更されていたかどうか
+        """
+        c = self._connection().cursor()
+        c.execute('DELETE FROM message_template WHERE name = ?', (name,))
+        self.invalidate()
+        return c.rowcount > 0
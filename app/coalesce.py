@@ -0,0 +1,102 @@
+import logging
+import threading
+from typing import Any, Callable, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Batch:
+    """ 一つの返信を共有する要求のまとまり """
+
+    def __init__(self, requester: str):
+        """
+        :param requester : 最初の要求のユーザ名
+        """
+        self.requesters = [requester]
+        self.reply = None
+        self.timer: Optional[threading.Timer] = None
+
+
+class Coalescer:
+    """
+    読み取り専用のコマンドの相乗り
+
+    同じキー(チャンネル・コマンド・参加者の版など)の要求が window 秒の間に
+    続いた場合、最初の要求で一度だけ返信を作り、その間に届いた要求の
+    ユーザ名を集めて window 秒後に一つの返信として届ける。
+    要求の数に関わらず、返信の作成と投稿は window ごとに一回で済む。
+    """
+
+    def __init__(self, window: float,
+                 deliver: Callable[[Hashable, List[str], Any], Any]):
+        """
+        :param window  : 要求をまとめる時間(秒)
+        :param deliver : まとめた返信を届ける関数 (キー, ユーザ名, 返信)
+        """
+        self.window = window
+        self.deliver = deliver
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, requester: str,
+               compute: Callable[[], Any]) -> bool:
+        """
+        要求の登録
+
+        同じキーのまとまりがあればユーザ名を加えるだけで戻る。
+        なければ compute() で返信を作り、window 秒後に届ける。
+
+        :param key       : 同じ返信を共有できる要求のキー
+        :param requester : 要求したユーザ名
+        :param compute   : 返信を作る関数
+        :return          : 先行する要求の返信に相乗りしたか
+        """
+        with self._lock:
+            batch = self._batches.get(key)
+            if batch is not None:
+                if requester not in batch.requesters:
+                    batch.requesters.append(requester)
+                return True
+            batch = self._batches[key] = Batch(requester)
+
+        try:
+            batch.reply = compute()
+        except BaseException:
+            # 相乗りした要求には返信できないため記録を残す
+            with self._lock:
+                del self._batches[key]
+            if len(batch.requesters) > 1:
+                logger.error('dropped coalesced requests from %s',
+                             ', '.join(batch.requesters[1:]))
+            raise
+
+        batch.timer = threading.Timer(self.window, self._close, (key, batch))
+        batch.timer.daemon = True
+        batch.timer.start()
+        return False
+
+    def _close(self, key: Hashable, batch: Batch):
+        """ まとまりを閉じて返信を届ける """
+        with self._lock:
+            if self._batches.get(key) is not batch:
+                return
+            del self._batches[key]
+            requesters = list(batch.requesters)
+
+        try:
+            self.deliver(key, requesters, batch.reply)
+        except Exception:
+            logger.exception('failed to deliver a coalesced reply')
+
+    def flush(self):
+        """
+        待機中のまとまりの返信
+
+        プロセス終了時に、window 秒を待たずに全ての返信を届ける。
+        """
+        with self._lock:
+            batches = [(key, batch) for key, batch in self._batches.items()
+                       if batch.timer is not None]
+        for key, batch in batches:
+            batch.timer.cancel()
+            self._close(key, batch)
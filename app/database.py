@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Tuple
+
+import metrics
+
+# 接続ごとにキャッシュするプリペアドステートメントの数
+CACHED_STATEMENTS = 128
+
+# 接続ごとに登録する SQL 関数 (関数名: (引数の数, 関数))
+functions: Dict[str, Tuple[int, Callable]] = {}
+
+# 接続はプロセス・スレッドごとに保持する
+_local = threading.local()
+
+def register_functions(conn: sqlite3.Connection):
+    """
+    SQL 関数の登録
+
+    トリガーから呼ぶ関数は、書き込む全ての接続に登録する。
+
+    :param conn : データベース接続
+    """
+    for name, (num_params, func) in functions.items():
+        conn.create_function(name, num_params, func)
+
+def connection(db_file: str, busy_timeout: int = 5000,
+               trace: bool = False,
+               journal_mode: str = 'WAL') -> sqlite3.Connection:
+    """
+    データベース接続の取得
+
+    プロセス・スレッドごとに一つの接続を使い回す。
+    fork 後の子プロセスでは親プロセスの接続を使わず、新たに接続する。
+    接続は自動コミットモードとし、更新は transaction() で明示的に囲む。
+    WAL は共有メモリを使うため、複数のホストから共有するファイルは
+    journal_mode を DELETE (ロールバックジャーナル) にして開く。
+
+    :param db_file      : データベースファイル
+    :param busy_timeout : ロック解放を待つ最大時間(ミリ秒)
+    :param trace        : 実行した SQL 文の数を数えるか
+    :param journal_mode : ジャーナルモード (最初に接続した時の値を使う)
+    :return             : データベース接続
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.pid = pid
+        _local.connections = {}
+
+    conn = _local.connections.get(db_file)
+    if conn is None:
+        conn = sqlite3.connect(
+            db_file,
+            timeout = busy_timeout / 1000,
+            isolation_level = None,
+            cached_statements = CACHED_STATEMENTS,
+        )
+        conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout)}')
+        conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+        if journal_mode.upper() == 'WAL':
+            conn.execute('PRAGMA synchronous = NORMAL')
+        register_functions(conn)
+        if trace:
+            conn.set_trace_callback(count_statement)
+        _local.connections[db_file] = conn
+
+    return conn
+
+def count_statement(statement: str):
+    """
+    実行した SQL 文の計測
+
+    :param statement : 実行した SQL 文
+    """
+    metrics.inc('hirumibot_db_statements_total')
+
+@contextmanager
+def transaction(db_file: str, busy_timeout: int = 5000,
+                immediate: bool = True, trace: bool = False,
+                journal_mode: str = 'WAL') -> Iterator[sqlite3.Cursor]:
+    """
+    トランザクション
+
+    ブロック内の処理を一つのトランザクションとして実行する。
+    更新を伴う場合は開始時に書き込みロックを取得し、
+    ロックの昇格待ちによるデッドロックを避ける。
+
+    :param db_file      : データベースファイル
+    :param busy_timeout : ロック解放を待つ最大時間(ミリ秒)
+    :param immediate    : 開始時に書き込みロックを取得するか
+    :param trace        : 実行した SQL 文の数を数えるか
+    :param journal_mode : ジャーナルモード
+    :return             : カーソル
+    """
+    conn = connection(db_file, busy_timeout, trace, journal_mode)
+    c = conn.cursor()
+    c.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield c
+    except BaseException:
+        c.execute('ROLLBACK')
+        raise
+    else:
+        c.execute('COMMIT')
+    finally:
+        c.close()
+
+def close_all():
+    """
+    データベース接続の切断
+
+    現在のスレッドが保持している接続を全て閉じる。
+    """
+    # fork 前の親プロセスの接続には触れない
+    if getattr(_local, 'pid', None) == os.getpid():
+        for conn in _local.connections.values():
+            conn.close()
+    _local.connections = {}
@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+import business_calendar
+import hirumibot
+import metrics
+from outbound import retry_delay
+from outbound_async import AsyncOutboundQueue
+
+logger = logging.getLogger(__name__)
+
+# Mattermost の API のベース URL (投稿 API の URL から求める)
+API_BASE_URL = hirumibot.MM_API_ADDRESS.rsplit('/posts', 1)[0]
+
+# イベントストリームの URL (省略時は API のベース URL から求める)
+WEBSOCKET_URL = hirumibot.config.get('websocket', 'URL', fallback=None)
+# 接続が生きているか確認する間隔(秒)
+HEARTBEAT     = hirumibot.config.getfloat('websocket', 'HEARTBEAT',
+                                          fallback=30)
+# 再接続の間隔(秒)
+RECONNECT_BACKOFF     = hirumibot.config.getfloat(
+    'websocket', 'RECONNECT_BACKOFF', fallback=1
+)
+RECONNECT_BACKOFF_MAX = hirumibot.config.getfloat(
+    'websocket', 'RECONNECT_BACKOFF_MAX', fallback=30
+)
+# データベース処理を行うスレッド数
+DB_THREADS    = hirumibot.config.getint('websocket', 'DB_THREADS', fallback=8)
+
+
+def websocket_url(api_base_url: str) -> str:
+    """
+    イベントストリームの URL
+
+    :param api_base_url : API のベース URL (http://<ホスト>/api/v4)
+    :return             : ws://<ホスト>/api/v4/websocket
+    """
+    scheme, netloc, path, _, _ = urlsplit(api_base_url)
+    scheme = 'wss' if scheme == 'https' else 'ws'
+    return urlunsplit((scheme, netloc, path.rstrip('/') + '/websocket',
+                       '', ''))
+
+def posted_payload(data: dict) -> dict:
+    """
+    posted イベントの変換
+
+    イベントの内容を Outgoing Webhook と同じ形式のペイロードにする。
+
+    :param data : posted イベントの data
+    :return     : Outgoing Webhook 形式のペイロード
+    """
+    post = json.loads(data['post'])
+    return {
+        'channel_id': post['channel_id'],
+        'channel_name': data.get('channel_name', ''),
+        'timestamp': post.get('create_at'),
+        'user_id': post['user_id'],
+        'user_name': data.get('sender_name', '').lstrip('@'),
+        'post_id': post['id'],
+        'text': post['message'],
+    }
+
+
+class EventStream:
+    """
+    Mattermost のイベントストリームの購読
+
+    /api/v4/websocket に一つの接続を張り続け、
+    Botアカウント宛てのメンション(またはダイレクトメッセージ)の
+    posted イベントを handler に渡す。
+    切断された場合は指数バックオフで再接続し、接続ID と次のシーケンス番号を
+    渡して、切断中に配信されるはずだったイベントから再開する。
+    """
+
+    def __init__(self, url: str, api_base_url: str, token: str,
+                 handler: Callable[[dict], Awaitable[None]],
+                 heartbeat: float = 30, backoff: float = 1,
+                 backoff_max: float = 30):
+        """
+        :param url          : イベントストリームの URL
+        :param api_base_url : API のベース URL
+        :param token        : Botアカウントのトークン
+        :param handler      : Outgoing Webhook 形式のペイロードを受け取る処理
+        :param heartbeat    : 接続が生きているか確認する間隔(秒)
+        :param backoff      : 再接続の間隔の初期値(秒)
+        :param backoff_max  : 再接続の間隔の上限(秒)
+        """
+        self.url = url
+        self.api_base_url = api_base_url
+        self.token = token
+        self.handler = handler
+        self.heartbeat = heartbeat
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+
+        self.bot_user_id = None
+        # 再開に使う接続IDと、次に届くはずのシーケンス番号
+        self.connection_id = None
+        self.next_seq = 0
+        self._tasks = set()
+        self._closed = asyncio.Event()
+
+    @property
+    def headers(self) -> dict:
+        return {'Authorization': 'Bearer ' + self.token}
+
+    def resume_url(self) -> str:
+        """ 再開のための接続ID とシーケンス番号を付けた URL """
+        if self.connection_id is None:
+            return self.url
+        return self.url + '?' + urlencode({
+            'connection_id': self.connection_id,
+            'sequence_number': self.next_seq,
+        })
+
+    async def run(self):
+        """ 停止するまで購読を続ける """
+        attempt = 0
+        async with aiohttp.ClientSession() as session:
+            while not self._closed.is_set():
+                try:
+                    if self.bot_user_id is None:
+                        await self._fetch_bot_user(session)
+                    if await self._listen(session):
+                        attempt = 0
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning('event stream disconnected: %s', e)
+                if self._closed.is_set():
+                    break
+
+                metrics.inc('hirumibot_event_stream_reconnects_total')
+                delay = retry_delay(attempt, self.backoff, self.backoff_max)
+                attempt += 1
+                try:
+                    await asyncio.wait_for(self._closed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def close(self):
+        """ 購読の停止 """
+        self._closed.set()
+
+    async def _fetch_bot_user(self, session: aiohttp.ClientSession):
+        """ Botアカウントのユーザ ID の取得 """
+        async with session.get(f'{self.api_base_url}/users/me',
+                               headers=self.headers) as response:
+            response.raise_for_status()
+            self.bot_user_id = (await response.json())['id']
+
+    async def _listen(self, session: aiohttp.ClientSession) -> bool:
+        """
+        一回の接続での購読
+
+        :return : イベントを受信できたかどうか
+        """
+        received = False
+        async with session.ws_connect(self.resume_url(), headers=self.headers,
+                                      heartbeat=self.heartbeat) as ws:
+            closed = asyncio.create_task(self._closed.wait())
+            try:
+                while True:
+                    receive = asyncio.create_task(ws.receive())
+                    await asyncio.wait({receive, closed},
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    if not receive.done():
+                        receive.cancel()
+                        return received
+
+                    message = receive.result()
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        return received
+                    received = True
+                    # 壊れたイベントは一つずつ読み飛ばし、購読を続ける
+                    try:
+                        self._receive(json.loads(message.data))
+                    except (ValueError, KeyError, TypeError,
+                            AttributeError) as e:
+                        metrics.inc(
+                            'hirumibot_event_stream_malformed_events_total'
+                        )
+                        logger.warning('ignored a malformed event: %r', e)
+            finally:
+                closed.cancel()
+
+    def _receive(self, event: dict):
+        """
+        イベントの受信
+
+        シーケンス番号を確認し、届かなかったイベントがあれば数える。
+        """
+        # クライアントからの要求への応答はシーケンス番号を持たない
+        if 'event' not in event:
+            return
+
+        if event['event'] == 'hello':
+            connection_id = event['data'].get('connection_id')
+            if connection_id != self.connection_id:
+                # 初回の接続か、再開できず新しい接続になった
+                # (後者の場合、切断中のイベントは届かない)
+                metrics.inc('hirumibot_event_stream_connects_total',
+                            result='new')
+                self.connection_id = connection_id
+                self.next_seq = event.get('seq', 0) + 1
+            else:
+                metrics.inc('hirumibot_event_stream_connects_total',
+                            result='resumed')
+            return
+
+        seq = event.get('seq')
+        if seq is not None:
+            if seq < self.next_seq:
+                # 再開時に重複して届いたイベント
+                return
+            if seq > self.next_seq:
+                metrics.inc('hirumibot_event_stream_missed_events_total',
+                            seq - self.next_seq)
+                logger.warning('missed %s events before seq %s',
+                               seq - self.next_seq, seq)
+            self.next_seq = seq + 1
+
+        if event['event'] != 'posted':
+            return
+
+        payload = self._mentioned(event['data'])
+        if payload is None:
+            return
+
+        metrics.inc('hirumibot_event_stream_posts_total')
+        task = asyncio.create_task(self.handler(payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _mentioned(self, data: dict) -> Optional[dict]:
+        """
+        Botアカウント宛ての投稿の判定
+
+        :param data : posted イベントの data
+        :return     : Botアカウント宛てであればペイロード、そうでなければ None
+        """
+        payload = posted_payload(data)
+        if payload['user_id'] == self.bot_user_id:
+            return None
+
+        mentions = json.loads(data.get('mentions') or '[]')
+        if (self.bot_user_id not in mentions
+                and data.get('channel_type') != 'D'):
+            return None
+        return payload
+
+
+class ChannelDispatcher:
+    """
+    コマンドの実行
+
+    Webhook と同じ hirumibot.webhook_reply() でコマンドを処理し、
+    返信は REST API で投稿する。SQLite への読み書きはスレッドで行い、
+    同じチャンネルのコマンドは届いた順に一つずつ処理する。
+    """
+
+    def __init__(self, executor: ThreadPoolExecutor):
+        """
+        :param executor : データベース処理を行うスレッドプール
+        """
+        self.executor = executor
+        self._locks = {}
+
+    async def __call__(self, payload: dict):
+        channel_id = payload['channel_id']
+        lock = self._locks.setdefault(channel_id, asyncio.Lock())
+        loop = asyncio.get_running_loop()
+        try:
+            async with lock:
+                with metrics.stage('event'):
+                    await loop.run_in_executor(
+                        self.executor, hirumibot.webhook_reply, payload, 'api'
+                    )
+        except Exception:
+            logger.exception('failed to handle post %s', payload['post_id'])
+
+
+async def serve():
+    """ イベントストリームを購読して、コマンドを処理する """
+    hirumibot.init_database()
+    business_calendar.warm_up()
+
+    outbound_queue = AsyncOutboundQueue(**hirumibot.OUTBOUND_SETTINGS)
+    await outbound_queue.start()
+    hirumibot.outbound_queue = outbound_queue
+
+    executor = ThreadPoolExecutor(DB_THREADS,
+                                  thread_name_prefix='hirumibot-db')
+    stream = EventStream(
+        WEBSOCKET_URL or websocket_url(API_BASE_URL), API_BASE_URL,
+        hirumibot.HIRUMIBOT_TOKEN, ChannelDispatcher(executor),
+        heartbeat = HEARTBEAT,
+        backoff = RECONNECT_BACKOFF,
+        backoff_max = RECONNECT_BACKOFF_MAX,
+    )
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stream.close)
+
+    try:
+        await stream.run()
+    finally:
+        await outbound_queue.close(hirumibot.OUTBOUND_FLUSH_TIMEOUT)
+        executor.shutdown()
+
+def main():
+    """ イベントストリームの購読プロセスとして起動 """
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main()
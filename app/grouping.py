@@ -0,0 +1,190 @@
+import random
+from collections import defaultdict
+from math import ceil
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 過去に同じ班になった回数 ((ユーザ名, ユーザ名) -> 回数)
+PairHistory = Dict[Tuple[str, str], float]
+
+
+def pair_key(user_a: str, user_b: str) -> Tuple[str, str]:
+    """
+    ペアのキー
+
+    :param user_a : ユーザ名
+    :param user_b : ユーザ名
+    :return       : 順序を揃えたユーザ名の組
+    """
+    return (user_a, user_b) if user_a < user_b else (user_b, user_a)
+
+def group_sizes(member_num: int, min_num: int, max_num: int) -> List[int]:
+    """
+    班ごとの人数
+
+    班の数をできるだけ少なくし、班ごとの人数の差が1人以内となるよう分ける。
+    最小人数を満たす分け方が無い場合(参加者が最小人数に満たない場合など)も、
+    最大人数は超えない。
+
+    :param member_num : 参加者の数
+    :param min_num    : 一班の最小人数
+    :param max_num    : 一班の最大人数
+    :return           : 班ごとの人数
+    """
+    if not 1 <= min_num <= max_num:
+        raise ValueError(f'invalid group size: {min_num}-{max_num}')
+    if member_num <= 0:
+        return []
+
+    group_num = ceil(member_num / max_num)
+    base, extra = divmod(member_num, group_num)
+    return [base + 1] * extra + [base] * (group_num - extra)
+
+def partition(members: Sequence[str], min_num: int, max_num: int,
+              history: Optional[PairHistory] = None,
+              iterations: Optional[int] = None,
+              rng: Optional[random.Random] = None) -> List[List[str]]:
+    """
+    班分け
+
+    参加者をランダムに班分けした後、過去に同じ班になったペアが
+    なるべく同じ班にならないよう、参加者の入れ替えで改善する。
+
+    班ごとの「過去に同じ班になった回数」の合計を各参加者について保持し、
+    入れ替えの評価とその反映を、過去に同じ班になった相手の数だけの
+    計算量で行う。
+
+    :param members    : 参加者のユーザ名
+    :param min_num    : 一班の最小人数
+    :param max_num    : 一班の最大人数
+    :param history    : 過去に同じ班になった回数
+    :param iterations : 入れ替えを試す回数の上限 (省略時は参加者数の20倍)
+    :param rng        : 乱数生成器
+    :return           : 班ごとの参加者のユーザ名
+    """
+    rng = rng or random.Random()
+    members = list(dict.fromkeys(members))
+    rng.shuffle(members)
+
+    sizes = group_sizes(len(members), min_num, max_num)
+    group_of = []
+    for group_idx, size in enumerate(sizes):
+        group_of.extend([group_idx] * size)
+
+    if not history or len(sizes) < 2:
+        return _groups(members, group_of, len(sizes))
+
+    # 過去に同じ班になった相手 (疎な隣接リスト)
+    index = {username: idx for idx, username in enumerate(members)}
+    neighbors = defaultdict(dict)
+    for (user_a, user_b), weight in history.items():
+        idx_a = index.get(user_a)
+        idx_b = index.get(user_b)
+        if idx_a is None or idx_b is None or idx_a == idx_b or weight <= 0:
+            continue
+        neighbors[idx_a][idx_b] = weight
+        neighbors[idx_b][idx_a] = weight
+
+    # conflict[i][g] : 参加者 i と班 g のメンバーが過去に同じ班になった回数の合計
+    conflict = defaultdict(lambda: defaultdict(float))
+    for idx_a, adjacent in neighbors.items():
+        for idx_b, weight in adjacent.items():
+            conflict[idx_a][group_of[idx_b]] += weight
+
+    members_of = [[] for _ in sizes]
+    for idx, group_idx in enumerate(group_of):
+        members_of[group_idx].append(idx)
+
+    def move(idx: int, src: int, dst: int):
+        group_of[idx] = dst
+        for other, weight in neighbors[idx].items():
+            conflict[other][src] -= weight
+            conflict[other][dst] += weight
+
+    if iterations is None:
+        iterations = 20 * len(members)
+
+    # 同じ班に過去のペアがいる参加者を、他の班の参加者と入れ替えてみる
+    candidates = [idx for idx in neighbors if conflict[idx][group_of[idx]] > 0]
+    tries = 0
+    while candidates and tries < iterations:
+        pos_a = rng.randrange(len(candidates))
+        candidates[pos_a], candidates[-1] = candidates[-1], candidates[pos_a]
+        idx_a = candidates.pop()
+        group_a = group_of[idx_a]
+        cost_a = conflict[idx_a][group_a]
+        if cost_a <= 0:
+            continue
+
+        best_delta = 0
+        best = None
+        for _ in range(min(8, len(sizes) - 1)):
+            tries += 1
+            group_b = rng.randrange(len(sizes) - 1)
+            if group_b >= group_a:
+                group_b += 1
+            pos_b = rng.randrange(len(members_of[group_b]))
+            idx_b = members_of[group_b][pos_b]
+
+            weight_ab = neighbors[idx_a].get(idx_b, 0)
+            delta = (
+                conflict[idx_a][group_b] - weight_ab
+                + conflict[idx_b][group_a] - weight_ab
+                - cost_a
+                - conflict[idx_b][group_b]
+            )
+            if delta < best_delta:
+                best_delta = delta
+                best = (idx_b, group_b, pos_b)
+
+        if best is None:
+            continue
+
+        idx_b, group_b, pos_b = best
+        members_of[group_a][members_of[group_a].index(idx_a)] = idx_b
+        members_of[group_b][pos_b] = idx_a
+        move(idx_a, group_a, group_b)
+        move(idx_b, group_b, group_a)
+
+        # まだ過去のペアが残っていれば、再び入れ替えの候補にする
+        for idx in (idx_a, idx_b):
+            if conflict[idx][group_of[idx]] > 0:
+                candidates.append(idx)
+
+    return _groups(members, group_of, len(sizes))
+
+def _groups(members: List[str], group_of: List[int],
+            group_num: int) -> List[List[str]]:
+    groups = [[] for _ in range(group_num)]
+    for username, group_idx in zip(members, group_of):
+        groups[group_idx].append(username)
+    return groups
+
+def repeat_pairs(groups: Sequence[Sequence[str]],
+                 history: PairHistory) -> float:
+    """
+    過去に同じ班になったペアの評価
+
+    :param groups  : 班ごとの参加者のユーザ名
+    :param history : 過去に同じ班になった回数
+    :return        : 同じ班の全ペアについての、過去に同じ班になった回数の合計
+    """
+    total = 0
+    for group in groups:
+        for pos, user_a in enumerate(group):
+            for user_b in group[pos + 1:]:
+                total += history.get(pair_key(user_a, user_b), 0)
+    return total
+
+def group_pairs(groups: Sequence[Sequence[str]]) -> List[Tuple[str, str]]:
+    """
+    同じ班になったペアの一覧
+
+    :param groups : 班ごとの参加者のユーザ名
+    :return       : 同じ班になったユーザ名の組
+    """
+    pairs = []
+    for group in groups:
+        for pos, user_a in enumerate(group):
+            for user_b in group[pos + 1:]:
+                pairs.append(pair_key(user_a, user_b))
+    return pairs
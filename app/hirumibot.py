@@ -1,36 +1,610 @@
-import calendar
+import atexit
 import configparser
-import json
-import sqlite3
-from datetime import datetime, date
+import itertools
+import logging
+import os
+import re
+import tempfile
+import time
+import zlib
+from datetime import datetime, date, timedelta
 from pathlib import Path
-from random import shuffle
-
-import jpholiday
-import requests
+from typing import (Callable, Dict, Iterable, List, Optional, Sequence, Set,
+                    Union)
+
+import business_calendar
+import database
+import grouping
+import metrics
+from broadcast import Broadcaster, BroadcastResult
+from catalogue import Catalogue
+from coalesce import Coalescer
+from keyword_matcher import KeywordMatcher
+from outbound import OutboundQueue
+from paginate import POST_MAX_LENGTH, split_posts
+from recorder import PayloadRecorder
+from reply_cache import ReplyCache
+from session_state import SessionState
+
+logger = logging.getLogger(__name__)
 
 p = Path(__file__)
 CONFIG_DIR = p.resolve().parent.parent / 'config'
+SETTING_FILE = os.environ.get('HIRUMIBOT_SETTING', CONFIG_DIR / 'setting.ini')
 
 config = configparser.ConfigParser()
-config.read(CONFIG_DIR / 'setting.ini')
+config.read(SETTING_FILE)
 
 MM_API_ADDRESS   = config['Mattermost']['MM_API_ADDRESS']
 CHANNEL_ID_ALL   = config['Mattermost']['CHANNEL_ID_ALL']
 CHANNEL_ID_LUNCH = config['Mattermost']['CHANNEL_ID_LUNCH']
 HIRUMIBOT_TOKEN  = config['Mattermost']['HIRUMIBOT_TOKEN']
+BOT_USERNAME     = config['Mattermost'].get('BOT_USERNAME', 'hirumibot')
 HIRUMIBOT_DB     = config['hirumibot']['DATABASE_FILE']
+DB_BUSY_TIMEOUT  = config['hirumibot'].getint('DATABASE_BUSY_TIMEOUT', 5000)
+DB_TRACE         = config['hirumibot'].getboolean('DATABASE_TRACE', False)
+REPLY_MODE       = config['hirumibot'].get('REPLY_MODE', 'response')
+# 参加者の状態をチャンネルごとに振り分けるデータベースファイルの数
+SESSION_SHARDS   = config['hirumibot'].getint('SESSION_SHARDS', 1)
+# 定期通知のリースと実行記録のデータベースファイル
+# 複数のホストで共有する場合は WAL にできないため、ロールバックジャーナルで開く
+LEADER_DB        = config.get('leader', 'DATABASE_FILE', fallback='')
+LEADER_SHARED    = bool(LEADER_DB)
+LEADER_DB        = LEADER_DB or HIRUMIBOT_DB
+LEADER_JOURNAL_MODE = 'DELETE' if LEADER_SHARED else 'WAL'
+# キーワードとメッセージを変更できるユーザ名 (カンマ区切り)
+ADMIN_USERS      = {user.strip() for user in
+                    config['hirumibot'].get('ADMIN_USERS', '').split(',')
+                    if user.strip()}
+
+# 一つの投稿の最大文字数 (Mattermost の MaxPostSize)
+# 超える返信は班の区切りで複数の投稿に分ける
+POST_MAX_LENGTH  = config['hirumibot'].getint('POST_MAX_LENGTH',
+                                              POST_MAX_LENGTH)
+
+# 人数確認・ヘルプの要求をまとめる時間(秒)
+# この間に同じチャンネルから届いた要求には、全員宛ての一つの返信で答える
+# (0 ならまとめない)
+COALESCE_WINDOW  = config.getfloat('coalesce', 'WINDOW', fallback=0)
+
+# 現在時刻を返す関数 (記録した Webhook の再生時は元の受信時刻に固定する)
+clock: Callable[[], datetime] = datetime.now
+
+# 班分けの設定
+# 参加者が SINGLE_GROUP_MAX 名以下なら一班、それより多ければ
+# 一班 MEMBER_MIN_NUM～MEMBER_MAX_NUM 名で班分けする
+MEMBER_MIN_NUM   = config.getint('grouping', 'MEMBER_MIN_NUM', fallback=3)
+MEMBER_MAX_NUM   = config.getint('grouping', 'MEMBER_MAX_NUM', fallback=4)
+SINGLE_GROUP_MAX = config.getint('grouping', 'SINGLE_GROUP_MAX', fallback=6)
+
+# 祝日の計算結果を保存し、次回の起動を速くする
+business_calendar.configure(
+    config.get('hirumibot', 'CALENDAR_CACHE', fallback=None)
+)
+
+# 処理時間の計測
+# 書き出し先の既定値は設定ファイルごとに分け、
+# 一つのホストで動かす複数のBotの計測値を合算しないようにする
+SETTING_HASH = zlib.crc32(str(Path(SETTING_FILE).resolve()).encode())
+METRICS_DIRECTORY = config.get(
+    'metrics', 'DIRECTORY',
+    fallback = str(Path(tempfile.gettempdir())
+                   / f'hirumibot-metrics-{SETTING_HASH:08x}')
+)
+metrics.configure(
+    directory      = METRICS_DIRECTORY or None,
+    sample_rate    = config.getfloat('metrics', 'SAMPLE_RATE', fallback=1.0),
+    flush_interval = config.getfloat('metrics', 'FLUSH_INTERVAL', fallback=5),
+)
+
+# 投稿はキューに積み、ワーカスレッドから非同期に送信する
+OUTBOUND_SETTINGS = dict(
+    workers     = config.getint('outbound', 'WORKERS', fallback=4),
+    queue_size  = config.getint('outbound', 'QUEUE_SIZE', fallback=1000),
+    timeout     = config.getfloat('outbound', 'TIMEOUT', fallback=10),
+    max_retries = config.getint('outbound', 'MAX_RETRIES', fallback=5),
+    backoff     = config.getfloat('outbound', 'BACKOFF', fallback=0.5),
+    backoff_max = config.getfloat('outbound', 'BACKOFF_MAX', fallback=30),
+    rate        = config.getfloat('outbound', 'RATE', fallback=10),
+    burst       = config.getint('outbound', 'BURST', fallback=20),
+)
+OUTBOUND_FLUSH_TIMEOUT = config.getfloat('outbound', 'FLUSH_TIMEOUT',
+                                         fallback=10)
+outbound_queue = OutboundQueue(**OUTBOUND_SETTINGS)
+# プロセス終了時は送信待ちの投稿をできるだけ送り切る
+atexit.register(outbound_queue.join, OUTBOUND_FLUSH_TIMEOUT)
+
+# 通知は送信キューと同じ送信レートで、多数のチャンネルへ並行して配信する
+# 配信できなかったチャンネルには RETRY_INTERVAL 秒おきに RETRY_ROUNDS 回まで再送する
+broadcaster = Broadcaster(
+    outbound_queue,
+    concurrency    = config.getint('broadcast', 'CONCURRENCY', fallback=16),
+    retry_rounds   = config.getint('broadcast', 'RETRY_ROUNDS', fallback=3),
+    retry_interval = config.getfloat('broadcast', 'RETRY_INTERVAL',
+                                     fallback=5),
+)
+
+# 受信した Webhook のペイロードを記録する (性能の調査で再生するため)
+RECORD_FILE = config.get('hirumibot', 'RECORD_FILE', fallback=None)
+recorder = PayloadRecorder(RECORD_FILE) if RECORD_FILE else None
+
+# 再送された Webhook には最初の応答を返す
+reply_cache = ReplyCache(
+    HIRUMIBOT_DB, DB_BUSY_TIMEOUT,
+    ttl      = config.getfloat('idempotency', 'TTL', fallback=600),
+    capacity = config.getint('idempotency', 'CAPACITY', fallback=10000),
+    wait     = config.getfloat('idempotency', 'WAIT', fallback=5),
+    takeover = config.getfloat('idempotency', 'TAKEOVER', fallback=300),
+    trace    = DB_TRACE,
+)
+
+# キーワードカテゴリの優先順位 (先頭ほど優先)
+KEYWORD_PRIORITY = ('help', 'stats', 'count', 'cancel', 'entry', 'go',
+                    'reset')
+
+# メッセージ中のメンション (@ユーザ名)
+MENTION_PATTERN = re.compile(r'(?<![\w@])@([A-Za-z0-9][A-Za-z0-9._-]*)')
+
+# 返信・通知のメッセージの既定値 (format() 形式のテンプレート)
+# message_template テーブルに同じ名前で登録すると置き換えられる
+DEFAULT_MESSAGES = {
+    'help': (
+        "##### ひるみちゃんの使い方\n"
+        "ひるみちゃん(@hirumibot)宛に"
+        "キーワードを含む文章を投稿してください。\n"
+        "下記キーワード以外でも反応できることがあります。"
+        "いろいろ試してみてね！:wink:\n\n"
+        "| アクション | キーワード |\n"
+        "| :-------- | :-------- |\n"
+        "| 参加する | 参加、出席、entry |\n"
+        "| 参加を取り消す | キャンセル、欠席、cancle |\n"
+        "| まとめて参加・取り消し | 参加 @user1 @user2、キャンセル @user1 |\n"
+        "| 現在の参加人数を確認 | 人数は？、何人？、count |\n"
+        "| 参加メンバーのリセット | リセット、初期化、reset |\n"
+        "| 班分け＆出発 | 行くぞ、出発、go |\n"
+        "| 参加の記録を確認 | 統計、記録、stats |\n"
+        "| ヘルプを表示 | ヘルプ、使い方、help |"
+    ),
+    'outside_reception_hours': (
+        "現在はランチミーティングの受付時間外です:sweat:"
+    ),
+    'no_keywords': (
+        "キーワードがないので、何もできませんでした:dizzy_face:\n"
+        "ひるみちゃんに使い方を聞いてみてね！"
+    ),
+    'entry_accepted': (
+        "@{user} さんの参加を受け付けました！"
+        "わーい！:laughing::raised_hands:"
+    ),
+    'entry_duplicated': "@{user} さんはすでに参加表明済みだよ！:laughing:",
+    'cancel_accepted': (
+        "@{user} さんの参加を取り消したよ！"
+        "また今度参加してね！:cry:"
+    ),
+    'cancel_not_entered': "@{user} さんはまだ参加表明してないよ！:innocent:",
+    'bulk_added': "参加を受け付けたよ！({count}名) {users}\n",
+    'bulk_already_entered': "すでに参加表明済みだよ！({count}名) {users}\n",
+    'bulk_removed': "参加を取り消したよ！({count}名) {users}\n",
+    'bulk_not_entered': "まだ参加表明してないよ！({count}名) {users}\n",
+    'count_empty': "現在は参加予定者が一人もいません:disappointed_relieved:",
+    'count_header': (
+        "現在の参加予定者は{count}名です！:kissing_heart:\n"
+        "###### +++ 参加予定メンバー +++\n"
+    ),
+    'member': "@{user}\n",
+    'reset': "参加者をリセットしたよ！:expressionless:",
+    'depart_empty': "参加者が一人もいません:sweat:",
+    'depart_header': "はーい！参加メンバーはこちら！:smile:\n",
+    'depart_single_group': "###### +++ 参加メンバー +++\n",
+    'depart_group': "###### +++ {group_num}班 +++\n",
+    'stats_empty': "まだランチミーティングの記録がありません:sweat:",
+    'stats_header': "##### ランチミーティングの記録 :bar_chart:\n",
+    'stats_user': (
+        "@{user} さんの参加は{sessions}回、"
+        "連続参加は{current_streak}回 (最長{longest_streak}回) です！\n"
+    ),
+    'stats_new_user': "@{user} さんはまだ参加したことがないよ！\n",
+    'stats_partners': "よく同じ班になるメンバー: {partners}\n",
+    'stats_partner': "@{user} ({count}回)",
+    'stats_weeks_header': (
+        "\n| 週 | 開催 | 参加人数 |\n"
+        "| :-------- | --------: | --------: |\n"
+    ),
+    'stats_week': "| {week} | {sessions} | {attendees} |\n",
+    'morning_assembly': "朝ミの時間です！:clock930:",
+    'leaving_on_time': (
+        "18時です！:clock6:\n"
+        "残業申請をしていない人は帰りましょう！:running_man::dash:"
+    ),
+    'premium_friday': (
+        "本日はプレミアムフライデーです！:clock3:\n"
+        "早めに仕事を切り上げて、プレ金を満喫しましょう！:beers:"
+    ),
+    'lunch_meeting': (
+        "本日はランチミーティングの日です！:clock11:\n"
+        "参加する方はひるみちゃん(@hirumibot)宛に"
+        "メッセージを投稿してください！:smiley:"
+    ),
+    'lunch_time': "ランチの時間です！:clock12:",
+    'requesters': "{mentions}\n",
+}
+
+# キーワードとメッセージのカタログ
+# 各プロセスがメモリに保持し、更新は CATALOGUE_CHECK_INTERVAL 秒以内に反映する
+catalogue = Catalogue(
+    HIRUMIBOT_DB, DB_BUSY_TIMEOUT, KEYWORD_PRIORITY, DEFAULT_MESSAGES,
+    check_interval = config['hirumibot'].getfloat('CATALOGUE_CHECK_INTERVAL',
+                                                  1.0),
+    trace = DB_TRACE,
+)
+
+# テーブル定義の補完
+# キーワードリスト・メッセージテーブルが更新されるたびにバージョンを進める
+SCHEMA_QUERY = '''
+CREATE TABLE IF NOT EXISTS keyword_list(
+    category TEXT NOT NULL, keyword TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS message_template(
+    name TEXT NOT NULL PRIMARY KEY, template TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS notice_run(
+    name TEXT NOT NULL PRIMARY KEY, last_run TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS webhook_reply(
+    post_id TEXT NOT NULL PRIMARY KEY, reply TEXT, created REAL NOT NULL,
+    holder TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_reply_created ON webhook_reply(created);
+DROP TRIGGER IF EXISTS keyword_list_inserted;
+DROP TRIGGER IF EXISTS keyword_list_updated;
+DROP TRIGGER IF EXISTS keyword_list_deleted;
+DROP TABLE IF EXISTS keyword_list_version;
+CREATE TABLE IF NOT EXISTS catalogue_version(version INTEGER NOT NULL);
+INSERT INTO catalogue_version(version)
+    SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM catalogue_version);
+CREATE TRIGGER IF NOT EXISTS catalogue_keyword_inserted
+    AFTER INSERT ON keyword_list
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS catalogue_keyword_updated
+    AFTER UPDATE ON keyword_list
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS catalogue_keyword_deleted
+    AFTER DELETE ON keyword_list
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS catalogue_message_inserted
+    AFTER INSERT ON message_template
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS catalogue_message_updated
+    AFTER UPDATE ON message_template
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS catalogue_message_deleted
+    AFTER DELETE ON message_template
+    BEGIN UPDATE catalogue_version SET version = version + 1; END;
+INSERT OR IGNORE INTO keyword_list(category, keyword) VALUES
+    ('stats', 'stats'), ('stats', 'Stats'), ('stats', 'STATS'),
+    ('stats', '統計'), ('stats', '記録'), ('stats', '出席率'),
+    ('stats', '参加率');
+'''
+
+# 定期通知のリースと実行記録のテーブル定義 (LEADER_DB に作る)
+LEADER_SCHEMA_QUERY = '''
+CREATE TABLE IF NOT EXISTS notice_fired(
+    name TEXT NOT NULL,
+    scheduled TEXT NOT NULL,
+    holder TEXT NOT NULL,
+    fired REAL NOT NULL,
+    PRIMARY KEY(name, scheduled)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS leader_lease(
+    name TEXT NOT NULL PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL,
+    term INTEGER NOT NULL
+);
+'''
+
+# ランチミーティングの状態のテーブル定義
+# チャンネル・開催日ごとに参加者を持ち、各チャンネルの操作は
+# 自チャンネルの行だけを索引で参照する
+# roster_version は参加者の版で、どのプロセスが参加者を変更しても
+# トリガーで進める
+SESSION_SCHEMA_QUERY = '''
+CREATE TABLE IF NOT EXISTS lunch_participant(
+    channel_id TEXT NOT NULL,
+    session_date TEXT NOT NULL,
+    username TEXT NOT NULL,
+    UNIQUE(channel_id, session_date, username)
+);
+CREATE TABLE IF NOT EXISTS pair_history(
+    channel_id TEXT NOT NULL,
+    user_a TEXT NOT NULL,
+    user_b TEXT NOT NULL,
+    met_count INTEGER NOT NULL,
+    last_met TEXT NOT NULL,
+    PRIMARY KEY(channel_id, user_a, user_b)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pair_history_user_b
+    ON pair_history(channel_id, user_b, met_count);
+CREATE TABLE IF NOT EXISTS roster_version(
+    channel_id TEXT NOT NULL PRIMARY KEY,
+    version INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS roster_version_joined
+    AFTER INSERT ON lunch_participant
+    BEGIN
+        INSERT INTO roster_version(channel_id, version)
+        VALUES(NEW.channel_id, 1)
+        ON CONFLICT(channel_id) DO UPDATE SET version = version + 1;
+    END;
+CREATE TRIGGER IF NOT EXISTS roster_version_left
+    AFTER DELETE ON lunch_participant
+    BEGIN
+        INSERT INTO roster_version(channel_id, version)
+        VALUES(OLD.channel_id, 1)
+        ON CONFLICT(channel_id) DO UPDATE SET version = version + 1;
+    END;
+'''
+
+# 出席記録のテーブル定義
+# attendance_log は参加表明ごとの記録で、行は削除しない。
+# 参加者テーブルからの削除(取り消し・リセット)は、班分け前であれば
+# 取り消し時刻として記録する。
+# 統計は出発時に更新する集計テーブルから求め、記録全体は走査しない。
+# 記録の時刻は clock() に従うよう hirumibot_now() で求める。
+# (旧版の datetime('now') のトリガーは作り直す)
+ATTENDANCE_SCHEMA_QUERY = '''
+CREATE TABLE IF NOT EXISTS attendance_log(
+    channel_id TEXT NOT NULL,
+    session_date TEXT NOT NULL,
+    username TEXT NOT NULL,
+    joined_at TEXT NOT NULL,
+    cancelled_at TEXT,
+    group_num INTEGER
+);
+CREATE INDEX IF NOT EXISTS attendance_log_session
+    ON attendance_log(channel_id, session_date, username, cancelled_at);
+CREATE INDEX IF NOT EXISTS attendance_log_user
+    ON attendance_log(channel_id, username, session_date, group_num);
+BEGIN IMMEDIATE;
+DROP TRIGGER IF EXISTS lunch_participant_joined;
+DROP TRIGGER IF EXISTS lunch_participant_left;
+CREATE TRIGGER lunch_participant_joined
+    AFTER INSERT ON lunch_participant
+    BEGIN
+        INSERT INTO attendance_log(channel_id, session_date, username,
+                                   joined_at)
+        VALUES(NEW.channel_id, NEW.session_date, NEW.username,
+               hirumibot_now());
+    END;
+CREATE TRIGGER lunch_participant_left
+    AFTER DELETE ON lunch_participant
+    BEGIN
+        UPDATE attendance_log SET cancelled_at = hirumibot_now()
+        WHERE channel_id = OLD.channel_id
+          AND session_date = OLD.session_date
+          AND username = OLD.username
+          AND cancelled_at IS NULL
+          AND group_num IS NULL;
+    END;
+COMMIT;
+CREATE TABLE IF NOT EXISTS lunch_session(
+    channel_id TEXT NOT NULL,
+    session_date TEXT NOT NULL,
+    turnout INTEGER NOT NULL,
+    group_count INTEGER NOT NULL,
+    PRIMARY KEY(channel_id, session_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS attendance_streak(
+    channel_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    current_streak INTEGER NOT NULL,
+    longest_streak INTEGER NOT NULL,
+    last_session TEXT NOT NULL,
+    PRIMARY KEY(channel_id, username)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS weekly_turnout(
+    channel_id TEXT NOT NULL,
+    week TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    attendees INTEGER NOT NULL,
+    PRIMARY KEY(channel_id, week)
+) WITHOUT ROWID;
+'''
+
+# データベース系
+def db_connection():
+    """
+    データベース接続の取得
+
+    プロセス・スレッドごとに保持している接続を返す。
+
+    :return : データベース接続
+    """
+    return database.connection(HIRUMIBOT_DB, DB_BUSY_TIMEOUT, DB_TRACE)
+
+def leader_connection():
+    """
+    定期通知のリースと実行記録のデータベース接続の取得
+
+    :return : データベース接続
+    """
+    return database.connection(LEADER_DB, DB_BUSY_TIMEOUT, DB_TRACE,
+                               LEADER_JOURNAL_MODE)
+
+def db_transaction(immediate: bool = True):
+    """
+    トランザクションの開始
+
+    :param immediate : 開始時に書き込みロックを取得するか
+    :return          : カーソルを返すコンテキストマネージャ
+    """
+    return database.transaction(HIRUMIBOT_DB, DB_BUSY_TIMEOUT, immediate,
+                                DB_TRACE)
+
+def shard_db(shard: int) -> str:
+    """
+    振り分け先のデータベースファイル
+
+    :param shard : 振り分け先の番号
+    :return      : データベースファイル
+    """
+    if SESSION_SHARDS <= 1:
+        return HIRUMIBOT_DB
+
+    stem, suffix = os.path.splitext(HIRUMIBOT_DB)
+    return f'{stem}-shard{shard}{suffix}'
+
+def session_db(channel_id: str) -> str:
+    """
+    チャンネルの状態を保持するデータベースファイル
+
+    SESSION_SHARDS が2以上であれば、チャンネルIDのハッシュで
+    複数のデータベースファイルに振り分け、チャンネル間の書き込みロックの
+    競合を減らす。
+
+    :param channel_id : チャンネルID
+    :return           : データベースファイル
+    """
+    shard = zlib.crc32(channel_id.encode('utf-8')) % max(SESSION_SHARDS, 1)
+    return shard_db(shard)
+
+def session_connection(channel_id: str):
+    """
+    チャンネルの状態を保持するデータベースへの接続
+
+    :param channel_id : チャンネルID
+    :return           : データベース接続
+    """
+    return database.connection(session_db(channel_id), DB_BUSY_TIMEOUT,
+                               DB_TRACE)
+
+def session_transaction(channel_id: str, immediate: bool = True):
+    """
+    チャンネルの状態を保持するデータベースでのトランザクションの開始
+
+    :param channel_id : チャンネルID
+    :param immediate  : 開始時に書き込みロックを取得するか
+    :return           : カーソルを返すコンテキストマネージャ
+    """
+    return database.transaction(session_db(channel_id), DB_BUSY_TIMEOUT,
+                                immediate, DB_TRACE)
+
+# 参加者の状態をメモリに保持し、データベースへはまとめて書き込む
+# 状態の持ち主はプロセスに一つのため、コマンドを一つのプロセスで受ける
+# 構成 (asyncio / websocket、ワーカが一つの gunicorn) でのみ有効にする
+if config.getboolean('session_state', 'ENABLED', fallback=False):
+    session_state = SessionState(
+        session_db, DB_BUSY_TIMEOUT,
+        flush_interval = config.getfloat('session_state', 'FLUSH_INTERVAL',
+                                         fallback=0.1),
+        batch_size     = config.getint('session_state', 'BATCH_SIZE',
+                                       fallback=100),
+        trace          = DB_TRACE,
+    )
+    # プロセス終了時は書き込み待ちの変更を書き込む
+    atexit.register(session_state.close)
+else:
+    session_state = None
+
+# チャンネルごとの、このプロセスでの参加者の版
+# このプロセスで参加者を変更するたびに、全チャンネルで一意な値に進める
+# (データベースに書き込む前の、メモリ上の参加者の変更を区別するため)
+roster_versions: Dict[str, int] = {}
+_roster_version = itertools.count(1)
+
+def bump_roster_version(channel_id: str):
+    """
+    参加者の版を進める
+
+    :param channel_id : 参加者を変更したチャンネルID
+    """
+    roster_versions[channel_id] = next(_roster_version)
+
+def sql_now() -> str:
+    """
+    SQL の hirumibot_now()
+
+    :return : 現在時刻 (datetime('now', 'localtime') と同じ形式)
+    """
+    return clock().strftime('%Y-%m-%d %H:%M:%S')
+
+# 出席記録のトリガーから呼ぶため、全ての接続に登録する
+database.functions['hirumibot_now'] = (0, sql_now)
+
+def session_date() -> str:
+    """
+    開催日
+
+    :return : 実行日 (ISO 形式)
+    """
+    return clock().date().isoformat()
+
+def init_database():
+    """
+    データベースの初期化
+
+    不足しているテーブル・トリガーを作成する。
+    旧形式の参加者テーブルに残っている参加者は、
+    CHANNEL_ID_LUNCH の本日の参加者として移行する。
+    """
+    db_connection().executescript(SCHEMA_QUERY)
+
+    # 処理権を持つプロセスの列が無い旧形式の応答テーブルに列を追加する
+    with db_transaction() as c:
+        c.execute('PRAGMA table_info(webhook_reply)')
+        if 'holder' not in {column[1] for column in c.fetchall()}:
+            c.execute('ALTER TABLE webhook_reply ADD COLUMN holder TEXT')
+
+    # 複数のホストで共有するファイルが WAL のままであれば起動しない
+    conn = leader_connection()
+    journal_mode = conn.execute('PRAGMA journal_mode').fetchall()[0][0]
+    if LEADER_SHARED and journal_mode.upper() == 'WAL':
+        raise RuntimeError(
+            f'{LEADER_DB} is in WAL mode and cannot be shared between hosts; '
+            'set [leader] DATABASE_FILE to a file used only for the lease'
+        )
+    conn.executescript(LEADER_SCHEMA_QUERY)
+
+    for shard in range(max(SESSION_SHARDS, 1)):
+        database.connection(shard_db(shard), DB_BUSY_TIMEOUT).executescript(
+            SESSION_SCHEMA_QUERY + ATTENDANCE_SCHEMA_QUERY
+        )
+
+    c = db_connection().cursor()
+    c.execute(
+        "SELECT count(*) FROM sqlite_master "
+        "WHERE type = 'table' AND name = 'participant'"
+    )
+    if c.fetchall()[0][0] == 0:
+        return
+
+    with db_transaction() as c:
+        c.execute('SELECT username FROM participant ORDER BY rowid')
+        legacy_participants = c.fetchall()
+        c.execute('DELETE FROM participant')
+
+    if legacy_participants:
+        with session_transaction(CHANNEL_ID_LUNCH) as c:
+            c.executemany(
+                'INSERT OR IGNORE INTO lunch_participant'
+                '(channel_id, session_date, username) VALUES(?, ?, ?)',
+                [(CHANNEL_ID_LUNCH, session_date(), username)
+                 for username, in legacy_participants]
+            )
 
 # 投稿系
-def bot_posts_content(posts_msg: str, dst_chl_id: str) -> str:
+@metrics.timed('enqueue_post')
+def bot_posts_content(posts_msg: str, dst_chl_id: str) -> bool:
     """
     メッセージの投稿
 
     Botアカウントで指定のチャンネルにメッセージを投稿する。
+    投稿は送信キューに積み、送信の完了は待たない。
 
     :param posts_msg  : Botアカウントが投稿するメッセージ
     :param dst_chl_id : 投稿先のチャンネルID
-    :return           : HTTPリクエスト(POST)
+    :return           : 送信キューに積めたかどうか
     """
     bot_posts_headers = {
         'Content-Type': 'application/json',
@@ -42,80 +616,193 @@ def bot_posts_content(posts_msg: str, dst_chl_id: str) -> str:
          "message": posts_msg,
     }
 
-    bot_posts_request = requests.post(
-        MM_API_ADDRESS,
-        headers = bot_posts_headers,
-        data = json.dumps(bot_posts_data)
+    return outbound_queue.put(
+        MM_API_ADDRESS, bot_posts_headers, bot_posts_data
+    )
+
+def bot_broadcast_content(posts_msg: str,
+                          dst_chl_ids: Iterable[str]) -> BroadcastResult:
+    """
+    メッセージの一斉配信
+
+    Botアカウントで複数のチャンネルに同じメッセージを並行して投稿し、
+    全ての配信が終わるまで待つ。
+    配信できなかったチャンネルには時間をおいて再送する。
+
+    :param posts_msg   : Botアカウントが投稿するメッセージ
+    :param dst_chl_ids : 投稿先のチャンネルIDの一覧
+    :return            : チャンネルごとの配信結果
+    """
+    bot_posts_headers = {
+        'Content-Type': 'application/json',
+        'Authorization': 'Bearer ' + HIRUMIBOT_TOKEN,
+    }
+
+    result = broadcaster.broadcast(
+        MM_API_ADDRESS, bot_posts_headers, posts_msg, dst_chl_ids
     )
 
-    return bot_posts_request
+    for delivery in result.failed:
+        logger.error('broadcast to %s failed: status %s',
+                     delivery.channel_id, delivery.status)
+    return result
 
-def bot_reply_content(bot_reply_msg: str,
-                      posted_user: str, posted_msg: str) -> str:
+@metrics.timed('render_response')
+def bot_response_content(bot_reply_msg: str,
+                         posted_user: str, posted_msg: str) -> dict:
+    """
+    Outgoing Webhook の応答内容
+
+    トリガーワードを含んだ投稿を引用する形式の返信を、
+    Outgoing Webhook の応答(JSON)として組み立てる。
+
+    :param bot_reply_msg : Botアカウントが投稿するメッセージ
+    :param posted_user   : 引用元のメッセージを投稿したユーザ名
+    :param posted_msg    : 引用元のメッセージ
+    :return              : Outgoing Webhook の応答内容
+    """
+    bot_response_data = {
+        "text": bot_reply_msg,
+        "props": {
+            "attachments": [
+                    {
+                "author_name": posted_user,
+                "text": posted_msg,
+                }
+            ]
+        },
+    }
+
+    return bot_response_data
+
+@metrics.timed('enqueue_post')
+def bot_reply_content(bot_reply_msg: str, posted_user: str, posted_msg: str,
+                      dst_chl_id: str = CHANNEL_ID_LUNCH,
+                      continued: Sequence[str] = ()) -> bool:
     """
     メッセージの返信
 
     トリガーワードを含んだ投稿を引用する形式で、
     Botアカウントからメッセージを投稿する。
+    続きの投稿があれば、引用なしでその後に順番に投稿する。
+    投稿は送信キューに積み、送信の完了は待たない。
 
     :param bot_reply_msg : Botアカウントが投稿するメッセージ
     :param posted_user   : 引用元のメッセージを投稿したユーザ名
     :param posted_msg    : 引用元のメッセージ
-    :return              : HTTPリクエスト(POST)
+    :param dst_chl_id    : 投稿先のチャンネルID
+    :param continued     : 続きの投稿のメッセージ
+    :return              : 送信キューに積めたかどうか
     """
     bot_reply_headers = {
         'Content-Type': 'application/json',
         'Authorization': 'Bearer ' + HIRUMIBOT_TOKEN,
     }
 
+    bot_response_data = bot_response_content(
+        bot_reply_msg, posted_user, posted_msg
+    )
     bot_reply_data = {
-        "channel_id": CHANNEL_ID_LUNCH,
-        "message": bot_reply_msg,
-        "props": {
-            "attachments": [
-                    {
-                "author_name": posted_user,
-                "text": posted_msg,
-                }
-            ]
-        },
+        "channel_id": dst_chl_id,
+        "message": bot_response_data['text'],
+        "props": bot_response_data['props'],
+    }
+    bot_continued_data = [
+        {
+            "channel_id": dst_chl_id,
+            "message": continued_msg,
+        }
+        for continued_msg in continued
+    ]
+
+    return outbound_queue.put_all(
+        MM_API_ADDRESS, bot_reply_headers,
+        [bot_reply_data] + bot_continued_data
+    )
+
+@metrics.timed('enqueue_post')
+def bot_coalesced_content(key: tuple, requesters: List[str],
+                          bot_reply: Union[str, List[str]]) -> bool:
+    """
+    まとめた要求への返信
+
+    要求した全員宛てのメンションに続けて、共有する返信を投稿する。
+    投稿は送信キューに積み、送信の完了は待たない。
+
+    :param key        : 要求のキー (先頭は投稿先のチャンネルID)
+    :param requesters : 要求したユーザ名 (要求順)
+    :param bot_reply  : Botアカウントが投稿するメッセージ (またはブロック)
+    :return           : 送信キューに積めたかどうか
+    """
+    bot_reply_headers = {
+        'Content-Type': 'application/json',
+        'Authorization': 'Bearer ' + HIRUMIBOT_TOKEN,
     }
 
-    bot_reply_request = requests.post(
-        MM_API_ADDRESS,
-        headers = bot_reply_headers,
-        data = json.dumps(bot_reply_data)
+    if isinstance(bot_reply, str):
+        bot_reply = [bot_reply]
+    mentions = ' '.join(f'@{requester}' for requester in requesters)
+    bot_reply_posts = split_posts(
+        [catalogue.render('requesters', mentions=mentions)] + bot_reply,
+        POST_MAX_LENGTH
     )
 
-    return bot_reply_request
+    return outbound_queue.put_all(
+        MM_API_ADDRESS, bot_reply_headers,
+        [{"channel_id": key[0], "message": bot_reply_post}
+         for bot_reply_post in bot_reply_posts]
+    )
+
+# 人数確認・ヘルプの要求は COALESCE_WINDOW 秒ごとにまとめて返信する
+if COALESCE_WINDOW > 0:
+    coalescer = Coalescer(COALESCE_WINDOW, bot_coalesced_content)
+    # プロセス終了時はまとめている返信を待たずに送る (送信キューより先に実行)
+    atexit.register(coalescer.flush)
+else:
+    coalescer = None
 
 
 # 確認系
+def keyword_matcher() -> KeywordMatcher:
+    """
+    キーワード照合器の取得
+
+    カタログが保持している照合器を返す。
+    キーワードリストテーブルが更新されていれば、
+    CATALOGUE_CHECK_INTERVAL 秒以内に再構築される。
+
+    :return : キーワード照合器
+    """
+    return catalogue.matcher()
+
+@metrics.timed('keyword_match')
+def keyword_classify(posted_msg: str) -> str:
+    """
+    キーワードによるメッセージの分類
+
+    投稿されたメッセージを一回走査し、含まれているキーワードのうち
+    最も優先順位の高いカテゴリを判定する。
+
+    :param posted_msg : 投稿されたメッセージ
+    :return           : 判定したカテゴリ (キーワードがなければ None)
+    """
+    # メンションしたユーザ名に含まれる語はキーワードとみなさない
+    if '@' in posted_msg:
+        posted_msg = MENTION_PATTERN.sub(' ', posted_msg)
+    return keyword_matcher().classify(posted_msg)
+
 def keyword_check(category: str, posted_msg: str) -> bool:
     """
     キーワードの確認
 
-    指定されたカテゴリのキーワードをキーワードリストテーブルから取得し、
-    投稿されたメッセージ内にキーワードが含まれているかをチェックする。
+    指定されたカテゴリのキーワードが、
+    投稿されたメッセージ内に含まれているかをチェックする。
 
     :param category   : チェック対象キーワードのカテゴリ
     :param posted_msg : 投稿されたメッセージ
     :return           : メッセージ内にキーワードが含まれているかの判定結果
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
-    target_category = (category,)
-
-    query = 'SELECT keyword FROM keyword_list WHERE category = ?'
-    c.execute(query, target_category)
-    keyword_list = c.fetchall()
-    conn.close()
-
-    for keyword in keyword_list:
-        if keyword[0] in posted_msg:
-            return True
-
-    return False
+    return keyword_matcher().contains(category, posted_msg)
 
 def holiday_check() -> bool:
     """
@@ -125,7 +812,7 @@ def holiday_check() -> bool:
 
     :return : 祝日判定の結果
     """
-    holiday_jadge = jpholiday.is_holiday(date.today())
+    holiday_jadge = business_calendar.is_holiday(clock().date())
     return holiday_jadge
 
 def premium_friday_check() -> bool:
@@ -136,17 +823,8 @@ def premium_friday_check() -> bool:
 
     :return : プレミアムフライデー判定の結果
     """
-    cal = calendar.Calendar(firstweekday=calendar.FRIDAY)
-    today = datetime.now()
-
-    for days in reversed(cal.monthdatescalendar(today.year, today.month)):
-        premium_friday = days[0]
-        break
-
-    if today.day == premium_friday:
-        return True
-    else:
-        return False
+    premium_friday_jadge = business_calendar.is_last_friday(clock().date())
+    return premium_friday_jadge
 
 def reception_possible_check() -> bool:
     """
@@ -156,219 +834,929 @@ def reception_possible_check() -> bool:
 
     :return : ランチミーティング受付可能時間帯の判定結果
     """
-    posted_datetime = datetime.now()
-    posted_weekday  = posted_datetime.strftime('%A')
-
-    holiday_jadge = holiday_check()
-    if holiday_jadge == True:
-        return False
-
-    if posted_weekday != 'Wednesday' or not 11 <= posted_datetime.hour < 13:
-        return False
-
-    return True
+    posted_datetime = clock()
+    return business_calendar.is_reception_possible(posted_datetime)
 
 
 # ランチミーティング系
-def participant_registration(posted_user: str) -> str:
+@metrics.timed('db_participant_registration')
+def participant_registration(posted_user: str,
+                             channel_id: str = CHANNEL_ID_LUNCH) -> str:
     """
     ランチミーティング参加者の登録
 
-    参加表明したユーザを参加者テーブルに登録する。
+    参加表明したユーザを、チャンネルの本日の参加者として登録する。
 
     :param posted_user : メッセージを投稿したユーザ名
+    :param channel_id  : 投稿されたチャンネルID
     :return            : Botアカウントが投稿するメッセージ
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
-    target_user = (posted_user,)
-
-    # すでに参加者として登録済みのユーザか確認
-    check_query = 'SELECT count(*) FROM participant WHERE username = ?'
-    c.execute(check_query, target_user)
-    registerd_num = c.fetchall()[0][0]
+    target_user = (channel_id, session_date(), posted_user)
 
-    if registerd_num != 0:
-        conn.close()
-        bot_reply_msg = (
-            f"@{posted_user} さんはすでに参加表明済みだよ！:laughing:"
+    # 未登録のユーザであれば参加者登録を行う
+    if session_state is not None:
+        registered = session_state.add(*target_user)
+    else:
+        # 登録済みかどうかは一つの文の結果(変更行数)で判定する
+        c = session_connection(channel_id).cursor()
+        registration_query = (
+            'INSERT INTO lunch_participant(channel_id, session_date, username) '
+            'VALUES(?, ?, ?) '
+            'ON CONFLICT(channel_id, session_date, username) DO NOTHING'
         )
-        return bot_reply_msg
+        c.execute(registration_query, target_user)
+        registered = c.rowcount == 1
 
-    # 未登録のユーザであれば、参加者登録を行う
-    registration_query = 'INSERT INTO participant(username) VALUES(?)'
-    c.execute(registration_query, target_user)
-    conn.commit()
-    conn.close()
+    if not registered:
+        bot_reply_msg = catalogue.render('entry_duplicated', user=posted_user)
+        return bot_reply_msg
 
-    bot_reply_msg = (
-        f"@{posted_user} さんの参加を受け付けました！"
-        "わーい！:laughing::raised_hands:"
-    )
+    bump_roster_version(channel_id)
+    bot_reply_msg = catalogue.render('entry_accepted', user=posted_user)
     return bot_reply_msg
 
-def cancel_participation(posted_user: str) -> str:
+@metrics.timed('db_cancel_participation')
+def cancel_participation(posted_user: str,
+                         channel_id: str = CHANNEL_ID_LUNCH) -> str:
     """
     ランチミーティング参加のキャンセル
 
-    参加をキャンセルしたユーザを参加者テーブルから削除する。
+    参加をキャンセルしたユーザを、チャンネルの本日の参加者から削除する。
 
     :param posted_user : メッセージを投稿したユーザ名
+    :param channel_id  : 投稿されたチャンネルID
     :return            : Botアカウントが投稿するメッセージ
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
-    target_user = (posted_user,)
-
-    # すでに参加者として登録済みのユーザか確認
-    check_query = 'SELECT count(*) FROM participant WHERE username = ?'
-    c.execute(check_query, target_user)
-    registerd_num = c.fetchall()[0][0]
+    target_user = (channel_id, session_date(), posted_user)
 
-    if registerd_num == 0:
-        conn.close()
-        bot_reply_msg = (
-            f"@{posted_user} さんはまだ参加表明してないよ！:innocent:"
+    # 参加者登録済みのユーザであれば参加取り消し処理を行う
+    if session_state is not None:
+        cancelled = session_state.remove(*target_user)
+    else:
+        # 登録済みだったかどうかは一つの文の結果(変更行数)で判定する
+        c = session_connection(channel_id).cursor()
+        cancel_query = (
+            'DELETE FROM lunch_participant '
+            'WHERE channel_id = ? AND session_date = ? AND username = ?'
         )
+        c.execute(cancel_query, target_user)
+        cancelled = c.rowcount == 1
+
+    if not cancelled:
+        bot_reply_msg = catalogue.render('cancel_not_entered',
+                                         user=posted_user)
         return bot_reply_msg
 
-    # 参加者登録済みのユーザであれば、参加取り消し処理を行う
-    cancel_query = 'DELETE FROM participant WHERE username = ?'
-    c.execute(cancel_query, target_user)
-    conn.commit()
-    conn.close()
+    bump_roster_version(channel_id)
+    bot_reply_msg = catalogue.render('cancel_accepted', user=posted_user)
+    return bot_reply_msg
 
-    bot_reply_msg = (
-        f"@{posted_user} さんの参加を取り消したよ！"
-        "また今度参加してね！:cry:"
+def mentioned_users(posted_msg: str) -> List[str]:
+    """
+    メッセージ中で指定されたユーザ名
+
+    先頭のメンション(Botアカウント宛て)を除いた @ユーザ名 を、
+    一回の走査で投稿内の順に重複なく取り出す。
+    Botアカウント自身のユーザ名は含めない。
+
+    :param posted_msg : 投稿されたメッセージ
+    :return           : ユーザ名 (指定がなければ空)
+    """
+    words = posted_msg.split()
+    body = ' '.join(words[1:] if words and words[0].startswith('@')
+                    else words)
+    usernames = dict.fromkeys(
+        username.rstrip('.') for username in MENTION_PATTERN.findall(body)
     )
-    return bot_reply_msg
+    usernames.pop(BOT_USERNAME, None)
+    return list(usernames)
 
-def count_participant() -> str:
+def bulk_summary(*lines: tuple) -> str:
     """
-    ランチミーティング参加人数の確認
+    まとめて登録・取り消しした結果
+
+    :param lines : (メッセージ名, ユーザ名の一覧) (該当者がいない行は省く)
+    :return      : Botアカウントが投稿するメッセージ
+    """
+    return ''.join(
+        catalogue.render(name, count=len(usernames),
+                         users=' '.join(f'@{username}'
+                                        for username in usernames))
+        for name, usernames in lines if usernames
+    ).rstrip('\n')
+
+@metrics.timed('db_bulk_registration')
+def bulk_registration(usernames: List[str],
+                      channel_id: str = CHANNEL_ID_LUNCH) -> str:
+    """
+    ランチミーティング参加者のまとめての登録
 
-　　参加者テーブルを参照し、参加表明済みのユーザの数と一覧を表示する。
+    メッセージで指定された複数のユーザを、一つのトランザクションで
+    チャンネルの本日の参加者として登録する。
 
-    :return : Botアカウントが投稿するメッセージ
+    :param usernames  : 登録するユーザ名
+    :param channel_id : 投稿されたチャンネルID
+    :return           : Botアカウントが投稿するメッセージ
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
+    today = session_date()
+    if session_state is not None:
+        added = session_state.add_all(channel_id, today, usernames)
+    else:
+        with session_transaction(channel_id) as c:
+            registered = set(list_participant(c, channel_id))
+            added = [username for username in usernames
+                     if username not in registered]
+            c.executemany(
+                'INSERT INTO lunch_participant'
+                '(channel_id, session_date, username) VALUES(?, ?, ?) '
+                'ON CONFLICT(channel_id, session_date, username) DO NOTHING',
+                [(channel_id, today, username) for username in added]
+            )
+
+    if added:
+        bump_roster_version(channel_id)
+    added_set = set(added)
+    return bulk_summary(
+        ('bulk_added', added),
+        ('bulk_already_entered',
+         [username for username in usernames if username not in added_set]),
+    )
 
-    count_query = 'SELECT count(*) FROM participant'
-    c.execute(count_query)
-    registerd_num = c.fetchall()[0][0]
+@metrics.timed('db_bulk_cancellation')
+def bulk_cancellation(usernames: List[str],
+                      channel_id: str = CHANNEL_ID_LUNCH) -> str:
+    """
+    ランチミーティング参加のまとめての取り消し
 
-    if registerd_num == 0:
-        conn.close()
-        bot_reply_msg = (
-            "現在は参加予定者が一人もいません:disappointed_relieved:"
-        )
+    メッセージで指定された複数のユーザを、一つのトランザクションで
+    チャンネルの本日の参加者から削除する。
+
+    :param usernames  : 取り消すユーザ名
+    :param channel_id : 投稿されたチャンネルID
+    :return           : Botアカウントが投稿するメッセージ
+    """
+    today = session_date()
+    if session_state is not None:
+        removed = session_state.remove_all(channel_id, today, usernames)
     else:
-        list_query = 'SELECT username FROM participant'
-        c.execute(list_query)
-        registerd_user = c.fetchall()
-        conn.close()
-
-        bot_reply_msg = (
-            f"現在の参加予定者は{registerd_num}名です！:kissing_heart:\n"
-            "###### +++ 参加予定メンバー +++\n"
-        )
-        for username in registerd_user:
-            bot_reply_msg += f"@{username[0]}\n"
+        with session_transaction(channel_id) as c:
+            registered = set(list_participant(c, channel_id))
+            removed = [username for username in usernames
+                       if username in registered]
+            c.executemany(
+                'DELETE FROM lunch_participant '
+                'WHERE channel_id = ? AND session_date = ? AND username = ?',
+                [(channel_id, today, username) for username in removed]
+            )
+
+    if removed:
+        bump_roster_version(channel_id)
+    removed_set = set(removed)
+    return bulk_summary(
+        ('bulk_removed', removed),
+        ('bulk_not_entered',
+         [username for username in usernames if username not in removed_set]),
+    )
 
-    return bot_reply_msg
+def list_participant(c, channel_id: str) -> list:
+    """
+    ランチミーティング参加者の一覧
 
-def reset_participant() -> str:
+    :param c          : カーソル
+    :param channel_id : チャンネルID
+    :return           : 参加表明順のユーザ名
     """
-    ランチミーティング参加者のリセット
+    list_query = (
+        'SELECT username FROM lunch_participant '
+        'WHERE channel_id = ? AND session_date = ? ORDER BY rowid'
+    )
+    c.execute(list_query, (channel_id, session_date()))
+    return [username for username, in c.fetchall()]
 
-    参加者テーブルから全ユーザを削除する。
+def current_participant(channel_id: str) -> list:
+    """
+    ランチミーティング参加者の一覧
 
-    :return : Botアカウントが投稿するメッセージ
+    参加者の状態をメモリに保持している場合はデータベースを参照しない。
+
+    :param channel_id : チャンネルID
+    :return           : 参加表明順のユーザ名
+    """
+    if session_state is not None:
+        return session_state.members(channel_id, session_date())
+
+    return list_participant(session_connection(channel_id).cursor(),
+                            channel_id)
+
+@metrics.timed('db_count_participant')
+def count_participant(channel_id: str = CHANNEL_ID_LUNCH) -> List[str]:
+    """
+    ランチミーティング参加人数の確認
+
+　　チャンネルの本日の参加者を参照し、参加表明済みのユーザの数と一覧を表示する。
+
+    :param channel_id : 投稿されたチャンネルID
+    :return           : Botアカウントが投稿するメッセージのブロック
+    """
+    registerd_user = current_participant(channel_id)
+    registerd_num = len(registerd_user)
+
+    if registerd_num == 0:
+        return [catalogue.render('count_empty')]
+
+    with metrics.stage('render_roster'):
+        return [
+            catalogue.render('count_header', count=registerd_num),
+            roster_block(registerd_user),
+        ]
+
+def roster_block(usernames: Iterable[str]) -> str:
+    """
+    メンバー一覧のブロック
+
+    一人一行の一覧を一回の連結で作る。
+
+    :param usernames : ユーザ名
+    :return          : メンバー一覧
+    """
+    member = catalogue.formatter('member')
+    return ''.join([member({'user': username}) for username in usernames])
+
+@metrics.timed('db_reset_participant')
+def reset_participant(channel_id: str = CHANNEL_ID_LUNCH) -> str:
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
+    ランチミーティング参加者のリセット
+
+    チャンネルの参加者を、過去の開催日の分も含めて全て削除する。
 
-    reset_query = 'DELETE FROM participant'
-    c.execute(reset_query)
-    conn.commit()
-    conn.close()
+    :param channel_id : 投稿されたチャンネルID
+    :return           : Botアカウントが投稿するメッセージ
+    """
+    if session_state is not None:
+        # セッションの区切りのため、書き込みを終えてから返信する
+        session_state.reset(channel_id)
+        session_state.flush()
+    else:
+        with session_transaction(channel_id) as c:
+            reset_query = 'DELETE FROM lunch_participant WHERE channel_id = ?'
+            c.execute(reset_query, (channel_id,))
+    bump_roster_version(channel_id)
 
-    bot_reply_msg = "参加者をリセットしたよ！:expressionless:"
+    bot_reply_msg = catalogue.render('reset')
     return bot_reply_msg
 
-def depart_lunch_meetig() -> str:
+@metrics.timed('depart_lunch_meeting')
+def depart_lunch_meetig(channel_id: str = CHANNEL_ID_LUNCH) -> List[str]:
     """
     ランチミーティングの出発
 
-    参加者テーブルに登録されているユーザをランダムに班分けして
-    一覧を表示する。
+    チャンネルの本日の参加者をランダムに班分けして一覧を表示する。
+    一覧は班ごとのブロックにして、投稿を分ける場合は班の区切りで分ける。
 
-    :return : Botアカウントが投稿するメッセージ
+    :param channel_id : 投稿されたチャンネルID
+    :return           : Botアカウントが投稿するメッセージのブロック
     """
-    conn = sqlite3.connect(HIRUMIBOT_DB)
-    c = conn.cursor()
+    # 班分けの履歴・出席の記録はデータベースの参加者を参照するため、
+    # 書き込み待ちの変更を書き込んでから班分けする
+    if session_state is not None:
+        session_state.flush()
 
-    list_query = 'SELECT username FROM participant'
-    c.execute(list_query)
-    participants = c.fetchall()
-    conn.close()
+    participant_list = current_participant(channel_id)
 
-    participant_num = len(participants)
+    participant_num = len(participant_list)
     if participant_num == 0:
-        conn.close()
-        bot_reply_msg = "参加者が一人もいません:sweat:"
-        return bot_reply_msg
-
-    bot_reply_msg = "はーい！参加メンバーはこちら！:smile:\n"
+        return [catalogue.render('depart_empty')]
 
-    # 参加者が6名以下なら一班にする
-    if participant_num <= 6:
-        bot_reply_msg += "###### +++ 参加メンバー +++\n"
-        for participant_name in participants:
-            bot_reply_msg += f"@{participant_name[0]}\n"
+    bot_reply_blocks = [catalogue.render('depart_header')]
 
-        return bot_reply_msg
+    # 参加者が少なければ一班にする
+    if participant_num <= SINGLE_GROUP_MAX:
+        bot_reply_blocks.append(
+            catalogue.render('depart_single_group')
+            + roster_block(participant_list)
+        )
 
-    # 参加者が7名以上なら一班最大4名、最低3名となるよう班分けする
-    participant_list = [username[0] for username in participants]
-    shuffle(participant_list)
-    MEMBER_MAX_NUM = 4
-    MEMBER_MIN_NUM = 3
-
-    # 参加者リストをスライスして班分けリストを作成
-    # まだ班に割り振られていない参加者の数が 4 or 3 の倍数である場合は、
-    # その人数で一班とし、どちらの倍数でもない場合は4人で一班とする。
-    p_idx = 0
-    group_list = []
-    while participant_num > 0:
-        mod_max = int(participant_num % MEMBER_MAX_NUM)
-        mod_min = int(participant_num % MEMBER_MIN_NUM)
-        if mod_max == 0:
-            group_list += [participant_list[p_idx : p_idx + MEMBER_MAX_NUM]]
-            p_idx += MEMBER_MAX_NUM
-            participant_num -= MEMBER_MAX_NUM
-        elif mod_min == 0:
-            group_list += [participant_list[p_idx : p_idx + MEMBER_MIN_NUM]]
-            p_idx += MEMBER_MIN_NUM
-            participant_num -= MEMBER_MIN_NUM
-        else:
-            group_list += [participant_list[p_idx : p_idx + MEMBER_MAX_NUM]]
-            p_idx += MEMBER_MAX_NUM
-            participant_num -= MEMBER_MAX_NUM
+        # 参加者は初期化しないため、再び出発した場合は新しい参加者の分だけ記録する
+        group_list = [participant_list]
+        new_members = record_attendance(group_list, channel_id)
+        if new_members:
+            record_pair_history(group_list, channel_id, new_members)
+        return bot_reply_blocks
+
+    # 参加者が多ければ、過去に同じ班になったペアがなるべく重ならないよう
+    # 一班 MEMBER_MIN_NUM～MEMBER_MAX_NUM 名で班分けする
+    history = load_pair_history(channel_id)
+    with metrics.stage('grouping'):
+        group_list = grouping.partition(
+            participant_list, MEMBER_MIN_NUM, MEMBER_MAX_NUM,
+            history = history
+        )
 
     # 班ごとにメンバーを出力
-    for group_num, group in enumerate(group_list, 1):
-        bot_reply_msg += f"###### +++ {group_num}班 +++\n"
-        for participant_name in group:
-            bot_reply_msg += f"@{participant_name}\n"
+    with metrics.stage('render_roster'):
+        bot_reply_blocks.extend(
+            catalogue.render('depart_group', group_num=group_num)
+            + roster_block(group)
+            for group_num, group in enumerate(group_list, 1)
+        )
+
+    # 班分けを出力したら、出席と同じ班になったペアを記録して参加者を初期化
+    new_members = record_attendance(group_list, channel_id)
+    if new_members:
+        record_pair_history(group_list, channel_id, new_members)
+    reset_participant(channel_id)
+
+    return bot_reply_blocks
+
+@metrics.timed('db_load_pair_history')
+def load_pair_history(channel_id: str = CHANNEL_ID_LUNCH) -> dict:
+    """
+    同じ班になった履歴の取得
+
+    チャンネルの本日の参加者同士のペアについて、
+    そのチャンネルで過去に同じ班になった回数を取得する。
+
+    :param channel_id : チャンネルID
+    :return           : ペアごとの過去に同じ班になった回数
+    """
+    c = session_connection(channel_id).cursor()
+
+    participant_query = (
+        'SELECT username FROM lunch_participant '
+        'WHERE channel_id = :channel_id AND session_date = :session_date'
+    )
+    history_query = (
+        'SELECT user_a, user_b, met_count FROM pair_history '
+        'WHERE channel_id = :channel_id '
+        f'AND user_a IN ({participant_query}) '
+        f'AND user_b IN ({participant_query})'
+    )
+    c.execute(history_query,
+              {'channel_id': channel_id, 'session_date': session_date()})
+    history = {(user_a, user_b): met_count
+               for user_a, user_b, met_count in c.fetchall()}
+
+    return history
+
+@metrics.timed('db_record_pair_history')
+def record_pair_history(group_list: list, channel_id: str = CHANNEL_ID_LUNCH,
+                        new_members: Optional[Set[str]] = None):
+    """
+    同じ班になった履歴の記録
+
+    :param group_list  : 班ごとの参加者のユーザ名
+    :param channel_id  : チャンネルID
+    :param new_members : 今回初めて班を記録した参加者
+                         (指定した場合は、その参加者を含むペアだけを記録する)
+    """
+    met_date = clock().date().isoformat()
+    pairs = [(channel_id, user_a, user_b, met_date)
+             for user_a, user_b in grouping.group_pairs(group_list)
+             if new_members is None
+             or user_a in new_members or user_b in new_members]
+    if not pairs:
+        return
+
+    with session_transaction(channel_id) as c:
+        record_query = (
+            'INSERT INTO pair_history'
+            '(channel_id, user_a, user_b, met_count, last_met) '
+            'VALUES(?, ?, ?, 1, ?) '
+            'ON CONFLICT(channel_id, user_a, user_b) DO UPDATE SET '
+            'met_count = met_count + 1, last_met = excluded.last_met'
+        )
+        c.executemany(record_query, pairs)
+
+# コマンド系
+def leading_mentions(words: List[str]) -> int:
+    """
+    先頭のメンションの数
+
+    :param words : 投稿されたメッセージの語
+    :return      : 先頭から続く @ で始まる語の数
+    """
+    mentions = 0
+    while mentions < len(words) and words[mentions].startswith('@'):
+        mentions += 1
+    return mentions
+
+def admin_command(posted_msg: str) -> Optional[list]:
+    """
+    管理コマンドの解析
+
+    先頭のメンションを除いて 'admin' で始まるメッセージを管理コマンドとする。
+
+    :param posted_msg : 投稿されたメッセージ
+    :return           : 'admin' に続く語の一覧 (管理コマンドでなければ None)
+    """
+    words = posted_msg.split()
+    mentions = leading_mentions(words)
+    if words[mentions:mentions + 1] != ['admin']:
+        return None
+
+    # テンプレートは空白や改行を含めてそのまま受け取る
+    return posted_msg.split(None, mentions + 4)[mentions + 1:]
+
+def admin_reply(posted_user: str, args: list) -> str:
+    """
+    管理コマンドの実行
+
+    admin keyword add <カテゴリ> <キーワード>
+    admin keyword remove <キーワード>
+    admin message list
+    admin message show <メッセージ名>
+    admin message set <メッセージ名> <テンプレート>
+    admin message reset <メッセージ名>
+
+    変更は他のワーカにも CATALOGUE_CHECK_INTERVAL 秒以内に反映される。
+
+    :param posted_user : メッセージを投稿したユーザ名
+    :param args        : 'admin' に続く語の一覧
+    :return            : Botアカウントが投稿するメッセージ
+    """
+    if posted_user not in ADMIN_USERS:
+        return f"@{posted_user} さんは管理コマンドを使えません:no_entry_sign:"
+
+    command = tuple(args[:2])
+    try:
+        if command == ('keyword', 'add') and len(args) == 4:
+            catalogue.add_keyword(args[2], args[3])
+            return f"キーワード「{args[3]}」を {args[2]} に登録したよ！"
+
+        if command == ('keyword', 'remove') and len(args) == 3:
+            if catalogue.remove_keyword(args[2]):
+                return f"キーワード「{args[2]}」を削除したよ！"
+            return f"キーワード「{args[2]}」は登録されていません"
+
+        if command == ('message', 'list') and len(args) == 2:
+            return "メッセージ名: " + "、".join(catalogue.names())
+
+        if command == ('message', 'show') and len(args) == 3:
+            template = catalogue.template(args[2])
+            if template is None:
+                return f"{args[2]} というメッセージはありません"
+            return f"```\n{template}\n```"
+
+        if command == ('message', 'set') and len(args) == 4:
+            catalogue.set_message(args[2], args[3])
+            return f"メッセージ {args[2]} を変更したよ！"
+
+        if command == ('message', 'reset') and len(args) == 3:
+            if catalogue.reset_message(args[2]):
+                return f"メッセージ {args[2]} を既定に戻したよ！"
+            return f"メッセージ {args[2]} は変更されていません"
+    except ValueError as e:
+        return f"{e}:sweat:"
+
+    return (
+        "管理コマンドの使い方:\n"
+        "`admin keyword add <カテゴリ> <キーワード>`、"
+        "`admin keyword remove <キーワード>`、"
+        "`admin message list`、`admin message show <名前>`、"
+        "`admin message set <名前> <テンプレート>`、"
+        "`admin message reset <名前>`"
+    )
+
+def command_reply(posted_user: str, posted_msg: str, posted_chl_id: str,
+                  keyword_category: Optional[str]) -> Union[str, List[str]]:
+    """
+    コマンドの実行
+
+    投稿されたメッセージのキーワードに応じた処理を行う。
+
+    :param posted_user      : メッセージを投稿したユーザ名
+    :param posted_msg       : 投稿されたメッセージ
+    :param posted_chl_id    : 投稿されたチャンネルID
+    :param keyword_category : キーワードで判定したカテゴリ
+    :return                 : Botアカウントが投稿するメッセージ
+                              (参加者の一覧はブロックの一覧)
+    """
+    # 管理コマンドはいつでも受け付ける
+    admin_args = admin_command(posted_msg)
+    if admin_args is not None:
+        metrics.inc('hirumibot_webhook_requests_total', command='admin')
+        return admin_reply(posted_user, admin_args)
+
+    metrics.inc('hirumibot_webhook_requests_total',
+                command=keyword_category or 'none')
+
+    # ヘルプと統計はいつでも受け付ける
+    if keyword_category == 'help':
+        return help_msg()
+
+    if keyword_category == 'stats':
+        return attendance_stats(posted_user, posted_chl_id)
+
+    # ランチミーティング受付時間の確認
+    reception_possible_jadge = reception_possible_check()
+    if 'debug' in posted_msg:
+        reception_possible_jadge = True
+
+    if reception_possible_jadge == False:
+        return outside_reception_hours_msg()
+
+    # 人数確認
+    if keyword_category == 'count':
+        return count_participant(posted_chl_id)
+
+    # 参加取り消し (メンションしたユーザがいればまとめて取り消す)
+    if keyword_category == 'cancel':
+        usernames = mentioned_users(posted_msg)
+        if usernames:
+            return bulk_cancellation(usernames, posted_chl_id)
+        return cancel_participation(posted_user, posted_chl_id)
+
+    # 参加登録 (メンションしたユーザがいればまとめて登録する)
+    if keyword_category == 'entry':
+        usernames = mentioned_users(posted_msg)
+        if usernames:
+            return bulk_registration(usernames, posted_chl_id)
+        return participant_registration(posted_user, posted_chl_id)
+
+    # 出発
+    if keyword_category == 'go':
+        return depart_lunch_meetig(posted_chl_id)
+
+    # リセット
+    if keyword_category == 'reset':
+        return reset_participant(posted_chl_id)
+
+    # キーワードなし
+    return no_keywords_msg()
+
+def shared_roster_version(channel_id: str) -> int:
+    """
+    データベースの参加者の版
+
+    :param channel_id : チャンネルID
+    :return           : 全プロセスで共通の参加者の版 (変更がなければ 0)
+    """
+    c = session_connection(channel_id).cursor()
+    c.execute('SELECT version FROM roster_version WHERE channel_id = ?',
+              (channel_id,))
+    version = c.fetchall()
+    return version[0][0] if version else 0
+
+def coalesce_key(keyword_category: Optional[str], posted_msg: str,
+                 posted_chl_id: str) -> Optional[tuple]:
+    """
+    まとめられる要求のキー
+
+    人数確認はチャンネルと参加者の版が同じ要求を、
+    ヘルプはチャンネルが同じ要求をまとめる。
+    参加者の版には、他のワーカプロセスでの変更も反映されるよう
+    データベースの版と、このプロセスの書き込み前の変更の版を使う。
+
+    :param keyword_category : 判定したカテゴリ
+    :param posted_msg       : 投稿されたメッセージ
+    :param posted_chl_id    : 投稿されたチャンネルID
+    :return                 : 要求のキー (まとめられない要求は None)
+    """
+    if keyword_category == 'help':
+        return (posted_chl_id, keyword_category)
+    if keyword_category == 'count':
+        # 受付時間の確認を省く debug 付きの要求は別にまとめる
+        return (posted_chl_id, keyword_category, 'debug' in posted_msg,
+                shared_roster_version(posted_chl_id),
+                roster_versions.get(posted_chl_id, 0))
+    return None
+
+def handle_webhook(payload: dict, reply_mode: Optional[str] = None) -> dict:
+    """
+    Outgoing Webhook の処理
+
+    返信は Webhook の送信元のチャンネルに投稿する。
+    返信方法が response であれば Outgoing Webhook の応答として返し、
+    api であれば REST API で投稿して空の応答を返す。
+    返信が POST_MAX_LENGTH 文字を超える場合は複数の投稿に分け、
+    順番を保つため返信方法に関わらず全て REST API で投稿する。
+    COALESCE_WINDOW が設定されていれば、人数確認・ヘルプの要求はその秒数の間
+    まとめ、要求した全員宛ての一つの返信を REST API で投稿する。
+
+    :param payload    : Outgoing Webhook のペイロード
+    :param reply_mode : 返信方法 (省略時は REPLY_MODE)
+    :return           : Outgoing Webhook の応答
+    """
+    posted_user = payload['user_name']
+    posted_msg  = payload['text']
+    posted_chl_id = payload.get('channel_id') or CHANNEL_ID_LUNCH
+
+    # キーワードの判定は一度だけ行い、まとめる判定とコマンドの実行に使う
+    keyword_category = None
+    if admin_command(posted_msg) is None:
+        keyword_category = keyword_classify(posted_msg)
+
+    if coalescer is not None:
+        key = coalesce_key(keyword_category, posted_msg, posted_chl_id)
+        if key is not None:
+            joined = coalescer.submit(
+                key, posted_user,
+                lambda: command_reply(posted_user, posted_msg, posted_chl_id,
+                                      keyword_category)
+            )
+            if joined:
+                metrics.inc('hirumibot_webhook_requests_total',
+                            command=key[1])
+                metrics.inc('hirumibot_webhook_coalesced_total',
+                            command=key[1])
+            return {}
+
+    bot_reply = command_reply(posted_user, posted_msg, posted_chl_id,
+                              keyword_category)
+    if isinstance(bot_reply, str):
+        bot_reply = [bot_reply]
+    bot_reply_posts = split_posts(bot_reply, POST_MAX_LENGTH)
+
+    # メッセージテンプレートが空にされた場合など、返信が空であれば投稿しない
+    if not bot_reply_posts:
+        logger.warning('empty reply to a %s request',
+                       keyword_category or 'non-keyword')
+        metrics.inc('hirumibot_webhook_empty_replies_total')
+        return {}
+
+    if (reply_mode or REPLY_MODE) == 'response' and len(bot_reply_posts) == 1:
+        return bot_response_content(bot_reply_posts[0], posted_user,
+                                    posted_msg)
+
+    bot_reply_content(bot_reply_posts[0], posted_user, posted_msg,
+                      posted_chl_id, continued=bot_reply_posts[1:])
+    return {}
+
+def webhook_reply(payload: dict, reply_mode: Optional[str] = None) -> dict:
+    """
+    Outgoing Webhook への応答
 
-    # 班分けを出力したら、参加者テーブルを初期化
-    reset_participant()
+    同じ post_id の Webhook が再び届いた場合は、
+    参加者の状態の変更や投稿を行わずに最初の応答を返す。
+
+    :param payload    : Outgoing Webhook のペイロード
+    :param reply_mode : 返信方法 (省略時は REPLY_MODE)
+    :return           : Outgoing Webhook の応答
+    """
+    if recorder is not None:
+        recorder.record(payload)
+
+    post_id = payload.get('post_id')
+    if not post_id:
+        return handle_webhook(payload, reply_mode)
+
+    claimed, reply = reply_cache.claim(post_id)
+    if not claimed:
+        metrics.inc('hirumibot_webhook_duplicates_total')
+        return reply
+
+    try:
+        reply = handle_webhook(payload, reply_mode)
+    except BaseException:
+        reply_cache.release(post_id)
+        raise
+
+    reply_cache.store(post_id, reply)
+    return reply
+
+# 記録系
+@metrics.timed('db_record_attendance')
+def record_attendance(group_list: list,
+                      channel_id: str = CHANNEL_ID_LUNCH) -> Set[str]:
+    """
+    出席の記録
+
+    出席記録に班を記録し、開催・連続参加・週ごとの参加人数の集計を更新する。
+    集計には今回初めて班を記録した参加者だけを数え、
+    同じ参加者のまま二度出発した場合は集計を更新しない。
+    同じ日に二度出発した場合、開催回数と連続参加は一度だけ数える。
+
+    :param group_list : 班ごとの参加者のユーザ名
+    :param channel_id : チャンネルID
+    :return           : 今回初めて班を記録した参加者
+    """
+    today = session_date()
+    session_day = date.fromisoformat(today)
+    week = (session_day - timedelta(days=session_day.weekday())).isoformat()
+
+    with session_transaction(channel_id) as c:
+        # 班がまだ記録されていない参加者だけに班を記録する
+        new_members = set()
+        group_count = 0
+        for group_num, group in enumerate(group_list, 1):
+            recorded = len(new_members)
+            for username in group:
+                c.execute(
+                    'UPDATE attendance_log SET group_num = ? '
+                    'WHERE channel_id = ? AND session_date = ? '
+                    'AND username = ? '
+                    'AND cancelled_at IS NULL AND group_num IS NULL',
+                    (group_num, channel_id, today, username)
+                )
+                if c.rowcount > 0:
+                    new_members.add(username)
+            group_count += len(new_members) > recorded
+        turnout = len(new_members)
+        if turnout == 0:
+            return new_members
+
+        # 本日より前の直近の開催
+        c.execute(
+            'SELECT session_date FROM lunch_session '
+            'WHERE channel_id = ? AND session_date < ? '
+            'ORDER BY session_date DESC LIMIT 1',
+            (channel_id, today)
+        )
+        previous = c.fetchall()
+        previous_session = previous[0][0] if previous else ''
+
+        c.execute(
+            'INSERT INTO lunch_session'
+            '(channel_id, session_date, turnout, group_count) '
+            'VALUES(?, ?, ?, ?) '
+            'ON CONFLICT(channel_id, session_date) DO NOTHING',
+            (channel_id, today, turnout, group_count)
+        )
+        new_session = c.rowcount == 1
+        if not new_session:
+            c.execute(
+                'UPDATE lunch_session SET turnout = turnout + ?, '
+                'group_count = group_count + ? '
+                'WHERE channel_id = ? AND session_date = ?',
+                (turnout, group_count, channel_id, today)
+            )
+
+        # 前回の開催にも参加していれば連続参加を伸ばす
+        streak = (
+            'CASE WHEN last_session = :previous '
+            'THEN current_streak + 1 ELSE 1 END'
+        )
+        c.executemany(
+            'INSERT INTO attendance_streak(channel_id, username, sessions, '
+            'current_streak, longest_streak, last_session) '
+            'VALUES(:channel_id, :username, 1, 1, 1, :today) '
+            'ON CONFLICT(channel_id, username) DO UPDATE SET '
+            'sessions = sessions + 1, '
+            f'current_streak = {streak}, '
+            f'longest_streak = max(longest_streak, {streak}), '
+            'last_session = excluded.last_session '
+            'WHERE last_session < excluded.last_session',
+            [{'channel_id': channel_id, 'username': username,
+              'today': today, 'previous': previous_session}
+             for group in group_list for username in group
+             if username in new_members]
+        )
+
+        c.execute(
+            'INSERT INTO weekly_turnout(channel_id, week, sessions, attendees) '
+            'VALUES(?, ?, ?, ?) '
+            'ON CONFLICT(channel_id, week) DO UPDATE SET '
+            'sessions = sessions + excluded.sessions, '
+            'attendees = attendees + excluded.attendees',
+            (channel_id, week, int(new_session), turnout)
+        )
+
+    return new_members
+
+@metrics.timed('db_attendance_stats')
+def attendance_stats(posted_user: str,
+                     channel_id: str = CHANNEL_ID_LUNCH) -> str:
+    """
+    出席の統計
+
+    投稿したユーザの参加回数・連続参加回数・よく同じ班になるメンバーと、
+    チャンネルの直近の週ごとの参加人数を表示する。
+    いずれも集計テーブルを主キー・索引で参照する。
+
+    :param posted_user : メッセージを投稿したユーザ名
+    :param channel_id  : 投稿されたチャンネルID
+    :return            : Botアカウントが投稿するメッセージ
+    """
+    with session_transaction(channel_id, immediate=False) as c:
+        c.execute(
+            'SELECT session_date FROM lunch_session WHERE channel_id = ? '
+            'ORDER BY session_date DESC LIMIT 1',
+            (channel_id,)
+        )
+        latest = c.fetchall()
+        if not latest:
+            return catalogue.render('stats_empty')
+
+        c.execute(
+            'SELECT sessions, current_streak, longest_streak, last_session '
+            'FROM attendance_streak WHERE channel_id = ? AND username = ?',
+            (channel_id, posted_user)
+        )
+        streak = c.fetchall()
+
+        c.execute(
+            'SELECT username, met_count FROM ('
+            'SELECT user_b AS username, met_count FROM pair_history '
+            'WHERE channel_id = :channel_id AND user_a = :username '
+            'UNION ALL '
+            'SELECT user_a AS username, met_count FROM pair_history '
+            'WHERE channel_id = :channel_id AND user_b = :username'
+            ') ORDER BY met_count DESC, username LIMIT 3',
+            {'channel_id': channel_id, 'username': posted_user}
+        )
+        partners = c.fetchall()
+
+        c.execute(
+            'SELECT week, sessions, attendees FROM weekly_turnout '
+            'WHERE channel_id = ? ORDER BY week DESC LIMIT 4',
+            (channel_id,)
+        )
+        weeks = c.fetchall()
+
+    bot_reply_msg = catalogue.render('stats_header')
+    if streak:
+        sessions, current_streak, longest_streak, last_session = streak[0]
+        # 最新の開催に参加していなければ連続参加は途切れている
+        if last_session != latest[0][0]:
+            current_streak = 0
+        bot_reply_msg += catalogue.render(
+            'stats_user', user=posted_user, sessions=sessions,
+            current_streak=current_streak, longest_streak=longest_streak
+        )
+    else:
+        bot_reply_msg += catalogue.render('stats_new_user', user=posted_user)
+
+    if partners:
+        bot_reply_msg += catalogue.render('stats_partners', partners="、".join(
+            catalogue.render('stats_partner', user=username, count=met_count)
+            for username, met_count in partners
+        ))
+
+    bot_reply_msg += catalogue.render('stats_weeks_header')
+    for week, sessions, attendees in weeks:
+        bot_reply_msg += catalogue.render(
+            'stats_week', week=week, sessions=sessions, attendees=attendees
+        )
 
     return bot_reply_msg
 
+# 通知系
+def last_notice_run(name: str) -> Optional[datetime]:
+    """
+    通知の前回実行時刻の取得
+
+    :param name : 通知ジョブ名
+    :return     : 前回予定されていた実行時刻 (記録がなければ None)
+    """
+    c = db_connection().cursor()
+
+    last_run_query = 'SELECT last_run FROM notice_run WHERE name = ?'
+    c.execute(last_run_query, (name,))
+    last_run = c.fetchall()
+    if not last_run:
+        return None
+
+    return datetime.fromisoformat(last_run[0][0])
+
+def record_notice_run(name: str, scheduled: datetime):
+    """
+    通知の実行時刻の記録
+
+    :param name      : 通知ジョブ名
+    :param scheduled : 予定されていた実行時刻
+    """
+    c = db_connection().cursor()
+
+    record_query = (
+        'INSERT INTO notice_run(name, last_run) VALUES(?, ?) '
+        'ON CONFLICT(name) DO UPDATE SET last_run = excluded.last_run'
+    )
+    c.execute(record_query, (name, scheduled.isoformat()))
+
+@metrics.timed('db_claim_notice_run')
+def claim_notice_run(name: str, scheduled: datetime, holder: str) -> bool:
+    """
+    通知の実行権の取得
+
+    通知ジョブの一回分の実行(ジョブ名と予定されていた実行時刻)を記録し、
+    初めて記録したノードだけが実行する。
+    リーダーが交代しても、実行済みの通知は繰り返さない。
+
+    :param name      : 通知ジョブ名
+    :param scheduled : 予定されていた実行時刻
+    :param holder    : 実行するノードの保持者名
+    :return          : 実行権を取得できたか
+    """
+    c = leader_connection().cursor()
+
+    claim_query = (
+        'INSERT OR IGNORE INTO notice_fired(name, scheduled, holder, fired) '
+        'VALUES(?, ?, ?, ?)'
+    )
+    c.execute(claim_query, (name, scheduled.isoformat(), holder, time.time()))
+    return c.rowcount == 1
+
+def purge_notice_fired(keep_days: float):
+    """
+    古い通知の実行記録の削除
+
+    :param keep_days : 記録を残す日数
+    """
+    c = leader_connection().cursor()
+
+    purge_query = 'DELETE FROM notice_fired WHERE fired < ?'
+    c.execute(purge_query, (time.time() - keep_days * 86400,))
+
 # メッセージ系
 def help_msg() -> str:
     """
@@ -378,21 +1766,7 @@ def help_msg() -> str:
 
     :return : Botアカウントが投稿するメッセージ
     """
-    bot_reply_msg = (
-        "##### ひるみちゃんの使い方\n"
-        "ひるみちゃん(@hirumibot)宛に"
-        "キーワードを含む文章を投稿してください。\n"
-        "下記キーワード以外でも反応できることがあります。"
-        "いろいろ試してみてね！:wink:\n\n"
-        "| アクション | キーワード |\n"
-        "| :-------- | :-------- |\n"
-        "| 参加する | 参加、出席、entry |\n"
-        "| 参加を取り消す | キャンセル、欠席、cancle |\n"
-        "| 現在の参加人数を確認 | 人数は？、何人？、count |\n"
-        "| 参加メンバーのリセット | リセット、初期化、reset |\n"
-        "| 班分け＆出発 | 行くぞ、出発、go |\n"
-        "| ヘルプを表示 | ヘルプ、使い方、help |"
-    )
+    bot_reply_msg = catalogue.render('help')
     return bot_reply_msg
 
 def outside_reception_hours_msg() -> str:
@@ -403,7 +1777,7 @@ def outside_reception_hours_msg() -> str:
 
     :return : Botアカウントが投稿するメッセージ
     """
-    bot_reply_msg = "現在はランチミーティングの受付時間外です:sweat:"
+    bot_reply_msg = catalogue.render('outside_reception_hours')
     return bot_reply_msg
 
 def no_keywords_msg() -> str:
@@ -415,87 +1789,96 @@ def no_keywords_msg() -> str:
 
     :return : Botアカウントが投稿するメッセージ
     """
-    bot_reply_msg = (
-        "キーワードがないので、何もできませんでした:dizzy_face:\n"
-        "ひるみちゃんに使い方を聞いてみてね！"
-    )
+    bot_reply_msg = catalogue.render('no_keywords')
     return bot_reply_msg
 
-def morning_assembly_notice():
+def morning_assembly_notice(*dst_chl_ids: str) -> Optional[BroadcastResult]:
     """
     朝会の通知
 
     実行日が祝日でなければ、朝会のメッセージを投稿する。
+
+    :param dst_chl_ids : 投稿先のチャンネルID (省略時は全体チャンネル)
+    :return            : チャンネルごとの配信結果 (投稿しなかった場合は None)
     """
     holiday_jadge = holiday_check()
     if holiday_jadge == True:
-        return
+        return None
 
-    bot_posts_msg = "朝ミの時間です！:clock930:"
-    bot_posts_content(bot_posts_msg, CHANNEL_ID_ALL)
+    bot_posts_msg = catalogue.render('morning_assembly')
+    return bot_broadcast_content(bot_posts_msg,
+                                 dst_chl_ids or [CHANNEL_ID_ALL])
 
-def leaving_on_time_notice():
+def leaving_on_time_notice(*dst_chl_ids: str) -> Optional[BroadcastResult]:
     """
     定時退社の通知
 
     実行日が祝日でなければ、定時退社のメッセージを投稿する。
+
+    :param dst_chl_ids : 投稿先のチャンネルID (省略時は全体チャンネル)
+    :return            : チャンネルごとの配信結果 (投稿しなかった場合は None)
     """
     holiday_jadge = holiday_check()
     if holiday_jadge == True:
-        return
+        return None
 
-    bot_posts_msg = (
-        "18時です！:clock6:\n"
-        "残業申請をしていない人は帰りましょう！:running_man::dash:"
-    )
-    bot_posts_content(bot_posts_msg, CHANNEL_ID_ALL)
+    bot_posts_msg = catalogue.render('leaving_on_time')
+    return bot_broadcast_content(bot_posts_msg,
+                                 dst_chl_ids or [CHANNEL_ID_ALL])
 
-def premium_friday_notice():
+def premium_friday_notice(*dst_chl_ids: str) -> Optional[BroadcastResult]:
     """
     プレミアムフライデーの通知
 
     実行日が月末金曜日であれば、プレミアムフライデーのメッセージを投稿する。
+
+    :param dst_chl_ids : 投稿先のチャンネルID (省略時は全体チャンネル)
+    :return            : チャンネルごとの配信結果 (投稿しなかった場合は None)
     """
     premium_friday_jadge = premium_friday_check()
     if premium_friday_jadge == False:
-        return
+        return None
 
-    bot_posts_msg = (
-        "本日はプレミアムフライデーです！:clock3:\n"
-        "早めに仕事を切り上げて、プレ金を満喫しましょう！:beers:"
-    )
-    bot_posts_content(bot_posts_msg, CHANNEL_ID_ALL)
+    bot_posts_msg = catalogue.render('premium_friday')
+    return bot_broadcast_content(bot_posts_msg,
+                                 dst_chl_ids or [CHANNEL_ID_ALL])
 
-def lunch_meeting_notice():
+def lunch_meeting_notice(*dst_chl_ids: str) -> Optional[BroadcastResult]:
     """
     ランチミーティングの通知
 
-    実行日が祝日でなければ、参加者テーブルを初期化した上で、
+    実行日が祝日でなければ、チャンネルの参加者を初期化した上で、
     ランチミーティングの受付開始メッセージを投稿する。
+
+    :param dst_chl_ids : 投稿先のチャンネルID (省略時はランチチャンネル)
+    :return            : チャンネルごとの配信結果 (投稿しなかった場合は None)
     """
     holiday_jadge = holiday_check()
     if holiday_jadge == True:
-        return
+        return None
 
-    # 事前に参加者テーブルを初期化
-    reset_participant()
+    dst_chl_ids = dst_chl_ids or [CHANNEL_ID_LUNCH]
 
-    bot_posts_msg = (
-        "本日はランチミーティングの日です！:clock11:\n"
-        "参加する方はひるみちゃん(@hirumibot)宛に"
-        "メッセージを投稿してください！:smiley:"
-    )
-    bot_posts_content(bot_posts_msg, CHANNEL_ID_LUNCH)
+    # 事前にチャンネルの参加者を初期化
+    for dst_chl_id in dst_chl_ids:
+        reset_participant(dst_chl_id)
+
+    bot_posts_msg = catalogue.render('lunch_meeting')
+    return bot_broadcast_content(bot_posts_msg, dst_chl_ids)
 
-def lunch_time_notice():
+def lunch_time_notice(*dst_chl_ids: str) -> Optional[BroadcastResult]:
     """
     ランチタイムの通知
 
     実行日が祝日でなければ、ランチタイムのメッセージを投稿する。
+
+    :param dst_chl_ids : 投稿先のチャンネルID (省略時はランチチャンネル)
+    :return            : チャンネルごとの配信結果 (投稿しなかった場合は None)
     """
     holiday_jadge = holiday_check()
     if holiday_jadge == True:
-        return
+        return None
 
-    bot_posts_msg = "ランチの時間です！:clock12:"
-    bot_posts_content(bot_posts_msg, CHANNEL_ID_LUNCH)
\ No newline at end of file
+    bot_posts_msg = catalogue.render('lunch_time')
+    return bot_broadcast_content(bot_posts_msg,
+                                 dst_chl_ids or [CHANNEL_ID_LUNCH])
\ No newline at end of file
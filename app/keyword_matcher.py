@@ -0,0 +1,133 @@
+from collections import deque
+from typing import Iterable, Optional, Sequence, Tuple
+
+
+class KeywordMatcher:
+    """
+    キーワード照合器
+
+    キーワードリストテーブルの全カテゴリのキーワードから
+    Aho-Corasick オートマトンを構築し、投稿されたメッセージを
+    一回の走査でカテゴリに分類する。
+    """
+
+    def __init__(self, keyword_list: Iterable[Tuple[str, str]],
+                 priority: Sequence[str]):
+        """
+        オートマトンの構築
+
+        :param keyword_list : (カテゴリ, キーワード) の組の一覧
+        :param priority     : カテゴリの優先順位 (先頭ほど優先)
+        """
+        keyword_list = list(keyword_list)
+
+        # 優先順位に無いカテゴリは末尾に回す
+        self.categories = list(priority)
+        for category, _ in keyword_list:
+            if category not in self.categories:
+                self.categories.append(category)
+        category_bit = {
+            category: 1 << idx for idx, category in enumerate(self.categories)
+        }
+
+        # トライ木の構築
+        self._goto = [{}]
+        self._output = [0]
+        for category, keyword in keyword_list:
+            if not keyword:
+                continue
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append(0)
+                state = next_state
+            self._output[state] |= category_bit[category]
+
+        # 失敗遷移の構築 (幅優先)
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fail_state = self._fail[state]
+                while fail_state and char not in self._goto[fail_state]:
+                    fail_state = self._fail[fail_state]
+                self._fail[next_state] = self._goto[fail_state].get(char, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+                queue.append(next_state)
+
+    def match(self, posted_msg: str) -> int:
+        """
+        キーワードの照合
+
+        投稿されたメッセージを一回走査し、含まれていたキーワードの
+        カテゴリをビット集合として返す。
+        最優先カテゴリが見つかった時点で走査を打ち切る。
+
+        :param posted_msg : 投稿されたメッセージ
+        :return           : 一致したカテゴリのビット集合
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        matched = 0
+        state = 0
+        for char in posted_msg:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            matched |= output[state]
+            if matched & 1:
+                break
+
+        return matched
+
+    def classify(self, posted_msg: str) -> Optional[str]:
+        """
+        メッセージの分類
+
+        投稿されたメッセージに含まれるキーワードのうち、
+        最も優先順位の高いカテゴリを返す。
+
+        :param posted_msg : 投稿されたメッセージ
+        :return           : 一致したカテゴリ (一致しなければ None)
+        """
+        matched = self.match(posted_msg)
+        if matched == 0:
+            return None
+
+        # 最下位ビットが最優先カテゴリ
+        return self.categories[(matched & -matched).bit_length() - 1]
+
+    def contains(self, category: str, posted_msg: str) -> bool:
+        """
+        カテゴリ単位のキーワード確認
+
+        :param category   : チェック対象キーワードのカテゴリ
+        :param posted_msg : 投稿されたメッセージ
+        :return           : メッセージ内にキーワードが含まれているかの判定結果
+        """
+        if category not in self.categories:
+            return False
+
+        category_bit = 1 << self.categories.index(category)
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+
+        state = 0
+        for char in posted_msg:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] & category_bit:
+                return True
+
+        return False
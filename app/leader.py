@@ -0,0 +1,164 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Callable, Optional
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def default_holder() -> str:
+    """
+    既定の保持者名
+
+    :return : ホスト名とプロセスID
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class LeaderLease:
+    """
+    リース行によるリーダー選出
+
+    共有データベースの leader_lease テーブルの行を、期限付きのリースとして
+    一つのノードだけが保持する。保持者は renew_interval 秒ごとに期限を延ばし、
+    期限が切れた行は他のノードが取得する。停止時はリースを手放し、
+    他のノードが次の更新確認で直ちに引き継げるようにする。
+
+    期限はノード間で比較するため UNIX 時間で記録する。
+    ノード間の時計のずれは ttl より十分小さいこと。
+    """
+
+    def __init__(self, db_file: str, name: str, holder: Optional[str] = None,
+                 ttl: float = 15, renew_interval: float = 5,
+                 busy_timeout: int = 5000, trace: bool = False,
+                 journal_mode: str = 'WAL'):
+        """
+        :param db_file        : 共有データベースファイル
+        :param name           : リース名
+        :param holder         : このノードの保持者名 (省略時はホスト名:PID)
+        :param ttl            : リースの有効期間(秒)
+        :param renew_interval : リースの更新・取得を試みる間隔(秒)
+        :param busy_timeout   : ロック解放を待つ最大時間(ミリ秒)
+        :param trace          : 実行した SQL 文の数を数えるか
+        :param journal_mode   : 共有データベースのジャーナルモード
+                                (複数のホストで共有する場合は DELETE)
+        """
+        self.db_file = db_file
+        self.name = name
+        self.holder = holder or default_holder()
+        self.ttl = ttl
+        self.renew_interval = renew_interval
+        self.busy_timeout = busy_timeout
+        self.trace = trace
+        self.journal_mode = journal_mode
+        # リーダーになった時・降りた時に呼ぶ関数
+        self.on_elected: Optional[Callable[[], None]] = None
+        self.on_demoted: Optional[Callable[[], None]] = None
+        # このノードで保持が確実な期限 (time.monotonic() の値)
+        self._valid_until = 0.0
+        self._leader = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def is_leader(self) -> bool:
+        """ リースを保持しているか (更新できないまま期限が近づけば False) """
+        return self._leader and time.monotonic() < self._valid_until
+
+    def try_acquire(self) -> bool:
+        """
+        リースの更新・取得
+
+        保持しているリースは期限を延ばし、期限切れのリースは取得する。
+
+        :return : リースを保持しているか
+        """
+        started = time.monotonic()
+        now = time.time()
+        with database.transaction(self.db_file, self.busy_timeout,
+                                  trace=self.trace,
+                                  journal_mode=self.journal_mode) as c:
+            c.execute(
+                'INSERT INTO leader_lease(name, holder, expires, term) '
+                'VALUES(:name, :holder, :expires, 1) '
+                'ON CONFLICT(name) DO UPDATE SET '
+                'term = term + (holder != excluded.holder), '
+                'holder = excluded.holder, expires = excluded.expires '
+                'WHERE holder = excluded.holder OR expires < :now',
+                {'name': self.name, 'holder': self.holder,
+                 'expires': now + self.ttl, 'now': now}
+            )
+            acquired = c.rowcount == 1
+
+        if acquired:
+            # 書き込みを始めた時点から数え、時計のずれの分だけ早めに失効させる
+            self._valid_until = started + self.ttl - self.renew_interval
+        self._set_leader(acquired)
+        return acquired
+
+    def release(self):
+        """ リースを手放す (他のノードが直ちに取得できるようにする) """
+        self._set_leader(False)
+        self._valid_until = 0.0
+        c = database.connection(self.db_file, self.busy_timeout,
+                                self.trace, self.journal_mode).cursor()
+        c.execute('UPDATE leader_lease SET expires = 0 '
+                  'WHERE name = ? AND holder = ?', (self.name, self.holder))
+
+    def _set_leader(self, leader: bool):
+        """ リーダーの交代の記録と通知 """
+        if leader == self._leader:
+            return
+
+        self._leader = leader
+        if leader:
+            logger.info('%s became the leader of %s', self.holder, self.name)
+            metrics.inc('hirumibot_leader_changes_total', lease=self.name,
+                        role='elected')
+            callback = self.on_elected
+        else:
+            logger.info('%s is no longer the leader of %s',
+                        self.holder, self.name)
+            metrics.inc('hirumibot_leader_changes_total', lease=self.name,
+                        role='demoted')
+            callback = self.on_demoted
+
+        if callback is not None:
+            try:
+                callback()
+            except Exception:
+                logger.exception('leader change callback failed')
+
+    def _run(self):
+        """ リースの更新スレッド """
+        while not self._stopped.is_set():
+            try:
+                self.try_acquire()
+            except Exception:
+                metrics.inc('hirumibot_leader_errors_total', lease=self.name)
+                logger.exception('failed to renew the lease %s', self.name)
+                if not self.is_leader:
+                    self._set_leader(False)
+            self._stopped.wait(self.renew_interval)
+
+    def start(self):
+        """ リースの更新スレッドの起動 """
+        self._thread = threading.Thread(target=self._run,
+                                        name=f'lease-{self.name}',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ 更新スレッドを止めてリースを手放す """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.release()
+        except Exception:
+            logger.exception('failed to release the lease %s', self.name)
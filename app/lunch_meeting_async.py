@@ -0,0 +1,94 @@
+import asyncio
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+import business_calendar
+import hirumibot
+import metrics
+from outbound_async import AsyncOutboundQueue
+
+# 待ち受けるアドレス ('unix:<パス>' または '<ホスト>:<ポート>')
+BIND       = hirumibot.config.get('asyncio', 'BIND',
+                                  fallback='unix:/tmp/hirumibot.sock')
+# データベース処理を行うスレッド数
+DB_THREADS = hirumibot.config.getint('asyncio', 'DB_THREADS', fallback=32)
+
+
+async def metrics_export(request: web.Request) -> web.Response:
+    """ 計測値の出力 (Prometheus 形式) """
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(request.app['db_executor'],
+                                      metrics.render)
+    return web.Response(
+        text = text,
+        headers = {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+async def lunch_meeting_manage(request: web.Request) -> web.Response:
+    """
+    ランチミーティングの管理
+
+    コマンドの処理は lunch_meeting.py と同じ hirumibot.webhook_reply() で行う。
+    SQLite への読み書きはイベントループを止めないようスレッドで行い、
+    Mattermost への投稿はイベントループ上の送信キューから送る。
+    """
+    payload = await request.json()
+
+    loop = asyncio.get_running_loop()
+    with metrics.stage('webhook'):
+        reply = await loop.run_in_executor(request.app['db_executor'],
+                                           hirumibot.webhook_reply, payload)
+
+    return web.json_response(reply)
+
+async def on_startup(app: web.Application):
+    """ スレッドプールと送信キューの準備 """
+    app['db_executor'] = ThreadPoolExecutor(
+        DB_THREADS, thread_name_prefix='hirumibot-db'
+    )
+
+    outbound_queue = AsyncOutboundQueue(**hirumibot.OUTBOUND_SETTINGS)
+    await outbound_queue.start()
+    hirumibot.outbound_queue = outbound_queue
+
+async def on_cleanup(app: web.Application):
+    """ 送信待ちの投稿を送り切ってから停止する """
+    await hirumibot.outbound_queue.close(hirumibot.OUTBOUND_FLUSH_TIMEOUT)
+    app['db_executor'].shutdown()
+
+def create_app() -> web.Application:
+    """
+    Webアプリケーションの作成
+
+    :return : lunch_meeting.py と同じ経路を持つアプリケーション
+    """
+    hirumibot.init_database()
+    business_calendar.warm_up()
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_export)
+    app.router.add_post('/hirumibot', lunch_meeting_manage)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+def main():
+    """ asyncio サーバとして起動 """
+    app = create_app()
+
+    if BIND.startswith('unix:'):
+        path = BIND[len('unix:'):]
+        # 前回の起動時のソケットファイルが残っていれば削除する
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.remove(path)
+        web.run_app(app, path=path, access_log=None, print=None)
+    else:
+        host, port = BIND.rsplit(':', 1)
+        web.run_app(app, host=host, port=int(port), access_log=None,
+                    print=None)
+
+if __name__ == '__main__':
+    main()
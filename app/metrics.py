@@ -0,0 +1,287 @@
+import atexit
+import functools
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+# 処理時間のヒストグラムの区切り(秒)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_METRIC = 'hirumibot_stage_seconds'
+
+_settings = {
+    'directory': None,
+    'sample_rate': 1.0,
+    'flush_interval': 5.0,
+}
+
+# 段階ごとのヒストグラム (段階名 -> [区切りごとの件数..., 合計時間, 件数])
+_histograms: Dict[str, list] = {}
+# カウンタ ((メトリクス名, ラベル) -> 値)
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_lock = threading.Lock()
+_state = {'pid': None, 'file': None}
+
+
+def configure(directory: Optional[str] = None, sample_rate: float = 1.0,
+              flush_interval: float = 5.0):
+    """
+    計測の設定
+
+    gunicorn の各ワーカや通知プロセスは、計測値を directory 内の
+    プロセスごとのファイルに、バックグラウンドのスレッドから定期的に書き出す。
+    /metrics ではそれらを合算して出力する。
+
+    :param directory      : 計測値を書き出すディレクトリ (None なら書き出さない)
+    :param sample_rate    : 処理時間を計測する割合 (0 なら計測しない)
+    :param flush_interval : 計測値を書き出す間隔(秒)
+    """
+    _settings['directory'] = directory
+    _settings['sample_rate'] = sample_rate
+    _settings['flush_interval'] = flush_interval
+    if directory:
+        Path(directory).mkdir(parents=True, exist_ok=True)
+
+def _process_file() -> Optional[Path]:
+    """ 現在のプロセスの書き出し先 """
+    directory = _settings['directory']
+    if not directory:
+        return None
+
+    # fork 後の子プロセスは親プロセスの計測値を引き継がない
+    pid = os.getpid()
+    if _state['pid'] != pid:
+        with _lock:
+            if _state['pid'] != pid:
+                _histograms.clear()
+                _counters.clear()
+                _state['pid'] = pid
+                # 同じ PID の終了済みのプロセスのファイルは引き継がず削除する
+                mark_process_dead(pid)
+                _state['file'] = (
+                    Path(directory) / f'{pid}-{time.time_ns()}.json'
+                )
+                threading.Thread(target=_flush_loop, daemon=True).start()
+    return _state['file']
+
+def _alive(pid: int) -> bool:
+    """ プロセスが動いているか """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def mark_process_dead(pid: int):
+    """
+    終了したプロセスの計測値の削除
+
+    終了したプロセスのファイルを削除し、/metrics で合算しないようにする。
+    (gunicorn の child_exit などから呼ぶ)
+
+    :param pid : 終了したプロセスのPID
+    """
+    directory = _settings['directory']
+    if not directory:
+        return
+
+    for metrics_file in Path(directory).glob(f'{pid}-*'):
+        try:
+            metrics_file.unlink()
+        except OSError:
+            pass
+
+def _flush_loop():
+    """ 計測値の定期的な書き出し """
+    pid = os.getpid()
+    while _state['pid'] == pid:
+        time.sleep(max(_settings['flush_interval'], 0.1))
+        try:
+            flush()
+        except OSError:
+            pass
+
+def sampled() -> bool:
+    """
+    計測対象の判定
+
+    :return : 今回の処理時間を計測するかどうか
+    """
+    sample_rate = _settings['sample_rate']
+    return sample_rate >= 1 or (sample_rate > 0 and random.random() < sample_rate)
+
+def observe(stage: str, seconds: float):
+    """
+    処理時間の記録
+
+    :param stage   : 処理の段階名
+    :param seconds : 処理時間(秒)
+    """
+    _process_file()
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = [0] * (len(BUCKETS) + 3)
+        histogram[bisect_left(BUCKETS, seconds)] += 1
+        histogram[-2] += seconds
+        histogram[-1] += 1
+
+def inc(name: str, value: float = 1, **labels: str):
+    """
+    カウンタの加算
+
+    :param name   : メトリクス名
+    :param value  : 加算する値
+    :param labels : ラベル
+    """
+    _process_file()
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    処理時間の計測
+
+    with ブロック内の処理時間を記録する。
+
+    :param name : 処理の段階名
+    """
+    if not sampled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def timed(name: str):
+    """
+    処理時間を計測するデコレータ
+
+    :param name : 処理の段階名
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not sampled():
+                return func(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def _snapshot() -> dict:
+    with _lock:
+        return {
+            'histograms': {k: list(v) for k, v in _histograms.items()},
+            'counters': [[name, list(labels), value]
+                         for (name, labels), value in _counters.items()],
+        }
+
+def flush():
+    """
+    計測値の書き出し
+
+    現在のプロセスの計測値をファイルに書き出す。
+    """
+    process_file = _process_file()
+    if process_file is None:
+        return
+
+    tmp_file = process_file.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps(_snapshot()))
+    os.replace(tmp_file, process_file)
+
+def _merge(total: dict, snapshot: dict):
+    for name, histogram in snapshot['histograms'].items():
+        merged = total['histograms'].setdefault(name, [0] * len(histogram))
+        for idx, value in enumerate(histogram):
+            merged[idx] += value
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(tuple(label) for label in labels))
+        total['counters'][key] = total['counters'].get(key, 0) + value
+
+def _label_str(labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels
+    )
+    return '{' + pairs + '}'
+
+def render() -> str:
+    """
+    Prometheus 形式での出力
+
+    動いている全プロセスの計測値を合算して出力する。
+    現在のプロセスの分は書き出し済みのファイルではなくメモリ上の値を使う。
+    終了したプロセスの分は削除するため、再起動するとカウンタは減りうる。
+
+    :return : Prometheus のテキスト形式の計測値
+    """
+    total = {'histograms': {}, 'counters': {}}
+    _merge(total, _snapshot())
+
+    own_file = _process_file()
+    directory = _settings['directory']
+    if directory:
+        for metrics_file in Path(directory).glob('*.json'):
+            if metrics_file == own_file:
+                continue
+            # 異常終了などで残ったファイルは削除する
+            pid = metrics_file.name.split('-', 1)[0]
+            if pid.isdigit() and not _alive(int(pid)):
+                mark_process_dead(int(pid))
+                continue
+            try:
+                _merge(total, json.loads(metrics_file.read_text()))
+            except (OSError, ValueError):
+                continue
+
+    lines = [
+        '# HELP hirumibot_metrics_sample_rate '
+        'Fraction of calls whose latency is recorded.',
+        '# TYPE hirumibot_metrics_sample_rate gauge',
+        f"hirumibot_metrics_sample_rate {_settings['sample_rate']}",
+        f'# HELP {STAGE_METRIC} Latency of each processing stage.',
+        f'# TYPE {STAGE_METRIC} histogram',
+    ]
+    for name in sorted(total['histograms']):
+        histogram = total['histograms'][name]
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram):
+            cumulative += count
+            labels = _label_str((('stage', name), ('le', bound)))
+            lines.append(f'{STAGE_METRIC}_bucket{labels} {cumulative}')
+        labels = _label_str((('stage', name),))
+        lines.append(f'{STAGE_METRIC}_sum{labels} {histogram[-2]}')
+        lines.append(f'{STAGE_METRIC}_count{labels} {histogram[-1]}')
+
+    declared = set()
+    for (name, labels), value in sorted(total['counters'].items()):
+        if name not in declared:
+            lines.append(f'# TYPE {name} counter')
+            declared.add(name)
+        lines.append(f'{name}{_label_str(labels)} {value}')
+
+    return '\n'.join(lines) + '\n'
+
+atexit.register(flush)
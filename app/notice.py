@@ -1,27 +1,236 @@
-from time import sleep
-
-import schedule
+import logging
+import signal
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
 
+import business_calendar
 import hirumibot
+import metrics
+from broadcast import BroadcastResult
+from leader import LeaderLease
+from scheduler import CronSchedule, Job, Scheduler
+
+logger = logging.getLogger(__name__)
+
+# 実行日の条件
+DAY_POLICIES = {
+    'every'        : lambda day: True,
+    'non_holiday'  : lambda day: not business_calendar.is_holiday(day),
+    'business_day' : business_calendar.is_business_day,
+    'last_friday'  : business_calendar.is_last_friday,
+}
+
+# 通知の実行記録を残す日数
+FIRED_KEEP_DAYS = 30
+
+# 投稿先チャンネルの別名
+CHANNEL_ALIASES = {
+    'all'   : hirumibot.CHANNEL_ID_ALL,
+    'lunch' : hirumibot.CHANNEL_ID_LUNCH,
+}
+
+def notice_channels(channels: str) -> list:
+    """
+    通知先チャンネルの解析
+
+    :param channels : カンマ区切りのチャンネルIDまたは別名
+    :return         : チャンネルIDの一覧
+    """
+    return [CHANNEL_ALIASES.get(channel, channel)
+            for channel in (c.strip() for c in channels.split(','))
+            if channel]
+
+def notice_action(section
+                  ) -> Callable[[datetime], Optional[BroadcastResult]]:
+    """
+    通知処理の作成
+
+    ACTION が指定されていれば hirumibot の同名の関数を実行し、
+    そうでなければ MESSAGE を CHANNEL に投稿する処理を作成する。
+    MESSAGE 内の {today} は実行日に置き換える。
+    CHANNEL にはチャンネルIDか別名をカンマ区切りで複数指定でき、
+    メッセージは一度だけ作成して全てのチャンネルに並行して配信する。
+    ACTION の場合は CHANNEL のチャンネルIDをまとめて渡す。
+
+    :param section : 通知の設定
+    :return        : 予定されていた実行時刻を受け取り、
+                     配信結果を返す通知処理
+    """
+    day_policy = DAY_POLICIES[section.get('DAYS', 'non_holiday')]
+
+    action_name = section.get('ACTION')
+    if action_name:
+        action = getattr(hirumibot, action_name)
+        dst_chl_ids = notice_channels(section.get('CHANNEL', ''))
+        def run_action(scheduled: datetime) -> Optional[BroadcastResult]:
+            if not day_policy(scheduled.date()):
+                return None
+            return action(*dst_chl_ids)
+        return run_action
+
+    message = section['MESSAGE'].strip()
+    dst_chl_ids = notice_channels(section.get('CHANNEL', 'all'))
+    def post_message(scheduled: datetime) -> Optional[BroadcastResult]:
+        if not day_policy(scheduled.date()):
+            return None
+        bot_posts_msg = message.format(today=scheduled)
+        return hirumibot.bot_broadcast_content(bot_posts_msg, dst_chl_ids)
+    return post_message
+
+def counted(name: str,
+            action: Callable[[datetime], Optional[BroadcastResult]]
+            ) -> Callable[[datetime], None]:
+    """
+    通知の実行回数の計測
+
+    一部のチャンネルに配信できなかった場合は partial として数え、
+    配信できなかったチャンネルを記録する。
+
+    :param name   : 通知ジョブ名
+    :param action : 通知処理
+    :return       : 実行結果ごとに回数を数える通知処理
+    """
+    def run_counted(scheduled: datetime):
+        try:
+            with metrics.stage(f'notice_{name}'):
+                result = action(scheduled)
+        except Exception:
+            metrics.inc('hirumibot_notice_runs_total', job=name, result='error')
+            raise
+
+        if result is not None and result.failed:
+            logger.error('notice %s was not delivered to %s of %s channels: '
+                         '%s', name, len(result.failed), len(result.deliveries),
+                         ', '.join(delivery.channel_id
+                                   for delivery in result.failed))
+            metrics.inc('hirumibot_notice_runs_total', job=name,
+                        result='partial')
+            return
+        metrics.inc('hirumibot_notice_runs_total', job=name, result='ok')
+    return run_counted
+
+def exactly_once(name: str, action: Callable[[datetime], None],
+                 lease: LeaderLease) -> Callable[[datetime], None]:
+    """
+    通知の一回だけの実行
+
+    複数のノードで通知を動かしても、リーダーのノードだけが
+    通知ジョブの一回分の実行権を取得して実行する。
+
+    :param name   : 通知ジョブ名
+    :param action : 通知処理
+    :param lease  : 通知のリーダーのリース
+    :return       : リーダーであり、実行権を取得できた場合だけ実行する通知処理
+    """
+    def run_once(scheduled: datetime):
+        if not lease.is_leader:
+            metrics.inc('hirumibot_notice_runs_total', job=name,
+                        result='follower')
+            return
+        if not hirumibot.claim_notice_run(name, scheduled, lease.holder):
+            metrics.inc('hirumibot_notice_runs_total', job=name,
+                        result='duplicate')
+            return
+        action(scheduled)
+    return run_once
+
+def catch_up(notice_scheduler: Scheduler, jobs: List[Job]):
+    """
+    リーダー交代の間の通知の実行
+
+    猶予時間内に予定されていた通知を全て直ちに実行する。
+    実行済みの通知は実行権を取得できないため繰り返さない。
+
+    :param notice_scheduler : 通知のスケジューラ
+    :param jobs             : 通知ジョブの一覧
+    """
+    now = notice_scheduler.clock()
+    for job in jobs:
+        if job.catchup <= 0:
+            continue
+        missed = job.schedule.next_after(now - timedelta(seconds=job.catchup))
+        while missed <= now:
+            notice_scheduler.run_now(job, missed)
+            missed = job.schedule.next_after(missed)
+
+def load_jobs(lease: LeaderLease) -> list:
+    """
+    通知設定の読み込み
+
+    設定ファイルの [notice.<ジョブ名>] セクションから通知ジョブを作成する。
+
+    :param lease : 通知のリーダーのリース
+    :return      : 通知ジョブの一覧
+    """
+    jobs = []
+    for section_name in hirumibot.config.sections():
+        if not section_name.startswith('notice.'):
+            continue
+
+        section = hirumibot.config[section_name]
+        name = section_name[len('notice.'):]
+        jobs.append(Job(
+            name     = name,
+            schedule = CronSchedule(section['SCHEDULE']),
+            action   = exactly_once(name,
+                                    counted(name, notice_action(section)),
+                                    lease),
+            jitter   = section.getfloat('JITTER', 0),
+            catchup  = section.getfloat('CATCHUP', 0),
+        ))
+
+    return jobs
 
 def bot_notice():
-    """ Botアカウントから指定の時間にメッセージを通知 """
-    # 毎日18:00に定時退社を通知
-    schedule.every().day.at("18:00").do(hirumibot.leaving_on_time_notice)
+    """
+    Botアカウントから指定の時間にメッセージを通知
+
+    複数のノードで動かした場合は、共有データベースのリースを
+    保持しているノードだけが通知する。
+    """
+    business_calendar.warm_up()
+    hirumibot.init_database()
+
+    config = hirumibot.config
+    lease = LeaderLease(
+        hirumibot.LEADER_DB, 'notice',
+        holder         = config.get('leader', 'HOLDER', fallback='') or None,
+        ttl            = config.getfloat('leader', 'TTL', fallback=15),
+        renew_interval = config.getfloat('leader', 'RENEW_INTERVAL',
+                                         fallback=5),
+        busy_timeout   = hirumibot.DB_BUSY_TIMEOUT,
+        trace          = hirumibot.DB_TRACE,
+        journal_mode   = hirumibot.LEADER_JOURNAL_MODE,
+    )
 
-    # 毎週月曜日・水曜日の09:30に朝会を通知
-    schedule.every().monday.at("09:30").do(hirumibot.morning_assembly_notice)
-    schedule.every().wednesday.at("09:30").do(hirumibot.morning_assembly_notice)
+    notice_scheduler = Scheduler(
+        workers = config.getint('hirumibot', 'NOTICE_WORKERS', fallback=4)
+    )
+    notice_scheduler.on_run = (
+        lambda job, scheduled: hirumibot.record_notice_run(job.name, scheduled)
+    )
 
-    # 毎週水曜日にランチミーティングを通知
-    schedule.every().wednesday.at("11:00").do(hirumibot.lunch_meeting_notice)
-    schedule.every().wednesday.at("12:00").do(hirumibot.lunch_time_notice)
+    # 停止中に実行し損ねた通知は、猶予時間内であれば起動時に実行する
+    jobs = load_jobs(lease)
+    for job in jobs:
+        last_run = hirumibot.last_notice_run(job.name)
+        if last_run is None:
+            hirumibot.record_notice_run(job.name, notice_scheduler.clock())
+        notice_scheduler.add(job, last_run)
 
-    # 毎月末金曜日はプレミアムフライデーを通知
-    schedule.every().friday.at("15:00").do(hirumibot.premium_friday_notice)
+    # リーダーを引き継いだら、交代の間に予定されていた通知を実行する
+    def on_elected():
+        hirumibot.purge_notice_fired(FIRED_KEEP_DAYS)
+        catch_up(notice_scheduler, jobs)
+    lease.on_elected = on_elected
 
-    while True:
-        schedule.run_pending()
-        sleep(10)
+    # 停止時はリースを手放し、他のノードが直ちに引き継げるようにする
+    signal.signal(signal.SIGTERM, lambda signum, frame: notice_scheduler.stop())
+    lease.start()
+    try:
+        notice_scheduler.run()
+    finally:
+        lease.stop()
 
-bot_notice()
\ No newline at end of file
+if __name__ == '__main__':
+    bot_notice()
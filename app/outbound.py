@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 再送の対象とする HTTP ステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    トークンバケット
+
+    送信レートを一定以下に抑える。
+    Mattermost から 429 が返された場合は Retry-After の間だけ送信を止める。
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate     : 1秒あたりに補充するトークン数
+        :param capacity : 貯められるトークンの上限
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        トークンの消費
+
+        トークンがあれば一つ消費する。
+
+        :return : 消費できた場合は 0、できなかった場合は補充までの秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            if now < self._not_before:
+                return self._not_before - now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        トークンの取得
+
+        トークンが補充されるまで待ってから一つ消費する。
+        """
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        送信の一時停止
+
+        :param seconds : 送信を止める秒数
+        """
+        with self._lock:
+            self._not_before = max(self._not_before,
+                                   time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class OutboundQueue:
+    """
+    送信キュー
+
+    Mattermost への投稿を上限付きのキューに積み、
+    HTTP セッションを共有するワーカスレッドが非同期に送信する。
+    失敗した投稿は指数バックオフ(ジッタ付き)で再送する。
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 1000,
+                 timeout: float = 10, max_retries: int = 5,
+                 backoff: float = 0.5, backoff_max: float = 30,
+                 rate: float = 10, burst: int = 20):
+        """
+        :param workers     : 送信ワーカスレッド数
+        :param queue_size  : キューに積める投稿数の上限
+        :param timeout     : HTTP リクエストのタイムアウト(秒)
+        :param max_retries : 再送の最大回数
+        :param backoff     : 再送間隔の初期値(秒)
+        :param backoff_max : 再送間隔の上限(秒)
+        :param rate        : 1秒あたりの最大送信数
+        :param burst       : 瞬間的に送信できる最大数
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate, burst)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """
+        ワーカスレッドの起動
+
+        fork 後の子プロセスでは親プロセスのスレッドが存在しないため、
+        プロセスごとにキュー・セッション・スレッドを作り直す。
+        requests は起動時間を短くするため、初めて投稿するときに読み込む。
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            self._queue = queue.Queue(self.queue_size)
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.workers)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+            for _ in range(self.workers):
+                threading.Thread(target=self._worker, daemon=True).start()
+            self._pid = pid
+
+    def put(self, url: str, headers: dict, data: dict) -> bool:
+        """
+        投稿の登録
+
+        投稿をキューに積んで直ちに戻る。キューが満杯の場合は破棄する。
+
+        :param url     : 投稿先の URL
+        :param headers : HTTP ヘッダ
+        :param data    : 投稿内容
+        :return        : キューに積めたかどうか
+        """
+        return self.put_all(url, headers, [data])
+
+    def put_all(self, url: str, headers: dict, posts: list) -> bool:
+        """
+        複数の投稿の登録
+
+        投稿をまとめてキューに積み、一つのワーカが順番に送信する。
+        キューが満杯の場合はまとめて破棄する。
+
+        :param url     : 投稿先の URL
+        :param headers : HTTP ヘッダ
+        :param posts   : 投稿内容の一覧 (送信する順)
+        :return        : キューに積めたかどうか
+        """
+        self._start()
+        try:
+            self._queue.put_nowait((url, headers, posts))
+        except queue.Full:
+            metrics.inc('hirumibot_outbound_dropped_total')
+            logger.error('outbound queue is full, dropped a post to %s', url)
+            return False
+
+        return True
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        送信完了の待機
+
+        :param timeout : 待機する最大時間(秒)
+        :return        : キューが空になったかどうか
+        """
+        if self._pid != os.getpid():
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                self._queue.all_tasks_done.wait(remaining)
+
+        return True
+
+    def _worker(self):
+        """ 送信ワーカ """
+        while True:
+            url, headers, posts = self._queue.get()
+            try:
+                for data in posts:
+                    self.send(url, headers, data)
+            except Exception:
+                logger.exception('failed to deliver a post to %s', url)
+            finally:
+                self._queue.task_done()
+
+    def send(self, url: str, headers: dict, data: dict,
+             session: Optional['requests.Session'] = None,
+             max_retries: Optional[int] = None
+             ) -> Optional['requests.Response']:
+        """
+        投稿の送信
+
+        失敗した場合は指数バックオフで再送し、
+        429 の場合は Retry-After に従って送信を止める。
+
+        :param url         : 投稿先の URL
+        :param headers     : HTTP ヘッダ
+        :param data        : 投稿内容
+        :param session     : 送信に使う HTTP セッション (省略時はキューのもの)
+        :param max_retries : 再送回数の上限 (省略時はキューの設定)
+        :return            : HTTPレスポンス (送信できなかった場合は None)
+        """
+        import requests
+
+        if session is None:
+            session = self.session
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        for attempt in range(max_retries + 1):
+            self.bucket.acquire()
+
+            retry_after = None
+            try:
+                with metrics.stage('mattermost_post'):
+                    response = session.post(
+                        url,
+                        headers = headers,
+                        data = json.dumps(data),
+                        timeout = self.timeout
+                    )
+            except requests.RequestException as e:
+                metrics.inc('hirumibot_outbound_requests_total',
+                            status='error')
+                logger.warning('post to %s failed: %s', url, e)
+            else:
+                metrics.inc('hirumibot_outbound_requests_total',
+                            status=str(response.status_code))
+                if response.status_code not in RETRY_STATUS:
+                    if response.status_code >= 400:
+                        logger.error('post to %s was rejected: %s %s',
+                                     url, response.status_code,
+                                     response.text)
+                    return response
+
+                retry_after = parse_retry_after(
+                    response.headers.get('Retry-After')
+                )
+                if response.status_code == 429:
+                    self.bucket.pause(retry_after or 1)
+                logger.warning('post to %s returned %s',
+                               url, response.status_code)
+
+            if attempt == max_retries:
+                break
+
+            time.sleep(retry_delay(attempt, self.backoff, self.backoff_max,
+                                   retry_after))
+
+        # 再送しない場合は、呼び出し元が再送するか失敗を記録する
+        if max_retries > 0:
+            logger.error('gave up a post to %s after %s attempts',
+                         url, max_retries + 1)
+        return None
+
+
+def retry_delay(attempt: int, backoff: float, backoff_max: float,
+                retry_after: Optional[float] = None) -> float:
+    """
+    再送までの待ち時間
+
+    指数バックオフ(フルジッタ)で決め、Retry-After があればそれ以上待つ。
+
+    :param attempt     : 何回目の送信に失敗したか (0 始まり)
+    :param backoff     : 再送間隔の初期値(秒)
+    :param backoff_max : 再送間隔の上限(秒)
+    :param retry_after : Retry-After で指定された秒数
+    :return            : 待ち時間(秒)
+    """
+    delay = random.uniform(0, min(backoff_max, backoff * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Retry-After ヘッダの解析
+
+    秒数と HTTP 日付のどちらの形式にも対応する。
+
+    :param value : Retry-After ヘッダの値
+    :return      : 待機する秒数 (解析できなければ None)
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
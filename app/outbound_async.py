@@ -0,0 +1,222 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Optional
+
+import aiohttp
+
+import metrics
+from outbound import (
+    RETRY_STATUS, TokenBucket, parse_retry_after, retry_delay
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncOutboundQueue:
+    """
+    送信キュー (asyncio 版)
+
+    OutboundQueue と同じ再送・送信レートの制御を、
+    イベントループ上のタスクと aiohttp のセッションで行う。
+    put() はイベントループ外のスレッドからも呼び出せる。
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 1000,
+                 timeout: float = 10, max_retries: int = 5,
+                 backoff: float = 0.5, backoff_max: float = 30,
+                 rate: float = 10, burst: int = 20):
+        """
+        :param workers     : 同時に送信する投稿数
+        :param queue_size  : キューに積める投稿数の上限
+        :param timeout     : HTTP リクエストのタイムアウト(秒)
+        :param max_retries : 再送の最大回数
+        :param backoff     : 再送間隔の初期値(秒)
+        :param backoff_max : 再送間隔の上限(秒)
+        :param rate        : 1秒あたりの最大送信数
+        :param burst       : 瞬間的に送信できる最大数
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate, burst)
+        self._loop = None
+        self._tasks = []
+
+    async def start(self):
+        """ 送信タスクの起動 (イベントループ上で呼び出す) """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.queue_size)
+        self.session = aiohttp.ClientSession(
+            timeout = aiohttp.ClientTimeout(total=self.timeout),
+            connector = aiohttp.TCPConnector(limit=self.workers),
+        )
+        self._tasks = [asyncio.create_task(self._worker())
+                       for _ in range(self.workers)]
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        送信タスクの停止
+
+        送信待ちの投稿をできるだけ送り切ってから停止する。
+
+        :param timeout : 送信完了を待つ最大時間(秒)
+        """
+        await self.join(timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.session.close()
+
+    def put(self, url: str, headers: dict, data: dict) -> bool:
+        """
+        投稿の登録
+
+        投稿をキューに積んで直ちに戻る。キューが満杯の場合は破棄する。
+
+        :param url     : 投稿先の URL
+        :param headers : HTTP ヘッダ
+        :param data    : 投稿内容
+        :return        : キューに積めたかどうか
+        """
+        return self.put_all(url, headers, [data])
+
+    def put_all(self, url: str, headers: dict, posts: list) -> bool:
+        """
+        複数の投稿の登録
+
+        投稿をまとめてキューに積み、一つの送信タスクが順番に送信する。
+
+        :param url     : 投稿先の URL
+        :param headers : HTTP ヘッダ
+        :param posts   : 投稿内容の一覧 (送信する順)
+        :return        : キューに積めたかどうか
+        """
+        try:
+            in_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            in_loop = False
+
+        if in_loop:
+            return self._put_nowait((url, headers, posts))
+
+        # 別スレッドからはイベントループに登録を依頼する
+        if self._queue.qsize() >= self.queue_size:
+            self._drop(url)
+            return False
+        self._loop.call_soon_threadsafe(self._put_nowait,
+                                        (url, headers, posts))
+        return True
+
+    def _put_nowait(self, item: tuple) -> bool:
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self._drop(item[0])
+            return False
+
+        return True
+
+    def _drop(self, url: str):
+        metrics.inc('hirumibot_outbound_dropped_total')
+        logger.error('outbound queue is full, dropped a post to %s', url)
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        送信完了の待機
+
+        :param timeout : 待機する最大時間(秒)
+        :return        : キューが空になったかどうか
+        """
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+    async def _worker(self):
+        """ 送信タスク """
+        while True:
+            url, headers, posts = await self._queue.get()
+            try:
+                for data in posts:
+                    await self.send(url, headers, data)
+            except Exception:
+                logger.exception('failed to deliver a post to %s', url)
+            finally:
+                self._queue.task_done()
+
+    async def send(self, url: str, headers: dict, data: dict) -> Optional[int]:
+        """
+        投稿の送信
+
+        失敗した場合は指数バックオフで再送し、
+        429 の場合は Retry-After に従って送信を止める。
+
+        :param url     : 投稿先の URL
+        :param headers : HTTP ヘッダ
+        :param data    : 投稿内容
+        :return        : HTTPステータス (送信できなかった場合は None)
+        """
+        for attempt in range(self.max_retries + 1):
+            await acquire_token(self.bucket)
+
+            retry_after = None
+            start = time.perf_counter()
+            try:
+                async with self.session.post(
+                    url, headers=headers, data=json.dumps(data)
+                ) as response:
+                    status = response.status
+                    body = await response.text()
+                    retry_after_header = response.headers.get('Retry-After')
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.inc('hirumibot_outbound_requests_total',
+                            status='error')
+                logger.warning('post to %s failed: %s', url, e)
+            else:
+                if metrics.sampled():
+                    metrics.observe('mattermost_post',
+                                    time.perf_counter() - start)
+                metrics.inc('hirumibot_outbound_requests_total',
+                            status=str(status))
+                if status not in RETRY_STATUS:
+                    if status >= 400:
+                        logger.error('post to %s was rejected: %s %s',
+                                     url, status, body)
+                    return status
+
+                retry_after = parse_retry_after(retry_after_header)
+                if status == 429:
+                    self.bucket.pause(retry_after or 1)
+                logger.warning('post to %s returned %s', url, status)
+
+            if attempt == self.max_retries:
+                break
+
+            await asyncio.sleep(retry_delay(attempt, self.backoff,
+                                            self.backoff_max, retry_after))
+
+        logger.error('gave up a post to %s after %s attempts',
+                     url, self.max_retries + 1)
+        return None
+
+
+async def acquire_token(bucket: TokenBucket):
+    """
+    トークンの取得
+
+    イベントループを止めずに、トークンが補充されるまで待ってから一つ消費する。
+
+    :param bucket : トークンバケット
+    """
+    while True:
+        wait = bucket.reserve()
+        if wait == 0:
+            return
+        await asyncio.sleep(wait)
@@ -0,0 +1,63 @@
+from typing import Iterable, List
+
+# Mattermost の投稿の最大文字数 (MaxPostSize の既定値)
+POST_MAX_LENGTH = 16383
+
+
+def split_lines(block: str, limit: int) -> List[str]:
+    """
+    長すぎるブロックの分割
+
+    行の区切りで limit 文字以下に分割する。
+    一行だけで limit 文字を超える場合は、その行を limit 文字ごとに切る。
+
+    :param block : 分割するブロック
+    :param limit : 一つの投稿の最大文字数
+    :return      : limit 文字以下の断片
+    """
+    pieces = []
+    lines = []
+    length = 0
+    for line in block.splitlines(keepends=True):
+        if length + len(line) > limit and lines:
+            pieces.append(''.join(lines))
+            lines = []
+            length = 0
+        while len(line) > limit:
+            pieces.append(line[:limit])
+            line = line[limit:]
+        lines.append(line)
+        length += len(line)
+    if lines:
+        pieces.append(''.join(lines))
+    return pieces
+
+def split_posts(blocks: Iterable[str],
+                limit: int = POST_MAX_LENGTH) -> List[str]:
+    """
+    ブロックの投稿への割り付け
+
+    ブロック(見出しと班ごとのメンバー一覧など)を順に詰め、
+    limit 文字を超える手前で次の投稿に移る。ブロックの途中では分けず、
+    一つで limit 文字を超えるブロックだけを行の区切りで分ける。
+    文字列の連結は投稿ごとに一回だけ行うため、全体の長さに比例した時間で済む。
+
+    :param blocks : 投稿する順のブロック
+    :param limit  : 一つの投稿の最大文字数
+    :return       : 投稿の一覧 (空のブロックしかなければ空)
+    """
+    posts = []
+    parts = []
+    length = 0
+    for block in blocks:
+        pieces = [block] if len(block) <= limit else split_lines(block, limit)
+        for piece in pieces:
+            if length + len(piece) > limit and parts:
+                posts.append(''.join(parts))
+                parts = []
+                length = 0
+            parts.append(piece)
+            length += len(piece)
+    if length:
+        posts.append(''.join(parts))
+    return posts
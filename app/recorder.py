@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 記録する項目 (記録ファイルでの短い名前 -> ペイロードの項目名)
+FIELDS = {
+    'c': 'channel_id',
+    'u': 'user_name',
+    'x': 'text',
+    'p': 'post_id',
+    's': 'timestamp',
+}
+
+
+class PayloadRecorder:
+    """
+    Webhook のペイロードの記録
+
+    受信時刻とペイロードの主な項目を、一件一行の JSON として
+    記録ファイルに追記する。一件ごとに O_APPEND のファイルへ一回の write で
+    書き込むため、gunicorn の複数のワーカから同じファイルに記録できる。
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path : 記録ファイル
+        """
+        self.path = path
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _open(self) -> int:
+        """ 記録ファイルを開く (fork 後の子プロセスでは開き直す) """
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._fd = os.open(
+                        self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                        0o600
+                    )
+                    self._pid = pid
+        return self._fd
+
+    def record(self, payload: dict, received: Optional[float] = None):
+        """
+        ペイロードの記録
+
+        記録に失敗しても Webhook の処理は続ける。
+
+        :param payload  : Outgoing Webhook のペイロード
+        :param received : 受信時刻 (UNIX 時間、省略時は現在時刻)
+        """
+        item = {'t': round(received or time.time(), 6)}
+        for short_name, name in FIELDS.items():
+            if payload.get(name) is not None:
+                item[short_name] = payload[name]
+        line = json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+
+        try:
+            os.write(self._open(), (line + '\n').encode('utf-8'))
+        except OSError as e:
+            metrics.inc('hirumibot_record_errors_total')
+            logger.error('failed to record a payload to %s: %s', self.path, e)
+
+
+def read_recording(path: str) -> Iterator[dict]:
+    """
+    記録ファイルの読み込み
+
+    :param path : 記録ファイル
+    :return     : 受信時刻('received')を加えたペイロード (記録順)
+    """
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            payload = {name: item[short_name]
+                       for short_name, name in FIELDS.items()
+                       if short_name in item}
+            payload['received'] = item['t']
+            yield payload
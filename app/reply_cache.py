@@ -0,0 +1,210 @@
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import database
+import metrics
+
+
+def claim_holder() -> str:
+    """
+    処理権を取得するプロセスの名前
+
+    :return : ホスト名とプロセスID
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def holder_dead(holder: Optional[str]) -> bool:
+    """
+    処理権を持つプロセスが終了したことが確かか
+
+    同じホストのプロセスだけを確認できる。
+    他のホストのプロセスや記録の無い処理権は、終了したとはみなさない。
+
+    :param holder : 処理権を持つプロセスの名前 (ホスト名:プロセスID)
+    :return       : 終了したことが確かか
+    """
+    host, _, pid = (holder or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+class ReplyCache:
+    """
+    Webhook の応答キャッシュ
+
+    Mattermost が応答待ちのタイムアウトで同じ投稿(post_id)の Webhook を
+    再送してきた場合に、処理をやり直さず最初の応答を返すために使う。
+    応答は webhook_reply テーブルに保存して gunicorn のワーカ間で共有し、
+    各プロセスでは件数上限付きの LRU としてメモリにも保持する。
+    """
+
+    def __init__(self, db_file: str, busy_timeout: int = 5000,
+                 ttl: float = 600, capacity: int = 10000,
+                 wait: float = 5, takeover: float = 300,
+                 trace: bool = False):
+        """
+        :param db_file      : 応答を保存するデータベースファイル
+        :param busy_timeout : ロック解放を待つ最大時間(ミリ秒)
+        :param ttl          : 応答を保持する時間(秒)
+        :param capacity     : メモリに保持する応答数の上限
+        :param wait         : 処理中の投稿の応答を待つ最大時間(秒)
+        :param takeover     : 処理権を持つプロセスの生死が分からない場合に、
+                              処理権を引き継ぐまでの時間(秒)
+                              (ワーカのタイムアウトより十分長くする)
+        :param trace        : 実行した SQL 文の数を数えるか
+        """
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.ttl = ttl
+        self.capacity = capacity
+        self.wait = wait
+        self.takeover = takeover
+        self.trace = trace
+        # post_id -> (有効期限, 応答)
+        self._replies = OrderedDict()
+        self._purged = 0.0
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        return database.connection(self.db_file, self.busy_timeout,
+                                   self.trace)
+
+    def _get_local(self, post_id: str) -> Optional[dict]:
+        """ メモリに保持している応答の取得 """
+        with self._lock:
+            item = self._replies.get(post_id)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._replies[post_id]
+                return None
+            self._replies.move_to_end(post_id)
+            return item[1]
+
+    def _put_local(self, post_id: str, reply: dict):
+        """ 応答をメモリに保持する (上限を超えたら古いものから捨てる) """
+        with self._lock:
+            self._replies[post_id] = (time.monotonic() + self.ttl, reply)
+            self._replies.move_to_end(post_id)
+            while len(self._replies) > self.capacity:
+                self._replies.popitem(last=False)
+
+    def _purge(self, c, now: float):
+        """ 保持期間を過ぎた応答の削除 (ttl の 1/10 の間隔で行う) """
+        if now - self._purged < self.ttl / 10:
+            return
+        self._purged = now
+        c.execute('DELETE FROM webhook_reply WHERE created < ?',
+                  (now - self.ttl,))
+
+    def claim(self, post_id: str) -> Tuple[bool, Optional[dict]]:
+        """
+        投稿の処理権の取得
+
+        初めて届いた投稿であれば処理権を取得する。
+        処理済みの投稿であれば保存されている応答を返し、
+        別のワーカが処理中であれば応答が保存されるまで待つ。
+        処理権の取得時刻は created に、取得したプロセスは holder に記録する。
+
+        :param post_id : 投稿ID
+        :return        : (処理権を取得できたか, 処理済みの場合の応答)
+        """
+        reply = self._get_local(post_id)
+        if reply is not None:
+            return False, reply
+
+        now = time.time()
+        c = self._connection().cursor()
+        self._purge(c, now)
+
+        claim_query = (
+            'INSERT INTO webhook_reply(post_id, reply, created, holder) '
+            'VALUES(?, NULL, ?, ?) ON CONFLICT(post_id) DO NOTHING'
+        )
+        c.execute(claim_query, (post_id, now, claim_holder()))
+        if c.rowcount == 1:
+            return True, None
+
+        return self._wait_reply(c, post_id)
+
+    def _wait_reply(self, c, post_id: str) -> Tuple[bool, Optional[dict]]:
+        """
+        処理中の投稿の応答の待機
+
+        待機中に処理が失敗して処理権が解放された場合は、改めて処理権を取得する。
+        処理権を持つプロセスが同じホストで終了していれば、処理権を引き継ぐ。
+        生死を確かめられない場合は、処理権の取得から takeover 秒を過ぎるまで
+        引き継がない (処理中の投稿を二重に処理しないため)。
+        待ち切れなかった場合は空の応答を返す。
+        """
+        deadline = time.monotonic() + self.wait
+        reply_query = (
+            'SELECT reply, created, holder FROM webhook_reply '
+            'WHERE post_id = ?'
+        )
+        takeover_query = (
+            'UPDATE webhook_reply SET created = ?, holder = ? '
+            'WHERE post_id = ? AND reply IS NULL AND created = ?'
+        )
+        while True:
+            c.execute(reply_query, (post_id,))
+            row = c.fetchone()
+            if row is None:
+                return self.claim(post_id)
+            reply, claimed, holder = row
+            if reply is not None:
+                reply = json.loads(reply)
+                self._put_local(post_id, reply)
+                return False, reply
+            now = time.time()
+            if holder_dead(holder) or claimed <= now - self.takeover:
+                # 他の待機中のワーカと同時に引き継がないよう、
+                # 読んだ時刻のままの行だけを更新する
+                c.execute(takeover_query,
+                          (now, claim_holder(), post_id, claimed))
+                if c.rowcount == 1:
+                    metrics.inc('hirumibot_webhook_claim_takeovers_total')
+                    return True, None
+                continue
+            if time.monotonic() >= deadline:
+                metrics.inc('hirumibot_webhook_reply_wait_timeouts_total')
+                return False, {}
+            time.sleep(0.05)
+
+    def store(self, post_id: str, reply: dict):
+        """
+        応答の保存
+
+        :param post_id : 投稿ID
+        :param reply   : Outgoing Webhook の応答
+        """
+        store_query = 'UPDATE webhook_reply SET reply = ? WHERE post_id = ?'
+        self._connection().execute(
+            store_query, (json.dumps(reply, ensure_ascii=False), post_id)
+        )
+        self._put_local(post_id, reply)
+
+    def release(self, post_id: str):
+        """
+        処理権の解放
+
+        処理に失敗した場合に、再送された投稿を改めて処理できるようにする。
+
+        :param post_id : 投稿ID
+        """
+        release_query = (
+            'DELETE FROM webhook_reply WHERE post_id = ? AND reply IS NULL'
+        )
+        self._connection().execute(release_query, (post_id,))
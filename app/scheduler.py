@@ -0,0 +1,274 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# cron 形式で使える月・曜日の名前
+MONTH_NAMES = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+WEEKDAY_NAMES = {
+    'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6,
+}
+
+# 時刻の変更に追従するため、一度に眠る時間の上限(秒)
+MAX_SLEEP = 3600
+
+
+def parse_cron_field(field: str, low: int, high: int,
+                     names: Optional[dict] = None) -> List[int]:
+    """
+    cron 形式のフィールドの解析
+
+    '*'・'1,3'・'1-5'・'*/15'・'mon-fri' の形式に対応する。
+
+    :param field : フィールドの文字列
+    :param low   : 取り得る最小値
+    :param high  : 取り得る最大値
+    :param names : 名前と値の対応
+    :return      : 該当する値の一覧(昇順)
+    """
+    def to_int(value: str) -> int:
+        value = value.lower()
+        if names and value in names:
+            return names[value]
+        return int(value)
+
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = int(step_str)
+
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_str, end_str = part.split('-', 1)
+            start, end = to_int(start_str), to_int(end_str)
+        else:
+            start = to_int(part)
+            end = high if step != 1 else start
+
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'invalid cron field: {field}')
+        values.update(range(start, end + 1, step))
+
+    return sorted(values)
+
+
+class CronSchedule:
+    """
+    cron 形式の実行時刻
+
+    '分 時 日 月 曜日' の5つのフィールドで実行時刻を表す。
+    日と曜日の両方が指定された場合は、どちらかに一致すれば実行する。
+    """
+
+    def __init__(self, expression: str):
+        """
+        :param expression : cron 形式の文字列 (例: '30 9 * * mon,wed')
+        """
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'invalid cron expression: {expression}')
+
+        self.expression = expression
+        self.minutes  = parse_cron_field(fields[0], 0, 59)
+        self.hours    = set(parse_cron_field(fields[1], 0, 23))
+        self.days     = set(parse_cron_field(fields[2], 1, 31))
+        self.months   = set(parse_cron_field(fields[3], 1, 12, MONTH_NAMES))
+        # 0 と 7 はどちらも日曜日
+        weekdays = parse_cron_field(fields[4], 0, 7, WEEKDAY_NAMES)
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self._any_day     = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, day: datetime) -> bool:
+        day_match = day.day in self.days
+        # datetime.weekday() は月曜日が 0
+        weekday_match = (day.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, after: datetime) -> datetime:
+        """
+        次の実行時刻
+
+        :param after : 基準の時刻
+        :return      : 基準の時刻より後で最も早い実行時刻
+        """
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+        # 条件に一致しない月・日・時は丸ごと読み飛ばす
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0)
+                     + timedelta(days=32)).replace(day=1)
+                continue
+            if not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+                continue
+            for minute in self.minutes:
+                if minute >= t.minute:
+                    return t.replace(minute=minute)
+            t = t.replace(minute=0) + timedelta(hours=1)
+
+        raise ValueError(f'no run time for: {self.expression}')
+
+
+class Job:
+    """
+    定期実行ジョブ
+    """
+
+    def __init__(self, name: str, schedule: CronSchedule,
+                 action: Callable[[datetime], None],
+                 jitter: float = 0, catchup: float = 0):
+        """
+        :param name     : ジョブ名
+        :param schedule : 実行時刻
+        :param action   : 実行する処理 (予定されていた実行時刻を受け取る)
+        :param jitter   : 実行時刻をずらす最大秒数
+        :param catchup  : 停止中に実行し損ねた場合に後から実行する猶予(秒)
+        """
+        self.name = name
+        self.schedule = schedule
+        self.action = action
+        self.jitter = jitter
+        self.catchup = catchup
+
+
+class Scheduler:
+    """
+    ヒープによるジョブスケジューラ
+
+    次に実行すべきジョブの時刻まで眠り、時刻が来たジョブを
+    スレッドプールで実行する。一つのジョブが遅れても他のジョブは遅れない。
+    """
+
+    def __init__(self, workers: int = 4,
+                 clock: Callable[[], datetime] = datetime.now):
+        """
+        :param workers : ジョブを実行するスレッド数
+        :param clock   : 現在時刻を返す関数
+        """
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self.on_run: Optional[Callable[[Job, datetime], None]] = None
+
+    def add(self, job: Job, last_run: Optional[datetime] = None):
+        """
+        ジョブの登録
+
+        前回の実行時刻が分かっている場合、その後に予定されていた実行のうち
+        猶予時間内で最も新しいものを直ちに実行する。
+
+        :param job      : 登録するジョブ
+        :param last_run : 前回予定されていた実行時刻
+        """
+        now = self.clock()
+        if last_run is not None and job.catchup > 0:
+            # 何回分も停止していた場合も、猶予時間内の最後の予定まで進める
+            after = max(last_run, now - timedelta(seconds=job.catchup))
+            missed = None
+            scheduled = job.schedule.next_after(after)
+            while scheduled <= now:
+                missed = scheduled
+                scheduled = job.schedule.next_after(scheduled)
+            if missed is not None:
+                logger.info('catching up missed run of %s at %s',
+                            job.name, missed)
+                self._push(now, missed, job)
+                return
+
+        self._schedule_next(job, now)
+
+    def _schedule_next(self, job: Job, after: datetime):
+        scheduled = job.schedule.next_after(after)
+        due = scheduled
+        if job.jitter > 0:
+            due += timedelta(seconds=random.uniform(0, job.jitter))
+        self._push(due, scheduled, job)
+
+    def _push(self, due: datetime, scheduled: datetime, job: Job):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), scheduled, job))
+            self._cond.notify()
+
+    def run(self):
+        """
+        スケジューラの実行
+
+        stop() が呼ばれるまで処理を返さない。
+        """
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    now = self.clock()
+                    if self._heap and self._heap[0][0] <= now:
+                        due, _, scheduled, job = heapq.heappop(self._heap)
+                        break
+                    timeout = MAX_SLEEP
+                    if self._heap:
+                        timeout = min(
+                            timeout,
+                            (self._heap[0][0] - now).total_seconds()
+                        )
+                    self._cond.wait(timeout)
+                else:
+                    break
+
+            # 停止中の実行を取り戻した場合も、次回は現在時刻以降とする
+            self._schedule_next(job, max(scheduled, now))
+            self._executor.submit(self._run_job, job, scheduled)
+
+        self._executor.shutdown(wait=True)
+
+    def run_now(self, job: Job, scheduled: datetime):
+        """
+        ジョブの即時実行
+
+        予定されていた実行を、次回の予定を変えずに直ちに実行する。
+        (リーダーを引き継いだノードが、交代の間に実行されなかった分を
+        取り戻す場合など)
+
+        :param job       : 実行するジョブ
+        :param scheduled : 予定されていた実行時刻
+        """
+        logger.info('running %s scheduled at %s now', job.name, scheduled)
+        self._executor.submit(self._run_job, job, scheduled)
+
+    def _run_job(self, job: Job, scheduled: datetime):
+        try:
+            job.action(scheduled)
+        except Exception:
+            logger.exception('job %s failed', job.name)
+
+        if self.on_run is not None:
+            try:
+                self.on_run(job, scheduled)
+            except Exception:
+                logger.exception('failed to record the run of %s', job.name)
+
+    def stop(self):
+        """ スケジューラの停止 """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
@@ -0,0 +1,430 @@
+import logging
+import os
+import sqlite3
+import threading
+from itertools import groupby
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 参加者テーブルへの書き込み (操作の種類 -> SQL 文)
+WRITE_QUERIES = {
+    'add': (
+        'INSERT INTO lunch_participant(channel_id, session_date, username) '
+        'VALUES(?, ?, ?) '
+        'ON CONFLICT(channel_id, session_date, username) DO NOTHING'
+    ),
+    'remove': (
+        'DELETE FROM lunch_participant '
+        'WHERE channel_id = ? AND session_date = ? AND username = ?'
+    ),
+    'reset': 'DELETE FROM lunch_participant WHERE channel_id = ?',
+}
+
+
+class SessionState:
+    """
+    参加者の状態のメモリ上での管理
+
+    チャンネル・開催日ごとの参加者を、参加表明順を保つ集合(dict)として
+    メモリに保持し、人数確認などの参照はデータベースを参照せずに返す。
+    変更はメモリに反映した上で書き込み待ちに積み、書き込みスレッドが
+    flush_interval 秒ごと(または batch_size 件たまった時点)に
+    データベースファイルごとに一つのトランザクションでまとめて書き込む。
+
+    参加者はデータベースを正として、初めて参照したときに読み込み、
+    書き込み待ちの変更を重ねる。他のプロセス(定期通知のリセットなど)が
+    データベースを更新した場合は、書き込みスレッドが data_version の変化で
+    検知し、そのデータベースの参加者を読み込み直させる。
+
+    状態の持ち主はプロセスに一つだけのため、複数のワーカプロセスで
+    同じチャンネルを扱う構成では使えない。
+    """
+
+    def __init__(self, db_for: Callable[[str], str],
+                 busy_timeout: int = 5000, flush_interval: float = 0.1,
+                 batch_size: int = 100, trace: bool = False):
+        """
+        :param db_for         : チャンネルIDからデータベースファイルを求める関数
+        :param busy_timeout   : ロック解放を待つ最大時間(ミリ秒)
+        :param flush_interval : 書き込み待ちの変更を書き込む間隔(秒)
+        :param batch_size     : 間隔を待たずに書き込む書き込み待ちの件数
+        :param trace          : 実行した SQL 文の数を数えるか
+        """
+        self.db_for = db_for
+        self.busy_timeout = busy_timeout
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.trace = trace
+        self._pid = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        """
+        書き込みスレッドの起動
+
+        fork 後の子プロセスでは親プロセスのスレッドが存在しないため、
+        プロセスごとに状態・接続・スレッドを作り直す。
+        """
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+
+        with self._start_lock:
+            if self._pid == pid:
+                return
+
+            # (チャンネルID, 開催日) -> 参加表明順のユーザ名
+            self._rosters: Dict[Tuple[str, str], Dict[str, None]] = {}
+            # 書き込み待ち・書き込み中の変更 (データベースファイル, 操作, 値)
+            self._pending: List[Tuple[str, str, tuple]] = []
+            self._in_flight: List[Tuple[str, str, tuple]] = []
+            # 書き込みを終えるたびに進める (読み込み中の書き込みの検知に使う)
+            self._generation = 0
+            # 書き込み専用の接続 (データベースファイル -> (接続, data_version))
+            self._connections: Dict[str, list] = {}
+            self._flush_lock = threading.Lock()
+            self._wakeup = threading.Condition(self._lock)
+            self._closed = False
+
+            self._thread = threading.Thread(
+                target=self._run, name='hirumibot-session-state', daemon=True
+            )
+            self._thread.start()
+            self._pid = pid
+
+    def _load(self, channel_id: str, session_date: str) -> Dict[str, None]:
+        """
+        参加者の読み込み
+
+        データベースの参加者に、書き込み待ち・書き込み中の変更を重ねる。
+        読み込みの間に書き込みや他の接続による更新の検知があった場合は
+        読み込み直す。
+        呼び出し時に self._lock を取得していること(読み込み中は解放する)。
+        """
+        key = (channel_id, session_date)
+        db_file = self.db_for(channel_id)
+        while key not in self._rosters:
+            generation = self._generation
+            self._lock.release()
+            try:
+                # 読み込み後の他の接続による更新を検知できるよう、
+                # 読み込む前に書き込み専用の接続の data_version を控える
+                with self._flush_lock:
+                    self._write_connection(db_file)
+                c = database.connection(db_file, self.busy_timeout,
+                                        self.trace).cursor()
+                c.execute(
+                    'SELECT username FROM lunch_participant '
+                    'WHERE channel_id = ? AND session_date = ? ORDER BY rowid',
+                    key
+                )
+                roster = dict.fromkeys(username for username, in c.fetchall())
+            finally:
+                self._lock.acquire()
+            if generation != self._generation or key in self._rosters:
+                continue
+
+            for _, operation, values in self._in_flight + self._pending:
+                apply_operation(roster, key, operation, values)
+            # 開催日が変わったチャンネルの過去の参加者は捨てる
+            for old_key in [k for k in self._rosters if k[0] == channel_id]:
+                del self._rosters[old_key]
+            self._rosters[key] = roster
+            metrics.inc('hirumibot_session_state_loads_total')
+
+        return self._rosters[key]
+
+    def _write(self, channel_id: str, operation: str, values: tuple):
+        """
+        変更を書き込み待ちに積む
+
+        呼び出し時に self._lock を取得していること。
+        """
+        self._pending.append((self.db_for(channel_id), operation, values))
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.notify()
+
+    def members(self, channel_id: str, session_date: str) -> List[str]:
+        """
+        参加者の一覧
+
+        :param channel_id   : チャンネルID
+        :param session_date : 開催日
+        :return             : 参加表明順のユーザ名
+        """
+        self._start()
+        with self._lock:
+            return list(self._load(channel_id, session_date))
+
+    def add(self, channel_id: str, session_date: str, username: str) -> bool:
+        """
+        参加者の登録
+
+        :param channel_id   : チャンネルID
+        :param session_date : 開催日
+        :param username     : ユーザ名
+        :return             : 登録したか (登録済みであれば False)
+        """
+        self._start()
+        with self._lock:
+            roster = self._load(channel_id, session_date)
+            if username in roster:
+                return False
+            roster[username] = None
+            self._write(channel_id, 'add', (channel_id, session_date, username))
+            return True
+
+    def remove(self, channel_id: str, session_date: str,
+               username: str) -> bool:
+        """
+        参加者の削除
+
+        :param channel_id   : チャンネルID
+        :param session_date : 開催日
+        :param username     : ユーザ名
+        :return             : 削除したか (未登録であれば False)
+        """
+        self._start()
+        with self._lock:
+            roster = self._load(channel_id, session_date)
+            if username not in roster:
+                return False
+            del roster[username]
+            self._write(channel_id, 'remove',
+                        (channel_id, session_date, username))
+            return True
+
+    def add_all(self, channel_id: str, session_date: str,
+                usernames: Iterable[str]) -> List[str]:
+        """
+        複数の参加者の登録
+
+        :param channel_id   : チャンネルID
+        :param session_date : 開催日
+        :param usernames    : ユーザ名
+        :return             : 登録したユーザ名 (登録済みのユーザを除く)
+        """
+        self._start()
+        with self._lock:
+            roster = self._load(channel_id, session_date)
+            added = [username for username in dict.fromkeys(usernames)
+                     if username not in roster]
+            for username in added:
+                roster[username] = None
+                self._write(channel_id, 'add',
+                            (channel_id, session_date, username))
+            return added
+
+    def remove_all(self, channel_id: str, session_date: str,
+                   usernames: Iterable[str]) -> List[str]:
+        """
+        複数の参加者の削除
+
+        :param channel_id   : チャンネルID
+        :param session_date : 開催日
+        :param usernames    : ユーザ名
+        :return             : 削除したユーザ名 (未登録のユーザを除く)
+        """
+        self._start()
+        with self._lock:
+            roster = self._load(channel_id, session_date)
+            removed = [username for username in dict.fromkeys(usernames)
+                       if username in roster]
+            for username in removed:
+                del roster[username]
+                self._write(channel_id, 'remove',
+                            (channel_id, session_date, username))
+            return removed
+
+    def reset(self, channel_id: str):
+        """
+        参加者のリセット
+
+        チャンネルの参加者を、過去の開催日の分も含めて全て削除する。
+
+        :param channel_id : チャンネルID
+        """
+        self._start()
+        with self._lock:
+            for key in self._rosters:
+                if key[0] == channel_id:
+                    self._rosters[key] = {}
+            self._write(channel_id, 'reset', (channel_id,))
+
+    def flush(self):
+        """
+        書き込み待ちの変更の書き込み
+
+        書き込み待ちの変更を全てデータベースに書き込むまで待つ。
+        出発の班分けなど、データベースの参加者を参照する前に呼ぶ。
+        書き込めなかった場合は例外を送出する(変更は書き込み待ちに残る)。
+        """
+        self._start()
+        self._flush(raise_errors=True)
+
+    def _flush(self, raise_errors: bool = False):
+        """
+        書き込み待ちの変更を、データベースファイルごとに
+        一つのトランザクションで書き込む
+
+        同じ種類の変更が続く間は executemany でまとめて実行する。
+        書き込みは一つずつ行い、変更の順序を保つ。
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._in_flight, self._pending = self._pending, []
+                in_flight = self._in_flight
+
+            failed = []
+            error = None
+            with metrics.stage('session_state_flush'):
+                for db_file, changes in groupby(
+                    sorted(in_flight, key=lambda change: change[0]),
+                    key=lambda change: change[0]
+                ):
+                    changes = list(changes)
+                    try:
+                        self._write_changes(db_file, changes)
+                    except sqlite3.Error as e:
+                        metrics.inc('hirumibot_session_state_errors_total')
+                        logger.error('failed to write %d changes to %s: %s',
+                                     len(changes), db_file, e)
+                        failed.extend(changes)
+                        error = e
+            metrics.inc('hirumibot_session_state_writes_total',
+                        len(in_flight) - len(failed))
+
+            with self._lock:
+                self._pending = failed + self._pending
+                self._in_flight = []
+                self._generation += 1
+
+        if error is not None and raise_errors:
+            raise error
+
+    def _write_connection(self, db_file: str) -> list:
+        """
+        書き込み専用の接続
+
+        書き込みはこの接続だけで行い、data_version の変化を
+        他の接続(他のプロセス)による更新として扱う。
+        self._flush_lock を取得しているスレッドだけが使う。
+        """
+        entry = self._connections.get(db_file)
+        if entry is None:
+            conn = sqlite3.connect(db_file, timeout=self.busy_timeout / 1000,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            database.register_functions(conn)
+            if self.trace:
+                conn.set_trace_callback(database.count_statement)
+            version = conn.execute('PRAGMA data_version').fetchall()[0][0]
+            entry = self._connections[db_file] = [conn, version]
+        return entry
+
+    def _write_changes(self, db_file: str, changes: list):
+        """ 一つのデータベースファイルへの変更の書き込み """
+        conn = self._write_connection(db_file)[0]
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        try:
+            for operation, group in groupby(changes,
+                                            key=lambda change: change[1]):
+                c.executemany(WRITE_QUERIES[operation],
+                              [values for _, _, values in group])
+        except BaseException:
+            c.execute('ROLLBACK')
+            raise
+        else:
+            c.execute('COMMIT')
+        finally:
+            c.close()
+
+    def _check_external(self):
+        """
+        他の接続による更新の検知
+
+        書き込み専用の接続の data_version が変わっていれば、
+        そのデータベースファイルの参加者を次の参照時に読み込み直させる。
+        """
+        with self._flush_lock:
+            changed = []
+            for db_file, entry in self._connections.items():
+                version = entry[0].execute(
+                    'PRAGMA data_version'
+                ).fetchall()[0][0]
+                if version != entry[1]:
+                    entry[1] = version
+                    changed.append(db_file)
+            if not changed:
+                return
+
+            with self._lock:
+                for key in [key for key in self._rosters
+                            if self.db_for(key[0]) in changed]:
+                    del self._rosters[key]
+                self._generation += 1
+            metrics.inc('hirumibot_session_state_reloads_total')
+
+    def _run(self):
+        """ 書き込みスレッド """
+        while True:
+            with self._lock:
+                if len(self._pending) < self.batch_size and not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                closed = self._closed
+
+            try:
+                self._flush()
+                self._check_external()
+            except Exception:
+                logger.exception('session state writer failed')
+            if closed:
+                return
+
+    def close(self, timeout: float = 10):
+        """
+        書き込みスレッドの停止
+
+        書き込み待ちの変更を書き込んでから停止する。
+
+        :param timeout : 停止を待つ最大時間(秒)
+        """
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join(timeout)
+
+
+def apply_operation(roster: Dict[str, None], key: Tuple[str, str],
+                    operation: str, values: tuple):
+    """
+    読み込んだ参加者への変更の適用
+
+    :param roster    : 参加表明順のユーザ名
+    :param key       : (チャンネルID, 開催日)
+    :param operation : 変更の種類 (add / remove / reset)
+    :param values    : 変更の値 (WRITE_QUERIES のパラメータ)
+    """
+    if values[0] != key[0]:
+        return
+    if operation == 'reset':
+        roster.clear()
+    elif values[1] != key[1]:
+        return
+    elif operation == 'add':
+        roster.setdefault(values[2], None)
+    elif operation == 'remove':
+        roster.pop(values[2], None)
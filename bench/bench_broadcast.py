@@ -0,0 +1,81 @@
+import argparse
+import sys
+import time
+from collections import Counter
+
+from fake_mattermost import FakeMattermost
+from webhook_load import APP_DIR
+
+sys.path.insert(0, str(APP_DIR))
+
+from broadcast import Broadcaster
+from outbound import OutboundQueue
+
+
+def max_rate(received_at: list) -> int:
+    """ 1秒間に受け付けた投稿数の最大値 """
+    if not received_at:
+        return 0
+    start = min(received_at)
+    return max(Counter(int(t - start) for t in received_at).values())
+
+def run(fake: FakeMattermost, channels: int, concurrency: int,
+        rate: float, burst: int) -> dict:
+    """
+    一斉配信の計測
+
+    :param fake        : Mattermost の代替サーバ
+    :param channels    : 配信先のチャンネル数
+    :param concurrency : 同時に送信する最大数
+    :param rate        : 1秒あたりの最大送信数
+    :param burst       : 瞬間的に送信できる最大数
+    :return            : 計測値
+    """
+    fake.reset()
+    outbound = OutboundQueue(rate=rate, burst=burst)
+    broadcaster = Broadcaster(outbound, concurrency, retry_rounds=3,
+                              retry_interval=0.1)
+    channel_ids = [f'bench-channel-{n}' for n in range(channels)]
+
+    start = time.perf_counter()
+    result = broadcaster.broadcast(
+        fake.url, {'Content-Type': 'application/json'},
+        '18時です！:clock6:', channel_ids
+    )
+    elapsed = time.perf_counter() - start
+
+    return {
+        'elapsed': elapsed,
+        'delivered': len(result.delivered),
+        'failed': len(result.failed),
+        'max_rate': max_rate([post['received_at'] for post in fake.posts]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='一斉配信のベンチマーク')
+    parser.add_argument('--channels', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 16, 64])
+    parser.add_argument('--rate', type=float, default=100,
+                        help='1秒あたりの最大送信数')
+    parser.add_argument('--burst', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Mattermost の応答の遅延(秒)')
+    parser.add_argument('--error-rate', type=float, default=0)
+    args = parser.parse_args()
+
+    fake = FakeMattermost(latency=args.latency,
+                          error_rate=args.error_rate).start()
+
+    print(f"{'concurrency':>11} {'elapsed[s]':>11} {'delivered':>10} "
+          f"{'failed':>7} {'max posts/s':>12}")
+    for concurrency in args.concurrency:
+        result = run(fake, args.channels, concurrency, args.rate, args.burst)
+        print(f"{concurrency:>11} {result['elapsed']:>11.2f} "
+              f"{result['delivered']:>10} {result['failed']:>7} "
+              f"{result['max_rate']:>12}")
+
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import argparse
+import configparser
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from bench_coalesce import CapturingOutboundQueue
+from webhook_load import APP_DIR, write_settings
+
+CHANNEL_ID = 'bench-channel'
+
+
+class TransactionCounter:
+    """
+    書き込みトランザクションの計数 (SQL 文の実行の記録に使う)
+
+    BEGIN から COMMIT までと、トランザクション外の更新文を一つと数える。
+    executemany の各行やトリガー内の文は数えない。
+    (トリガーの実行は元の文と同じ文として記録されるため、直前と同じ文は除く)
+    """
+
+    def __init__(self):
+        self.transactions = 0
+        self._in_transaction = False
+        self._last = None
+
+    def __call__(self, statement: str):
+        if statement.startswith('--') or statement == self._last:
+            return
+        self._last = statement
+        word = statement.split(None, 1)[0].upper()
+        if word == 'BEGIN':
+            self._in_transaction = True
+        elif word in ('COMMIT', 'ROLLBACK'):
+            self._in_transaction = False
+            self.transactions += 1
+        elif (word in ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+              and not self._in_transaction):
+            self.transactions += 1
+
+
+def run_entries(members: int, memory: bool) -> dict:
+    """
+    一人ずつの参加表明とまとめての参加表明の比較
+    (HIRUMIBOT_SETTING の設定で hirumibot を読み込んだ子プロセスで実行する)
+    """
+    sys.path.insert(0, str(APP_DIR))
+    import database
+    # 接続を作る前に、実行した SQL 文の記録先を差し替える (DATABASE_TRACE)
+    counter = TransactionCounter()
+    database.count_statement = counter
+    import hirumibot
+    hirumibot.init_database()
+    # 受付時間内の水曜日に固定する
+    hirumibot.clock = lambda: datetime(2026, 10, 21, 11, 30)
+    outbound_queue = CapturingOutboundQueue()
+    hirumibot.outbound_queue = outbound_queue
+    usernames = [f'member{n:04d}' for n in range(members)]
+
+    def measure(payloads: list) -> dict:
+        hirumibot.reset_participant(CHANNEL_ID)
+        if memory:
+            hirumibot.session_state.flush()
+        outbound_queue.posts = []
+        transactions = counter.transactions
+        start = time.perf_counter()
+        for payload in payloads:
+            hirumibot.handle_webhook(dict(payload, channel_id=CHANNEL_ID),
+                                     'api')
+        if memory:
+            hirumibot.session_state.flush()
+        elapsed = time.perf_counter() - start
+        registered = hirumibot.list_participant(
+            hirumibot.session_connection(CHANNEL_ID).cursor(), CHANNEL_ID
+        )
+        assert registered == usernames, 'roster is broken'
+        return {
+            'webhooks': len(payloads),
+            'elapsed': elapsed,
+            'transactions': counter.transactions - transactions,
+            'posts': len(outbound_queue.posts),
+        }
+
+    # 本人がそれぞれ参加表明する場合と、幹事がまとめて参加表明する場合
+    return {
+        'single': measure([{'user_name': username,
+                            'text': '@hirumibot 参加します'}
+                           for username in usernames]),
+        'bulk': measure([{'user_name': 'organiser',
+                          'text': '@hirumibot 参加 ' + ' '.join(
+                              f'@{username}' for username in usernames
+                          )}]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='まとめての参加表明のベンチマーク'
+    )
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--child', choices=('sqlite', 'memory'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_entries(args.members, args.child == 'memory')))
+        return
+
+    print(f"{'state':<7} {'command':<7} {'webhooks':>9} {'time[ms]':>9} "
+          f"{'write tx':>9} {'posts':>6}")
+    for mode in ('sqlite', 'memory'):
+        work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-bulk-'))
+        setting_file = write_settings(work_dir,
+                                      'http://127.0.0.1:9/api/v4/posts',
+                                      0, 1, 'sync')
+        config = configparser.ConfigParser()
+        config.read(setting_file)
+        config['metrics']['DIRECTORY'] = ''
+        config['session_state'] = {'ENABLED': str(mode == 'memory').lower()}
+        with open(setting_file, 'w') as f:
+            config.write(f)
+
+        # 設定は読み込み時に決まるため、モードごとに別のプロセスで計測する
+        result = subprocess.run(
+            [sys.executable, __file__, '--child', mode,
+             '--members', str(args.members)],
+            env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+            stdout = subprocess.PIPE, check = True, text = True,
+        )
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        for command, entries in json.loads(result.stdout).items():
+            print(f"{mode:<7} {command:<7} {entries['webhooks']:>9} "
+                  f"{entries['elapsed'] * 1000:>9.2f} "
+                  f"{entries['transactions']:>9} {entries['posts']:>6}")
+
+if __name__ == '__main__':
+    main()
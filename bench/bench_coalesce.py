@@ -0,0 +1,140 @@
+import argparse
+import configparser
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from webhook_load import APP_DIR, write_settings
+
+CHANNEL_ID = 'bench-channel'
+
+
+class CapturingOutboundQueue:
+    """ 送信キューの代替 (投稿内容を送信順に記録する) """
+
+    def __init__(self):
+        self.posts = []
+
+    def put(self, url: str, headers: dict, data: dict) -> bool:
+        return self.put_all(url, headers, [data])
+
+    def put_all(self, url: str, headers: dict, posts: list) -> bool:
+        self.posts.extend(posts)
+        return True
+
+def counter_values(text: str, prefix: str) -> float:
+    """ /metrics の出力のうち prefix で始まる値の合計 """
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith(prefix))
+
+def run_burst(requests: int, seconds: float, participants: int) -> dict:
+    """
+    人数確認の集中の再現
+    (HIRUMIBOT_SETTING の設定で hirumibot を読み込んだ子プロセスで実行する)
+    """
+    sys.path.insert(0, str(APP_DIR))
+    import hirumibot
+    import metrics
+    hirumibot.init_database()
+    # 受付時間内の水曜日に固定する
+    hirumibot.clock = lambda: datetime(2026, 10, 21, 11, 0)
+    outbound_queue = CapturingOutboundQueue()
+    hirumibot.outbound_queue = outbound_queue
+    hirumibot.reset_participant(CHANNEL_ID)
+    for n in range(participants):
+        hirumibot.participant_registration(f'member{n:04d}', CHANNEL_ID)
+
+    statements = counter_values(metrics.render(),
+                                'hirumibot_db_statements_total')
+    replies = {}
+    start = time.perf_counter()
+    for n in range(requests):
+        # 集中の途中で一人参加する (参加者の版が変わる)
+        if n == requests // 2:
+            hirumibot.participant_registration('latecomer', CHANNEL_ID)
+        username = f'asker{n:04d}'
+        replies[username] = hirumibot.handle_webhook(
+            {'user_name': username, 'text': '@hirumibot 何人？',
+             'channel_id': CHANNEL_ID}, 'response'
+        )
+        time.sleep(max(0.0, start + (n + 1) * seconds / requests
+                       - time.perf_counter()))
+    if hirumibot.coalescer is not None:
+        hirumibot.coalescer.flush()
+    elapsed = time.perf_counter() - start
+
+    text = metrics.render()
+    # 返信の一覧 (応答で返したものと投稿したもの)
+    messages = [reply['text'] for reply in replies.values() if reply]
+    messages += [post['message'] for post in outbound_queue.posts]
+    mentioned = {word.lstrip('@') for message in messages
+                 for word in message.split() if word.startswith('@asker')}
+    return {
+        'elapsed': elapsed,
+        'computations': counter_values(
+            text, 'hirumibot_stage_seconds_count{stage="db_count_participant"}'
+        ),
+        'statements': counter_values(text, 'hirumibot_db_statements_total')
+                      - statements,
+        'replies': len(messages),
+        'answered': len(mentioned) if hirumibot.coalescer is not None
+                    else len(messages),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='人数確認の要求をまとめた場合のベンチマーク'
+    )
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--seconds', type=float, default=6,
+                        help='要求を送る時間(秒)')
+    parser.add_argument('--participants', type=int, default=40)
+    parser.add_argument('--windows', type=float, nargs='+',
+                        default=[0, 1, 2])
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_burst(args.requests, args.seconds,
+                                   args.participants)))
+        return
+
+    print(f"{'window[s]':>9} {'requests':>9} {'computed':>9} "
+          f"{'statements':>11} {'posts':>6} {'answered':>9}")
+    for window in args.windows:
+        work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-coalesce-'))
+        setting_file = write_settings(work_dir,
+                                      'http://127.0.0.1:9/api/v4/posts',
+                                      0, 1, 'sync')
+        config = configparser.ConfigParser()
+        config.read(setting_file)
+        config['metrics']['DIRECTORY'] = ''
+        config['coalesce'] = {'WINDOW': str(window)}
+        with open(setting_file, 'w') as f:
+            config.write(f)
+
+        # 設定は読み込み時に決まるため、窓ごとに別のプロセスで計測する
+        result = subprocess.run(
+            [sys.executable, __file__, '--child',
+             '--requests', str(args.requests),
+             '--seconds', str(args.seconds),
+             '--participants', str(args.participants)],
+            env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+            stdout = subprocess.PIPE, check = True, text = True,
+        )
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        burst = json.loads(result.stdout)
+        print(f"{window:>9} {args.requests:>9} {burst['computations']:>9.0f} "
+              f"{burst['statements']:>11.0f} {burst['replies']:>6} "
+              f"{burst['answered']:>9}")
+
+if __name__ == '__main__':
+    main()
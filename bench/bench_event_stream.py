@@ -0,0 +1,104 @@
+import argparse
+import configparser
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from fake_event_stream import FakeEventStream
+from webhook_load import APP_DIR, write_settings
+
+
+def wait_until(predicate, timeout: float, message: str):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() >= deadline:
+            raise RuntimeError(message)
+        time.sleep(0.005)
+
+def percentile(values: list, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='イベントストリームでのコマンド処理のベンチマーク'
+    )
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=200,
+                        help='1秒あたりの投稿数')
+    parser.add_argument('--disconnects', type=int, default=3,
+                        help='投稿中に接続を切断する回数')
+    args = parser.parse_args()
+
+    fake = FakeEventStream().start()
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-events-'))
+    setting_file = write_settings(work_dir, fake.url, 0, 1, 'sync')
+    config = configparser.ConfigParser()
+    config.read(setting_file)
+    # 返信の送信レートで律速しないようにする
+    config['outbound']['RATE'] = '10000'
+    config['outbound']['BURST'] = '10000'
+    config['websocket'] = {'RECONNECT_BACKOFF': '0.05'}
+    with open(setting_file, 'w') as f:
+        config.write(f)
+
+    process = subprocess.Popen(
+        [sys.executable, str(APP_DIR / 'event_stream.py')],
+        cwd = str(APP_DIR),
+        env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+    )
+    try:
+        wait_until(fake.connected, 30, 'event stream did not connect')
+
+        posted_at = {}
+        disconnect_at = {args.posts * (n + 1) // (args.disconnects + 1)
+                         for n in range(args.disconnects)}
+        start = time.perf_counter()
+        for seq in range(args.posts):
+            if seq in disconnect_at:
+                fake.disconnect()
+            channel_id = f'bench-channel-{seq % args.channels}'
+            user_name = f'user{seq}'
+            posted_at[user_name] = time.time()
+            fake.post(channel_id, user_name, '@hirumibot 参加します debug')
+            time.sleep(max(0.0, start + (seq + 1) / args.rate
+                           - time.perf_counter()))
+
+        wait_until(lambda: len(fake.posts) >= args.posts, 60,
+                   f'only {len(fake.posts)} of {args.posts} replies arrived')
+        # 重複した返信がないことを確かめるため少し待つ
+        time.sleep(0.5)
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    replied = Counter()
+    latencies = []
+    for post in fake.posts:
+        user_name = post['message'].split()[0].lstrip('@')
+        replied[user_name] += 1
+        latencies.append(post['received_at'] - posted_at[user_name])
+
+    print(f'posts        : {args.posts} in {elapsed:.2f}s '
+          f'({args.disconnects} disconnects)')
+    print(f"connects     : {fake.connects['new']} new, "
+          f"{fake.connects['resumed']} resumed")
+    print(f'replies      : {len(fake.posts)} '
+          f'(missing {args.posts - len(replied)}, '
+          f'duplicated {sum(n - 1 for n in replied.values() if n > 1)})')
+    print(f'latency [ms] : p50 {statistics.median(latencies) * 1000:.1f}, '
+          f'p99 {percentile(latencies, 0.99) * 1000:.1f}')
+
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+p = Path(__file__)
+sys.path.insert(0, str(p.resolve().parent.parent / 'app'))
+
+import grouping
+
+def simulate_history(members: list, weeks: int, min_num: int, max_num: int,
+                     rng: random.Random) -> dict:
+    """
+    過去の班分け履歴の生成
+
+    毎週ランダムに班分けしたものとして、同じ班になった回数を作る。
+
+    :param members : 参加者のユーザ名
+    :param weeks   : 週数
+    :param min_num : 一班の最小人数
+    :param max_num : 一班の最大人数
+    :param rng     : 乱数生成器
+    :return        : 過去に同じ班になった回数
+    """
+    history = {}
+    for _ in range(weeks):
+        groups = grouping.partition(members, min_num, max_num, rng=rng)
+        for pair in grouping.group_pairs(groups):
+            history[pair] = history.get(pair, 0) + 1
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description='班分けのベンチマーク')
+    parser.add_argument('--sizes', default='10,100,1000,3000,10000')
+    parser.add_argument('--weeks', type=int, default=8)
+    parser.add_argument('--min', dest='min_num', type=int, default=3)
+    parser.add_argument('--max', dest='max_num', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'members':>8} {'history':>8} {'random':>8} {'optimized':>10} "
+          f"{'time[ms]':>9}")
+    for member_num in map(int, args.sizes.split(',')):
+        members = [f'user{idx:05d}' for idx in range(member_num)]
+        history = simulate_history(members, args.weeks,
+                                   args.min_num, args.max_num, rng)
+
+        baseline = grouping.partition(members, args.min_num, args.max_num,
+                                      rng=rng)
+
+        start = time.perf_counter()
+        groups = grouping.partition(members, args.min_num, args.max_num,
+                                    history=history, rng=rng)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        print(f'{member_num:>8} {len(history):>8} '
+              f'{grouping.repeat_pairs(baseline, history):>8.0f} '
+              f'{grouping.repeat_pairs(groups, history):>10.0f} '
+              f'{elapsed:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from webhook_load import APP_DIR, write_settings
+
+sys.path.insert(0, str(APP_DIR))
+
+
+class Node:
+    """ 一つのノードの通知スケジューラ (リースと通知ジョブ) """
+
+    def __init__(self, name: str, notice, hirumibot, leader, scheduler,
+                 ttl: float, renew_interval: float, fired: Counter):
+        self.lease = leader.LeaderLease(
+            hirumibot.LEADER_DB, 'notice', holder=name, ttl=ttl,
+            renew_interval=renew_interval,
+            journal_mode=hirumibot.LEADER_JOURNAL_MODE
+        )
+        self.scheduler = scheduler.Scheduler(workers=2)
+
+        def post(scheduled: datetime):
+            fired[scheduled] += 1
+        self.job = scheduler.Job(
+            'bench', scheduler.CronSchedule('* * * * *'),
+            notice.exactly_once('bench', post, self.lease), catchup=3600
+        )
+        self.lease.on_elected = (
+            lambda: notice.catch_up(self.scheduler, [self.job])
+        )
+
+    def fire(self, scheduled: datetime):
+        """ 全ノードのスケジューラが同じ時刻に通知ジョブを起動したとする """
+        self.scheduler.run_now(self.job, scheduled)
+
+    def crash(self):
+        """ リースを手放さずに停止する (異常終了) """
+        self.lease._stopped.set()
+        self.lease._leader = False
+
+def wait_leader(nodes: list, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        leaders = [node for node in nodes if node.lease.is_leader]
+        if leaders:
+            return leaders
+        time.sleep(0.01)
+    return []
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='通知のリーダー選出と引き継ぎの試験'
+    )
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--instances', type=int, default=30,
+                        help='通知ジョブを起動する回数')
+    parser.add_argument('--ttl', type=float, default=1.5)
+    parser.add_argument('--renew-interval', type=float, default=0.5)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-leader-'))
+    setting_file = write_settings(work_dir, 'http://127.0.0.1:9/api/v4/posts',
+                                  0, 1, 'sync')
+    config = configparser.ConfigParser()
+    config.read(setting_file)
+    config['metrics']['DIRECTORY'] = ''
+    with open(setting_file, 'w') as f:
+        config.write(f)
+    os.environ['HIRUMIBOT_SETTING'] = str(setting_file)
+
+    import hirumibot
+    import leader
+    import notice
+    import scheduler
+    hirumibot.init_database()
+
+    fired = Counter()
+    nodes = [Node(f'node{n}', notice, hirumibot, leader, scheduler,
+                  args.ttl, args.renew_interval, fired)
+             for n in range(args.nodes)]
+    for node in nodes:
+        node.lease.start()
+    wait_leader(nodes, args.ttl * 2)
+
+    takeovers = []
+    issued = []
+    base = datetime.now().replace(second=0, microsecond=0)
+    for n in range(args.instances):
+        scheduled = base - timedelta(minutes=args.instances - n)
+        issued.append(scheduled)
+        # 3回に1回、起動の直前にリーダーを停止する (交互に正常終了と異常終了)
+        if n % 3 == 1:
+            leaders = [node for node in nodes if node.lease.is_leader]
+            if leaders and len(nodes) > 1:
+                old = leaders[0]
+                nodes.remove(old)
+                start = time.monotonic()
+                if n % 2:
+                    old.lease.stop()
+                    kind = 'release'
+                else:
+                    old.crash()
+                    kind = 'crash'
+                for node in nodes:
+                    node.fire(scheduled)
+                if wait_leader(nodes, args.ttl * 3):
+                    takeovers.append((kind, time.monotonic() - start))
+                # 停止したノードの代わりを起動する
+                replacement = Node(f'node{args.nodes + n}', notice, hirumibot,
+                                   leader, scheduler, args.ttl,
+                                   args.renew_interval, fired)
+                replacement.lease.start()
+                nodes.append(replacement)
+                time.sleep(args.renew_interval)
+                continue
+        for node in nodes:
+            node.fire(scheduled)
+        time.sleep(0.05)
+
+    time.sleep(args.renew_interval * 2)
+    for node in nodes:
+        node.lease.stop()
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    # 引き継いだリーダーは猶予時間内の他の時刻の分も実行するため、
+    # 起動した時刻の分だけを数える
+    missing = sum(1 for scheduled in issued if fired[scheduled] == 0)
+    duplicated = sum(1 for count in fired.values() if count > 1)
+    print(f'instances : {len(issued)} '
+          f'(missing {missing}, duplicated {duplicated}, '
+          f'{len(fired)} fired including catch-up)')
+    for kind in ('release', 'crash'):
+        seconds = [elapsed for k, elapsed in takeovers if k == kind]
+        if seconds:
+            print(f'takeover after {kind:<7}: '
+                  f'max {max(seconds):.2f}s over {len(seconds)} '
+                  f'(ttl {args.ttl}s, renew {args.renew_interval}s)')
+
+if __name__ == '__main__':
+    main()
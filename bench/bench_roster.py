@@ -0,0 +1,147 @@
+import argparse
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from webhook_load import APP_DIR, write_settings
+
+sys.path.insert(0, str(APP_DIR))
+
+CHANNEL_ID = 'bench-channel'
+
+
+class CapturingOutboundQueue:
+    """ 送信キューの代替 (投稿内容を送信順に記録する) """
+
+    def __init__(self):
+        self.posts = []
+
+    def put(self, url: str, headers: dict, data: dict) -> bool:
+        return self.put_all(url, headers, [data])
+
+    def put_all(self, url: str, headers: dict, posts: list) -> bool:
+        self.posts.extend(posts)
+        return True
+
+def legacy_roster(hirumibot, usernames: list) -> str:
+    """ 以前の実装と同じ、一人ずつ += で連結する一覧 """
+    bot_reply_msg = hirumibot.catalogue.render('count_header',
+                                               count=len(usernames))
+    for username in usernames:
+        bot_reply_msg += hirumibot.catalogue.render('member', user=username)
+    return bot_reply_msg
+
+def best_of(runs: int, func) -> float:
+    """ runs 回実行したうちの最短時間(秒) """
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+def register(hirumibot, usernames: list):
+    with hirumibot.session_transaction(CHANNEL_ID) as c:
+        c.execute('DELETE FROM lunch_participant WHERE channel_id = ?',
+                  (CHANNEL_ID,))
+        c.executemany(
+            'INSERT INTO lunch_participant(channel_id, session_date, username) '
+            'VALUES(?, ?, ?)',
+            [(CHANNEL_ID, hirumibot.session_date(), username)
+             for username in usernames]
+        )
+
+def check_posts(posts: list, usernames: list, limit: int):
+    """ 全員が順番どおりに一度ずつ載り、各投稿が上限以下であることの確認 """
+    assert all(len(post['message']) <= limit for post in posts)
+    listed = [line[1:] for post in posts
+              for line in post['message'].splitlines()
+              if line.startswith('@')]
+    assert listed == usernames, 'roster is broken'
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='参加者一覧の作成と投稿の分割のベンチマーク'
+    )
+    parser.add_argument('--participants', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-roster-'))
+    setting_file = write_settings(work_dir, 'http://127.0.0.1:9/api/v4/posts',
+                                  0, 1, 'sync', reply_mode='response')
+    config = configparser.ConfigParser()
+    config.read(setting_file)
+    config['metrics']['DIRECTORY'] = ''
+    # 人数確認の返信を直ちに投稿させる
+    config['coalesce'] = {'WINDOW': '0'}
+    with open(setting_file, 'w') as f:
+        config.write(f)
+    os.environ['HIRUMIBOT_SETTING'] = str(setting_file)
+
+    import hirumibot
+    hirumibot.init_database()
+    # 受付時間内の水曜日に固定する
+    hirumibot.clock = lambda: datetime(2026, 10, 21, 11, 30)
+    outbound_queue = CapturingOutboundQueue()
+    hirumibot.outbound_queue = outbound_queue
+    limit = hirumibot.POST_MAX_LENGTH
+
+    print(f"{'participants':>12} {'legacy[ms]':>11} {'roster[ms]':>11} "
+          f"{'count[ms]':>10} {'depart[ms]':>11} {'count posts':>12} "
+          f"{'depart posts':>13}")
+    for participant_num in args.participants:
+        usernames = [f'member{n:05d}' for n in range(participant_num)]
+        register(hirumibot, usernames)
+
+        legacy = best_of(args.runs,
+                         lambda: legacy_roster(hirumibot, usernames))
+        roster = best_of(args.runs, lambda: hirumibot.split_posts([
+            hirumibot.catalogue.render('count_header', count=participant_num),
+            hirumibot.roster_block(usernames),
+        ], limit))
+        # 参加者の読み込みを含めた人数確認
+        count = best_of(args.runs, lambda: hirumibot.split_posts(
+            hirumibot.count_participant(CHANNEL_ID), limit
+        ))
+
+        outbound_queue.posts = []
+        hirumibot.handle_webhook({'user_name': 'bench', 'text': 'count',
+                                  'channel_id': CHANNEL_ID}, 'api')
+        check_posts(outbound_queue.posts, usernames, limit)
+        count_posts = len(outbound_queue.posts)
+
+        # 班分け(grouping)を除いた、班ごとの一覧の作成と分割の時間
+        groups = [usernames[n:n + 4] for n in range(0, participant_num, 4)]
+        depart = best_of(args.runs, lambda: hirumibot.split_posts(
+            [hirumibot.catalogue.render('depart_header')] + [
+                hirumibot.catalogue.render('depart_group', group_num=n)
+                + hirumibot.roster_block(group)
+                for n, group in enumerate(groups, 1)
+            ], limit
+        ))
+
+        outbound_queue.posts = []
+        hirumibot.handle_webhook({'user_name': 'bench', 'text': 'go',
+                                  'channel_id': CHANNEL_ID}, 'api')
+        depart_posts = outbound_queue.posts
+        assert all(len(post['message']) <= limit for post in depart_posts)
+        # 班の途中で投稿が分かれていないこと
+        assert all(post['message'].startswith(('はーい', '######'))
+                   for post in depart_posts)
+
+        print(f'{participant_num:>12} {legacy * 1000:>11.2f} '
+              f'{roster * 1000:>11.2f} {count * 1000:>10.2f} '
+              f'{depart * 1000:>11.2f} '
+              f'{count_posts:>12} {len(depart_posts):>13}')
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
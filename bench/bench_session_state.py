@@ -0,0 +1,106 @@
+import argparse
+import configparser
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from webhook_load import APP_DIR, write_settings
+
+CHANNEL_ID = 'bench-channel'
+
+
+def percentile(values: list, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def timed_calls(func, args_list: list) -> list:
+    seconds = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+def run_commands(participants: int, counts: int) -> dict:
+    """
+    参加登録・人数確認・取り消し・出発の処理時間の計測
+    (HIRUMIBOT_SETTING の設定で hirumibot を読み込んだ子プロセスで実行する)
+    """
+    sys.path.insert(0, str(APP_DIR))
+    import hirumibot
+    hirumibot.init_database()
+    # 受付時間内の水曜日に固定する
+    hirumibot.clock = lambda: datetime(2026, 10, 21, 11, 30)
+    hirumibot.reset_participant(CHANNEL_ID)
+
+    usernames = [f'member{n:05d}' for n in range(participants)]
+    latencies = {
+        'entry': timed_calls(hirumibot.participant_registration,
+                             [(username, CHANNEL_ID)
+                              for username in usernames]),
+        'count': timed_calls(hirumibot.count_participant,
+                             [(CHANNEL_ID,)] * counts),
+        'cancel': timed_calls(hirumibot.cancel_participation,
+                              [(username, CHANNEL_ID)
+                               for username in usernames[::10]]),
+    }
+    start = time.perf_counter()
+    hirumibot.depart_lunch_meetig(CHANNEL_ID)
+    latencies['go'] = [time.perf_counter() - start]
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='参加者の状態をメモリに保持した場合のベンチマーク'
+    )
+    parser.add_argument('--participants', type=int, default=300)
+    parser.add_argument('--counts', type=int, default=1000)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_commands(args.participants, args.counts)))
+        return
+
+    print(f"{'mode':<8} {'command':<8} {'count':>6} {'p50[ms]':>9} "
+          f"{'p99[ms]':>9} {'total[ms]':>10}")
+    for mode in ('sqlite', 'memory'):
+        work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-session-'))
+        setting_file = write_settings(work_dir,
+                                      'http://127.0.0.1:9/api/v4/posts',
+                                      0, 1, 'sync')
+        config = configparser.ConfigParser()
+        config.read(setting_file)
+        config['metrics']['DIRECTORY'] = ''
+        config['session_state'] = {
+            'ENABLED': str(mode == 'memory').lower(),
+        }
+        with open(setting_file, 'w') as f:
+            config.write(f)
+
+        # 設定は読み込み時に決まるため、モードごとに別のプロセスで計測する
+        result = subprocess.run(
+            [sys.executable, __file__, '--child',
+             '--participants', str(args.participants),
+             '--counts', str(args.counts)],
+            env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+            stdout = subprocess.PIPE, check = True, text = True,
+        )
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+        for command, values in json.loads(result.stdout).items():
+            print(f'{mode:<8} {command:<8} {len(values):>6} '
+                  f'{statistics.median(values) * 1000:>9.3f} '
+                  f'{percentile(values, 0.99) * 1000:>9.3f} '
+                  f'{sum(values) * 1000:>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import requests
+
+from fake_mattermost import FakeMattermost
+from webhook_load import APP_DIR, webhook_payload, write_settings
+
+# 読み込み時間を計るモジュール
+MODULES = ('hirumibot', 'notice', 'lunch_meeting', 'lunch_meeting_async')
+
+
+def import_seconds(module: str, env: dict) -> float:
+    """
+    モジュールの読み込み時間
+
+    新しいプロセスでモジュールを読み込み、その時間を計る。
+
+    :param module : モジュール名
+    :param env    : 環境変数
+    :return       : 読み込み時間(秒)
+    """
+    code = (
+        'import time\n'
+        'start = time.perf_counter()\n'
+        f'import {module}\n'
+        'print(time.perf_counter() - start)\n'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=str(APP_DIR), env=env,
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.splitlines()[-1])
+
+def wait_first_response(base_url: str, process: subprocess.Popen,
+                        timeout: float = 60) -> float:
+    """
+    最初の応答までの待機
+
+    /hirumibot にヘルプの問い合わせを送り続け、応答が返るまで待つ。
+
+    :return : 待機を始めてから応答が返るまでの時間(秒)
+    """
+    start = time.perf_counter()
+    deadline = time.monotonic() + timeout
+    seq = 0
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        seq += 1
+        try:
+            response = requests.post(
+                f'{base_url}/hirumibot',
+                json = webhook_payload('help', 'bench', 'bench-channel', seq),
+                timeout = 1,
+            )
+            if response.status_code == 200:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.005)
+    raise RuntimeError('server did not respond')
+
+def server_args(server: str, work_dir: Path) -> list:
+    if server == 'asyncio':
+        return [sys.executable, str(APP_DIR / 'lunch_meeting_async.py')]
+    return ['gunicorn', '--chdir', str(APP_DIR), 'lunch_meeting:app',
+            '-c', str(work_dir / 'gunicorn_conf.py')]
+
+def worker_pids(pid: int) -> list:
+    """ 子プロセスの PID (Linux の /proc から取得) """
+    children = Path(f'/proc/{pid}/task/{pid}/children')
+    if not children.exists():
+        return []
+    return [int(child) for child in children.read_text().split()]
+
+def bench_server(server: str, preload: bool, fake: FakeMattermost,
+                 port: int, runs: int) -> dict:
+    """
+    サーバの起動時間の計測
+
+    起動から最初の応答までの時間と、gunicorn の場合はワーカを強制終了してから
+    代わりのワーカが応答するまでの時間を計る。
+
+    :return : 計測値の一覧
+    """
+    results = {'first_response': [], 'worker_restart': []}
+    for _ in range(runs):
+        work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-startup-'))
+        setting_file = write_settings(work_dir, fake.url, port, 1, 'sync',
+                                      preload=preload)
+        base_url = f'http://127.0.0.1:{port}'
+
+        process = subprocess.Popen(
+            server_args(server, work_dir),
+            cwd = str(APP_DIR),
+            env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+        )
+        try:
+            start = time.perf_counter()
+            wait_first_response(base_url, process)
+            results['first_response'].append(time.perf_counter() - start)
+
+            workers = worker_pids(process.pid) if server == 'gunicorn' else []
+            if workers:
+                start = time.perf_counter()
+                os.kill(workers[0], signal.SIGKILL)
+                # 強制終了したワーカが消えるのを待ってから応答を確かめる
+                while workers[0] in worker_pids(process.pid):
+                    time.sleep(0.001)
+                wait_first_response(base_url, process)
+                results['worker_restart'].append(time.perf_counter() - start)
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(work_dir, ignore_errors=True)
+            # 待ち受けポートが解放されるのを待つ
+            time.sleep(0.2)
+
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='起動時間のベンチマーク')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=18090)
+    args = parser.parse_args()
+
+    fake = FakeMattermost().start()
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-startup-'))
+    try:
+        setting_file = write_settings(work_dir, fake.url, args.port, 1, 'sync')
+        env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file))
+
+        print(f"{'module':<22} {'import p50[ms]':>15} {'min[ms]':>9}")
+        for module in MODULES:
+            seconds = [import_seconds(module, env) for _ in range(args.runs)]
+            print(f'{module:<22} {statistics.median(seconds) * 1000:>15.1f} '
+                  f'{min(seconds) * 1000:>9.1f}')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"\n{'server':<22} {'first response p50[ms]':>23} "
+          f"{'worker restart p50[ms]':>23}")
+    for server, preload in (('gunicorn', True), ('gunicorn', False),
+                            ('asyncio', False)):
+        results = bench_server(server, preload, fake, args.port, args.runs)
+        name = f"{server}{' (preload)' if preload else ''}"
+        restart = results['worker_restart']
+        restart_ms = (f'{statistics.median(restart) * 1000:>23.1f}'
+                      if restart else f"{'-':>23}")
+        print(f"{name:<22} "
+              f"{statistics.median(results['first_response']) * 1000:>23.1f} "
+              f'{restart_ms}')
+
+    fake.stop()
+
+if __name__ == '__main__':
+    main()
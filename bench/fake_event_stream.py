@@ -0,0 +1,212 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+import uuid
+
+from aiohttp import web
+
+# Botアカウントのユーザ ID
+BOT_USER_ID = 'hirumibot-user-id'
+
+
+class FakeEventStream:
+    """
+    Mattermost のイベントストリームの代替サーバ
+
+    /api/v4/websocket で Mattermost と同じ形式のイベントを配信する。
+    イベントには接続ごとのシーケンス番号を付け、接続IDと sequence_number を
+    付けて再接続されたときは、切断中のイベントを再送して再開する。
+    /api/v4/posts への投稿は記録し、その投稿の posted イベントも配信する。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 token: str = 'bench-token', buffer: int = 1000):
+        """
+        :param host   : 待ち受けるアドレス
+        :param port   : 待ち受けるポート (0 なら空いているポート)
+        :param token  : 受け付けるトークン
+        :param buffer : 切断中のイベントを保持する数 (超えると再開できない)
+        """
+        self.host = host
+        self.port = port
+        self.token = token
+        self.buffer = buffer
+        self.posts = []
+        self.connects = {'new': 0, 'resumed': 0}
+        # 接続ID -> {'events': 配信したイベント, 'ws': 接続中の WebSocket}
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._started = threading.Event()
+
+    @property
+    def url(self) -> str:
+        """ 投稿 API の URL """
+        return f'http://{self.host}:{self.port}/api/v4/posts'
+
+    def start(self) -> 'FakeEventStream':
+        """ 別スレッドで待ち受けを開始する """
+        threading.Thread(target=self._run, daemon=True).start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        """ 待ち受けを停止する """
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(),
+                                         self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get('/api/v4/users/me', self._users_me)
+        app.router.add_get('/api/v4/websocket', self._websocket)
+        app.router.add_post('/api/v4/posts', self._create_post)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = self._runner.addresses[0][1]
+        self._started.set()
+        self._loop.run_forever()
+
+    def _authorized(self, request: web.Request) -> bool:
+        return request.headers.get('Authorization') == 'Bearer ' + self.token
+
+    async def _users_me(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({'message': 'unauthorized'}, status=401)
+        return web.json_response({'id': BOT_USER_ID, 'username': 'hirumibot'})
+
+    async def _create_post(self, request: web.Request) -> web.Response:
+        if not self._authorized(request):
+            return web.json_response({'message': 'unauthorized'}, status=401)
+
+        post = await request.json()
+        post['received_at'] = time.time()
+        with self._lock:
+            self.posts.append(post)
+            post_id = f'reply{len(self.posts)}'
+        await self._publish_post(post_id, post['channel_id'], BOT_USER_ID,
+                                 'hirumibot', post['message'], mention=False)
+        return web.json_response({'id': post_id, **post}, status=201)
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        if not self._authorized(request):
+            return web.json_response({'message': 'unauthorized'}, status=401)
+
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        connection_id = request.query.get('connection_id')
+        sequence_number = int(request.query.get('sequence_number', -1))
+        connection = self._connections.get(connection_id)
+        if (connection is not None
+                and len(connection['events']) - sequence_number
+                <= self.buffer):
+            # 切断中のイベントから再開する
+            self.connects['resumed'] += 1
+            connection['ws'] = ws
+            for event in connection['events'][sequence_number:]:
+                await ws.send_str(event)
+        else:
+            self.connects['new'] += 1
+            connection_id = uuid.uuid4().hex
+            connection = {'events': [], 'ws': ws}
+            self._connections[connection_id] = connection
+            await self._send(connection, 'hello',
+                             {'connection_id': connection_id,
+                              'server_version': 'fake'})
+
+        async for _ in ws:
+            pass
+        if connection['ws'] is ws:
+            connection['ws'] = None
+        return ws
+
+    async def _send(self, connection: dict, event: str, data: dict):
+        """ シーケンス番号を付けてイベントを配信する (切断中は保持のみ) """
+        message = json.dumps({
+            'event': event, 'data': data, 'broadcast': {},
+            'seq': len(connection['events']),
+        })
+        connection['events'].append(message)
+        if connection['ws'] is not None and not connection['ws'].closed:
+            try:
+                await connection['ws'].send_str(message)
+            except ConnectionError:
+                pass
+
+    async def _publish_post(self, post_id: str, channel_id: str,
+                            user_id: str, user_name: str, message: str,
+                            mention: bool = True):
+        post = {
+            'id': post_id, 'channel_id': channel_id, 'user_id': user_id,
+            'message': message, 'create_at': int(time.time() * 1000),
+        }
+        data = {
+            'post': json.dumps(post),
+            'channel_type': 'O',
+            'channel_name': 'lunch',
+            'sender_name': '@' + user_name,
+        }
+        if mention:
+            data['mentions'] = json.dumps([BOT_USER_ID])
+        for connection in list(self._connections.values()):
+            await self._send(connection, 'posted', data)
+
+    def post(self, channel_id: str, user_name: str, message: str,
+             mention: bool = True) -> str:
+        """
+        ユーザの投稿
+
+        :param channel_id : 投稿するチャンネルID
+        :param user_name  : 投稿するユーザ名
+        :param message    : 投稿内容
+        :param mention    : Botアカウント宛てのメンションを含むか
+        :return           : 投稿ID
+        """
+        post_id = uuid.uuid4().hex
+        asyncio.run_coroutine_threadsafe(
+            self._publish_post(post_id, channel_id, f'id-{user_name}',
+                               user_name, message, mention),
+            self._loop
+        ).result()
+        return post_id
+
+    def disconnect(self):
+        """ 全ての接続を切断する (接続IDとイベントは保持する) """
+        async def close_all():
+            for connection in self._connections.values():
+                if connection['ws'] is not None:
+                    await connection['ws'].close()
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result()
+
+    def connected(self) -> bool:
+        """ 接続中のクライアントがいるか """
+        return any(connection['ws'] is not None
+                   for connection in list(self._connections.values()))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Mattermost のイベントストリームの代替サーバ'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8065)
+    parser.add_argument('--token', default='bench-token')
+    args = parser.parse_args()
+
+    fake = FakeEventStream(args.host, args.port, args.token).start()
+    print(f'listening on {fake.url}', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    print(f'{len(fake.posts)} posts')
+
+if __name__ == '__main__':
+    main()
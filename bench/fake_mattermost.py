@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeMattermost:
+    """
+    Mattermost の代替サーバ
+
+    /api/v4/posts への投稿を記録する。
+    応答の遅延とエラーを設定でき、負荷試験で Mattermost の代わりに使う。
+    GET /posts で記録した投稿を、DELETE /posts で記録の消去を行う。
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0, jitter: float = 0,
+                 error_rate: float = 0, error_status: int = 500,
+                 retry_after: float = 1):
+        """
+        :param host         : 待ち受けるアドレス
+        :param port         : 待ち受けるポート (0 なら空いているポート)
+        :param latency      : 応答の遅延(秒)
+        :param jitter       : 応答の遅延に加えるばらつきの最大値(秒)
+        :param error_rate   : エラーを返す割合 (0～1)
+        :param error_status : エラー時の HTTP ステータス
+        :param retry_after  : 429 を返すときの Retry-After (秒)
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.posts = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.path != '/api/v4/posts':
+                    self._reply(404, {'message': 'not found'})
+                    return
+
+                delay = fake.latency + random.uniform(0, fake.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+
+                if random.random() < fake.error_rate:
+                    with fake._lock:
+                        fake.errors += 1
+                    headers = {}
+                    if fake.error_status == 429:
+                        headers['Retry-After'] = str(fake.retry_after)
+                    self._reply(fake.error_status,
+                                {'message': 'injected error'}, headers)
+                    return
+
+                post = json.loads(body)
+                post['received_at'] = time.time()
+                post['authorization'] = self.headers.get('Authorization')
+                with fake._lock:
+                    fake.posts.append(post)
+                    post_id = f'post{len(fake.posts)}'
+                self._reply(201, {'id': post_id, **post})
+
+            def do_GET(self):
+                if self.path != '/posts':
+                    self._reply(404, {'message': 'not found'})
+                    return
+                with fake._lock:
+                    self._reply(200, {'posts': fake.posts,
+                                      'errors': fake.errors})
+
+            def do_DELETE(self):
+                fake.reset()
+                self._reply(200, {})
+
+            def _reply(self, status: int, data: dict, headers: dict = None):
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        """ 投稿 API の URL """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/api/v4/posts'
+
+    def start(self) -> 'FakeMattermost':
+        """ 別スレッドで待ち受けを開始する """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """ 待ち受けを停止する """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset(self):
+        """ 記録した投稿を消去する """
+        with self._lock:
+            self.posts = []
+            self.errors = 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Mattermost の代替サーバ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8065)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='応答の遅延(秒)')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='応答の遅延のばらつき(秒)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='エラーを返す割合 (0～1)')
+    parser.add_argument('--error-status', type=int, default=500)
+    args = parser.parse_args()
+
+    fake = FakeMattermost(args.host, args.port, args.latency, args.jitter,
+                          args.error_rate, args.error_status)
+    print(f'listening on {fake.url}', flush=True)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f'{len(fake.posts)} posts, {fake.errors} injected errors')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import configparser
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+from webhook_load import APP_DIR, write_settings
+
+sys.path.insert(0, str(APP_DIR))
+
+from recorder import read_recording
+
+
+class StubOutboundQueue:
+    """
+    送信キューの代替
+
+    Mattermost へは送らず、投稿数だけを数える。
+    """
+
+    def __init__(self):
+        self.posts = 0
+
+    def put(self, url: str, headers: dict, data: dict) -> bool:
+        return self.put_all(url, headers, [data])
+
+    def put_all(self, url: str, headers: dict, posts: list) -> bool:
+        self.posts += len(posts)
+        return True
+
+    def join(self, timeout: float = None) -> bool:
+        return True
+
+def command_name(hirumibot, text: str) -> str:
+    """ 集計に使うコマンド名 """
+    if hirumibot.admin_command(text) is not None:
+        return 'admin'
+    return hirumibot.keyword_classify(text) or 'none'
+
+def percentile(values: list, ratio: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='記録した Webhook の再生 (RECORD_FILE で記録したもの)'
+    )
+    parser.add_argument('recording', help='記録ファイル')
+    parser.add_argument('--database', default=None,
+                        help='再生前の状態とするデータベースファイル '
+                             '(コピーして使う、省略時はリポジトリのもの)')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='元の間隔の何倍の速さで再生するか '
+                             '(0 ならできるだけ速く)')
+    parser.add_argument('--reply-mode', choices=('response', 'api'),
+                        default='response')
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-replay-'))
+    setting_file = write_settings(work_dir, 'http://127.0.0.1:9/api/v4/posts',
+                                  0, 1, 'sync', reply_mode=args.reply_mode)
+    config = configparser.ConfigParser()
+    config.read(setting_file)
+    # 計測値はこのプロセスの中で集計するので書き出さない
+    config['metrics']['DIRECTORY'] = ''
+    # 再生した Webhook を記録し直さない
+    config['hirumibot']['RECORD_FILE'] = ''
+    with open(setting_file, 'w') as f:
+        config.write(f)
+    if args.database:
+        shutil.copy(args.database, work_dir / 'hirumibot.sqlite3')
+    os.environ['HIRUMIBOT_SETTING'] = str(setting_file)
+
+    # lunch_meeting の読み込みで、サーバと同じ初期化を行う
+    import hirumibot
+    import lunch_meeting
+    outbound_queue = StubOutboundQueue()
+    hirumibot.outbound_queue = outbound_queue
+    client = lunch_meeting.app.test_client()
+
+    payloads = list(read_recording(args.recording))
+    latencies = defaultdict(list)
+    max_lag = 0.0
+    start = time.perf_counter()
+    first_received = payloads[0]['received'] if payloads else 0
+    for recorded in payloads:
+        received = recorded['received']
+        if args.speed > 0:
+            due = start + (received - first_received) / args.speed
+            lag = time.perf_counter() - due
+            if lag < 0:
+                time.sleep(-lag)
+            max_lag = max(max_lag, lag)
+
+        # 受付時間の判定などが記録時と同じになるよう時刻を固定する
+        frozen = datetime.fromtimestamp(received)
+        hirumibot.clock = lambda frozen=frozen: frozen
+        payload = {'user_name': '', 'text': '', **recorded}
+        del payload['received']
+
+        command = command_name(hirumibot, payload['text'])
+        request_start = time.perf_counter()
+        response = client.post('/hirumibot', json=payload)
+        latencies[command].append(time.perf_counter() - request_start)
+        if response.status_code != 200:
+            print(f"post {payload.get('post_id')} returned "
+                  f'{response.status_code}', file=sys.stderr)
+    # まとめている返信を送り切ってから投稿数を数える
+    if hirumibot.coalescer is not None:
+        hirumibot.coalescer.flush()
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+    total = sum(len(values) for values in latencies.values())
+    print(f'replayed     : {total} webhooks in {elapsed:.2f}s '
+          f'({total / elapsed if elapsed else 0:.1f} req/s)')
+    if payloads:
+        span = payloads[-1]['received'] - payloads[0]['received']
+        print(f'recorded     : {span:.2f}s span')
+    if args.speed > 0:
+        print(f'max lag      : {max_lag * 1000:.1f} ms')
+    print(f'posts        : {outbound_queue.posts} (stubbed)')
+    print(f"\n{'command':<10} {'count':>7} {'p50[ms]':>9} {'p99[ms]':>9} "
+          f"{'max[ms]':>9}")
+    for command, values in sorted(latencies.items()):
+        print(f'{command:<10} {len(values):>7} '
+              f'{statistics.median(values) * 1000:>9.2f} '
+              f'{percentile(values, 0.99) * 1000:>9.2f} '
+              f'{max(values) * 1000:>9.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+import argparse
+import configparser
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from fake_mattermost import FakeMattermost
+
+p = Path(__file__)
+ROOT_DIR   = p.resolve().parent.parent
+APP_DIR    = ROOT_DIR / 'app'
+CONFIG_DIR = ROOT_DIR / 'config'
+
+# 投稿内容の例 (受付時間外でも処理されるよう debug を含める)
+COMMAND_TEXTS = {
+    'entry' : ['@hirumibot 参加します debug', '@hirumibot entry debug',
+               '@hirumibot 今日は出よう debug'],
+    'count' : ['@hirumibot 何人？ debug', '@hirumibot count debug',
+               '@hirumibot 参加者は？ debug'],
+    'cancel': ['@hirumibot キャンセルで debug', '@hirumibot cancel debug'],
+    'go'    : ['@hirumibot 出発！ debug', '@hirumibot go debug'],
+    'help'  : ['@hirumibot help', '@hirumibot 使い方'],
+}
+
+
+def webhook_payload(command: str, user_name: str, channel_id: str,
+                    seq: int) -> dict:
+    """
+    Outgoing Webhook のペイロード
+
+    :param command    : コマンド種別
+    :param user_name  : 投稿したユーザ名
+    :param channel_id : 投稿されたチャンネルID
+    :param seq        : 通し番号
+    :return           : Mattermost が送るのと同じ形式のペイロード
+    """
+    return {
+        'token': 'bench',
+        'team_id': 'benchteam',
+        'team_domain': 'bench',
+        'channel_id': channel_id,
+        'channel_name': 'lunch',
+        'timestamp': int(time.time() * 1000),
+        'user_id': f'id-{user_name}',
+        'user_name': user_name,
+        'post_id': f'bench-post-{seq}',
+        'text': random.choice(COMMAND_TEXTS[command]),
+        'trigger_word': '@hirumibot',
+    }
+
+def scenario_signup_storm(users: int) -> list:
+    """
+    11:00 の参加表明の殺到
+
+    全員が参加を表明し、その合間に人数確認が混ざる。最後に出発する。
+    """
+    commands = [('entry', f'user{idx:04d}') for idx in range(users)]
+    commands += [('count', f'user{idx:04d}')
+                 for idx in random.sample(range(users), users // 5)]
+    random.shuffle(commands)
+    commands.append(('go', 'user0000'))
+    return commands
+
+def scenario_count_go_mix(users: int) -> list:
+    """
+    人数確認・参加・取り消し・出発の混在
+    """
+    commands = []
+    for idx in range(users * 2):
+        user_name = f'user{random.randrange(users):04d}'
+        command = random.choices(
+            ['count', 'entry', 'cancel', 'help', 'go'],
+            weights=[50, 30, 10, 8, 2]
+        )[0]
+        commands.append((command, user_name))
+    return commands
+
+SCENARIOS = {
+    'storm': scenario_signup_storm,
+    'mix'  : scenario_count_go_mix,
+}
+
+def write_settings(work_dir: Path, mm_url: str, port: int,
+                   workers: int, worker_class: str,
+                   reply_mode: str = 'response', shards: int = 1,
+                   preload: bool = True) -> Path:
+    """
+    負荷試験用の設定ファイルの作成
+
+    :return : 設定ファイルのパス
+    """
+    config = configparser.ConfigParser()
+    config.read(CONFIG_DIR / 'setting.ini')
+    config['Mattermost']['MM_API_ADDRESS'] = mm_url
+    config['Mattermost']['HIRUMIBOT_TOKEN'] = 'bench-token'
+    config['hirumibot']['DATABASE_FILE'] = str(work_dir / 'hirumibot.sqlite3')
+    config['hirumibot']['DATABASE_TRACE'] = 'true'
+    config['hirumibot']['REPLY_MODE'] = reply_mode
+    config['hirumibot']['SESSION_SHARDS'] = str(shards)
+    config['hirumibot']['GUNICORN_CONF'] = str(work_dir / 'gunicorn_conf.py')
+    config['asyncio']['BIND'] = f'127.0.0.1:{port}'
+    config['metrics']['DIRECTORY'] = str(work_dir / 'metrics')
+    config['metrics']['FLUSH_INTERVAL'] = '0.2'
+    config['metrics']['SAMPLE_RATE'] = '1.0'
+
+    setting_file = work_dir / 'setting.ini'
+    with open(setting_file, 'w') as f:
+        config.write(f)
+
+    (work_dir / 'gunicorn_conf.py').write_text(
+        f"bind = '127.0.0.1:{port}'\n"
+        f"workers = {workers}\n"
+        f"worker_class = '{worker_class}'\n"
+        "daemon = False\n"
+        f"preload_app = {preload}\n"
+        "reload = False\n"
+        "loglevel = 'warning'\n"
+    )
+    shutil.copy(APP_DIR / 'hirumibot-db.sqlite3', work_dir / 'hirumibot.sqlite3')
+    return setting_file
+
+def scrape(base_url: str) -> dict:
+    """
+    /metrics からカウンタを取得
+
+    :return : 'メトリクス名{ラベル}' と値の対応
+    """
+    text = requests.get(f'{base_url}/metrics', timeout=10).text
+    values = {}
+    for line in text.splitlines():
+        match = re.match(r'^([a-z_]+(?:\{[^}]*\})?) ([0-9.e+-]+)$', line)
+        if match:
+            values[match.group(1)] = float(match.group(2))
+    return values
+
+def percentile(values: list, ratio: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+def run_scenario(base_url: str, commands: list, channel_ids: list,
+                 concurrency: int) -> tuple:
+    """
+    シナリオの実行
+
+    channel_ids が複数あれば、同じシナリオを各チャンネルで並行して流す。
+
+    :return : (コマンドごとの応答時間, 失敗数, 経過時間)
+    """
+    local = threading.local()
+    latencies = {}
+    failures = [0]
+    lock = threading.Lock()
+
+    def send(item):
+        seq, (command, user_name, channel_id) = item
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        payload = webhook_payload(command, user_name, channel_id, seq)
+
+        start = time.perf_counter()
+        try:
+            response = session.post(f'{base_url}/hirumibot', json=payload,
+                                    timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+
+        with lock:
+            latencies.setdefault(command, []).append(elapsed)
+            if not ok:
+                failures[0] += 1
+
+    # 各チャンネルのコマンドを交互に並べる
+    channel_commands = [
+        (command, user_name, channel_id)
+        for command, user_name in commands
+        for channel_id in channel_ids
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, enumerate(channel_commands)))
+    return latencies, failures[0], time.perf_counter() - start
+
+def wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited during startup')
+        try:
+            requests.get(f'{base_url}/metrics', timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError('server did not become ready')
+
+def report(name: str, latencies: dict, failures: int, elapsed: float,
+           before: dict, after: dict):
+    all_latencies = [v for values in latencies.values() for v in values]
+    requests_num = len(all_latencies)
+    statements = (after.get('hirumibot_db_statements_total', 0)
+                  - before.get('hirumibot_db_statements_total', 0))
+
+    print(f'== {name}: {requests_num} requests, {failures} failed, '
+          f'{elapsed:.2f}s, {requests_num / elapsed:.1f} req/s, '
+          f'{statements / max(requests_num, 1):.2f} SQL statements/request')
+    print(f"   {'command':<8} {'n':>6} {'p50[ms]':>9} {'p99[ms]':>9} "
+          f"{'max[ms]':>9}")
+    for command in sorted(latencies):
+        values = latencies[command]
+        print(f'   {command:<8} {len(values):>6} '
+              f'{percentile(values, 0.5) * 1000:>9.1f} '
+              f'{percentile(values, 0.99) * 1000:>9.1f} '
+              f'{max(values) * 1000:>9.1f}')
+    print(f"   {'all':<8} {requests_num:>6} "
+          f'{percentile(all_latencies, 0.5) * 1000:>9.1f} '
+          f'{percentile(all_latencies, 0.99) * 1000:>9.1f} '
+          f'{max(all_latencies) * 1000:>9.1f}')
+
+def bench_notices(setting_file: Path, fake: FakeMattermost, count: int):
+    """
+    定期通知の処理時間の計測
+
+    通知処理を count 回呼び出し、キューへの登録と配送完了までの時間を計る。
+    """
+    os.environ['HIRUMIBOT_SETTING'] = str(setting_file)
+    sys.path.insert(0, str(APP_DIR))
+    import hirumibot
+
+    fake.reset()
+    durations = []
+    start = time.perf_counter()
+    for _ in range(count):
+        call_start = time.perf_counter()
+        hirumibot.bot_posts_content('bench notice', hirumibot.CHANNEL_ID_ALL)
+        durations.append(time.perf_counter() - call_start)
+    enqueued = time.perf_counter() - start
+    hirumibot.outbound_queue.join(60)
+    delivered = time.perf_counter() - start
+
+    print(f'== notices: {count} posts, enqueue p50 '
+          f'{statistics.median(durations) * 1000:.3f}ms, '
+          f'all enqueued in {enqueued:.3f}s, delivered {len(fake.posts)} '
+          f'in {delivered:.2f}s')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='/hirumibot の負荷試験 (Webhook サーバ + Mattermost の代替サーバ)'
+    )
+    parser.add_argument('--scenario', choices=[*SCENARIOS, 'all'],
+                        default='all')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--server', choices=['gunicorn', 'asyncio'],
+                        default='gunicorn')
+    parser.add_argument('--workers', type=int, default=2,
+                        help='gunicorn のワーカ数')
+    parser.add_argument('--worker-class', default='sync')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--rest', action='store_true',
+                        help='REST API で返信させる (REPLY_MODE = api)')
+    parser.add_argument('--channels', type=int, default=1,
+                        help='並行して投稿するチャンネル数')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='参加者の状態を振り分けるデータベースファイル数')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Mattermost の応答遅延(秒)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Mattermost がエラーを返す割合')
+    parser.add_argument('--notices', type=int, default=0,
+                        help='定期通知の投稿を計測する回数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    fake = FakeMattermost(latency=args.latency,
+                          error_rate=args.error_rate).start()
+    work_dir = Path(tempfile.mkdtemp(prefix='hirumibot-bench-'))
+    setting_file = write_settings(work_dir, fake.url, args.port,
+                                  args.workers, args.worker_class,
+                                  'api' if args.rest else 'response',
+                                  args.shards)
+    channel_ids = [f'bench-channel-{idx:03d}' for idx in range(args.channels)]
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    if args.server == 'gunicorn':
+        server_args = ['gunicorn', '--chdir', str(APP_DIR), 'lunch_meeting:app',
+                       '-c', str(work_dir / 'gunicorn_conf.py')]
+    else:
+        server_args = [sys.executable, str(APP_DIR / 'lunch_meeting_async.py')]
+    server = subprocess.Popen(
+        server_args,
+        cwd = str(APP_DIR),
+        env = dict(os.environ, HIRUMIBOT_SETTING=str(setting_file)),
+    )
+    try:
+        wait_ready(base_url, server)
+        names = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+        for name in names:
+            commands = SCENARIOS[name](args.users)
+            fake.reset()
+            time.sleep(0.5)
+            before = scrape(base_url)
+            latencies, failures, elapsed = run_scenario(
+                base_url, commands, channel_ids, args.concurrency
+            )
+            # 各ワーカが計測値を書き出すのを待つ
+            time.sleep(0.5)
+            after = scrape(base_url)
+            report(name, latencies, failures, elapsed, before, after)
+            print(f'   mattermost received {len(fake.posts)} posts')
+
+        if args.notices:
+            bench_notices(setting_file, fake, args.notices)
+    finally:
+        server.terminate()
+        server.wait()
+        fake.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
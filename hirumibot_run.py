@@ -1,54 +1,199 @@
-import atexit
 import configparser
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
 from pathlib import Path
-from subprocess import Popen, PIPE
-from time import sleep
+
+logger = logging.getLogger(__name__)
 
 p = Path(__file__)
 APP_DIR    = p.resolve().parent / 'app'
 CONFIG_DIR = p.resolve().parent / 'config'
 
+# 環境変数で設定ファイルを切り替え、一つのホストで複数のBotを動かせるようにする
+SETTING_FILE = Path(os.environ.get('HIRUMIBOT_SETTING',
+                                   CONFIG_DIR / 'setting.ini')).resolve()
+
 config = configparser.ConfigParser()
-config.read(CONFIG_DIR / 'setting.ini')
+config.read(SETTING_FILE)
 
 HIRUMI_NOTICE = APP_DIR / 'notice.py'
+HIRUMI_ASYNC  = APP_DIR / 'lunch_meeting_async.py'
+HIRUMI_EVENTS = APP_DIR / 'event_stream.py'
 GUNICORN_CONF = CONFIG_DIR / config['hirumibot']['GUNICORN_CONF']
+# コマンドを受けるサーバ (gunicorn / asyncio / websocket)
+SERVER        = config['hirumibot'].get('SERVER', 'gunicorn')
+
+# 子プロセスの再起動間隔(秒)
+RESTART_BACKOFF     = config.getfloat('supervisor', 'RESTART_BACKOFF',
+                                      fallback=1)
+RESTART_BACKOFF_MAX = config.getfloat('supervisor', 'RESTART_BACKOFF_MAX',
+                                      fallback=60)
+# この時間以上動いていた子プロセスは、再起動間隔を初期値に戻す
+STABLE_SECONDS      = config.getfloat('supervisor', 'STABLE_SECONDS',
+                                      fallback=60)
+# 停止時に子プロセスの終了を待つ時間(秒)
+SHUTDOWN_TIMEOUT    = config.getfloat('supervisor', 'SHUTDOWN_TIMEOUT',
+                                      fallback=30)
+
+# 子プロセスの起動コマンド
+SERVERS = {
+    'gunicorn': [
+        'gunicorn', '--chdir', str(APP_DIR),
+        'lunch_meeting:app', '-c', str(GUNICORN_CONF),
+    ],
+    'asyncio': [sys.executable, str(HIRUMI_ASYNC)],
+    'websocket': [sys.executable, str(HIRUMI_EVENTS)],
+}
+CHILDREN = {
+    'notice': [sys.executable, str(HIRUMI_NOTICE)],
+    'lunch_meeting': SERVERS[SERVER],
+}
 
-# 子プロセス起動
-p_notice = Popen(['python3', HIRUMI_NOTICE])
+# 監視するシグナル
+# 子プロセスの終了も停止要求も、シグナルとして待ち受ける
+HANDLED_SIGNALS = {signal.SIGCHLD, signal.SIGTERM, signal.SIGINT}
 
-p_lunch = f"gunicorn --chdir {APP_DIR} lunch_meeting:app -c {GUNICORN_CONF}"
-Popen(p_lunch.split())
 
-def endprocess():
+class Child:
     """
-    プロセスの停止
+    子プロセス
+
+    起動コマンドと再起動の状態を保持する。
+    """
+
+    def __init__(self, name: str, args: list):
+        """
+        :param name : 子プロセス名
+        :param args : 起動コマンド
+        """
+        self.name = name
+        self.args = args
+        self.process = None
+        self.started = 0.0
+        self.backoff = RESTART_BACKOFF
+        self.restart_at = None
+
+    def start(self):
+        """ 子プロセスの起動 """
+        env = dict(os.environ, HIRUMIBOT_SETTING=str(SETTING_FILE))
+        self.process = subprocess.Popen(
+            self.args,
+            env = env,
+            # 監視用にブロックしたシグナルを子プロセスでは元に戻す
+            preexec_fn = lambda: signal.pthread_sigmask(
+                signal.SIG_UNBLOCK, HANDLED_SIGNALS
+            ),
+        )
+        self.started = time.monotonic()
+        self.restart_at = None
+        logger.info('started %s (pid %s)', self.name, self.process.pid)
+
+    def exited(self, status: int):
+        """
+        子プロセス終了時の処理
+
+        再起動の時刻を決める。すぐに落ち続ける場合は間隔を倍にしていく。
+
+        :param status : waitpid() の終了ステータス
+        """
+        now = time.monotonic()
+        if now - self.started >= STABLE_SECONDS:
+            self.backoff = RESTART_BACKOFF
+
+        logger.warning('%s (pid %s) exited with status %s, '
+                       'restarting in %.1fs', self.name, self.process.pid,
+                       os.waitstatus_to_exitcode(status), self.backoff)
+
+        # Popen が二重に回収しないよう、回収済みとして記録する
+        self.process.returncode = os.waitstatus_to_exitcode(status)
+        self.process = None
+        self.restart_at = now + self.backoff
+        self.backoff = min(self.backoff * 2, RESTART_BACKOFF_MAX)
+
 
-    全ての子プロセスを停止した後に処理を終了させる。
+def reap(children: dict) -> None:
     """
-    p_notice.terminate()
-    Popen(['pkill', 'gunicorn'])
-    exit(1)
+    終了した子プロセスの回収
+
+    :param children : PID と子プロセスの対応
+    """
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+        child = children.pop(pid, None)
+        if child is not None:
+            child.exited(status)
+
+def shutdown(children: dict) -> None:
+    """
+    子プロセスの停止
+
+    全ての子プロセスに SIGTERM を送り、猶予時間内に終了しなければ
+    SIGKILL で停止させる。
+
+    :param children : PID と子プロセスの対応
+    """
+    for child in children.values():
+        child.process.terminate()
+
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    for child in children.values():
+        try:
+            child.process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            child.process.kill()
+            child.process.wait()
 
 def process_monitor():
     """
     プロセス監視
 
-    子プロセスの起動状況を定期的に確認する。
-    いずれかの子プロセスが停止していた場合、
-    全てのプロセスを停止し、処理を終了させる。
+    自身が起動した子プロセスだけを監視する。
+    子プロセスの終了は SIGCHLD で即座に検知し、間隔を空けて再起動する。
+    SIGTERM・SIGINT を受けると子プロセスを停止してから終了する。
     """
-    gunicorn_proc = str(2)
+    signal.pthread_sigmask(signal.SIG_BLOCK, HANDLED_SIGNALS)
+
+    supervised = [Child(name, args) for name, args in CHILDREN.items()]
+    children = {}
+    for child in supervised:
+        child.start()
+        children[child.process.pid] = child
+
     while True:
-        sleep(10)
+        # 再起動待ちの子プロセスがあれば、その時刻までシグナルを待つ
+        pending = [c.restart_at for c in supervised if c.restart_at is not None]
+        if pending:
+            timeout = max(0, min(pending) - time.monotonic())
+            info = signal.sigtimedwait(HANDLED_SIGNALS, timeout)
+        else:
+            info = signal.sigwaitinfo(HANDLED_SIGNALS)
+
+        if info is not None and info.si_signo != signal.SIGCHLD:
+            logger.info('received signal %s, shutting down', info.si_signo)
+            shutdown(children)
+            return
 
-        if p_notice.poll() is not None:
-            endprocess()
+        reap(children)
 
-        p_lunch_chk = "pgrep -c gunicorn"
-        p_lunch_num = Popen(p_lunch_chk.split(), stdout=PIPE).communicate()
-        if gunicorn_proc not in p_lunch_num[0].decode('utf-8'):
-            endprocess()
+        now = time.monotonic()
+        for child in supervised:
+            if child.restart_at is not None and child.restart_at <= now:
+                child.start()
+                children[child.process.pid] = child
 
-atexit.register(endprocess)
-process_monitor()
\ No newline at end of file
+if __name__ == '__main__':
+    logging.basicConfig(
+        level = logging.INFO,
+        format = '%(asctime)s %(name)s %(levelname)s %(message)s',
+    )
+    process_monitor()
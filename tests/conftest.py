@@ -0,0 +1,41 @@
+import configparser
+import importlib
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parent.parent / 'app'
+CONFIG_DIR = APP_DIR.parent / 'config'
+
+# app 以下のモジュールは app を起点に読み込む (起動時と同じ)
+sys.path.insert(0, str(APP_DIR))
+
+
+@pytest.fixture(scope='session')
+def hirumibot(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp('hirumibot')
+    config = configparser.ConfigParser()
+    config.read(CONFIG_DIR / 'setting.ini')
+    config['Mattermost']['MM_API_ADDRESS'] = 'http://127.0.0.1:9/api/v4/posts'
+    config['hirumibot']['DATABASE_FILE'] = str(work_dir / 'hirumibot.sqlite3')
+    config['metrics']['DIRECTORY'] = ''
+    setting_file = work_dir / 'setting.ini'
+    with open(setting_file, 'w') as f:
+        config.write(f)
+    # 同梱の DB は書き換えないよう、コピーに対して動かす
+    shutil.copy(APP_DIR / 'hirumibot-db.sqlite3', work_dir / 'hirumibot.sqlite3')
+
+    previous = os.environ.get('HIRUMIBOT_SETTING')
+    os.environ['HIRUMIBOT_SETTING'] = str(setting_file)
+    try:
+        module = importlib.import_module('hirumibot')
+    finally:
+        if previous is None:
+            del os.environ['HIRUMIBOT_SETTING']
+        else:
+            os.environ['HIRUMIBOT_SETTING'] = previous
+    module.init_database()
+    return module
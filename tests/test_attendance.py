@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def channel(hirumibot, monkeypatch):
+    monkeypatch.setattr(hirumibot, 'clock',
+                        lambda: datetime(2026, 10, 21, 11, 30))
+    channel_id = hirumibot.CHANNEL_ID_LUNCH
+    c = hirumibot.session_connection(channel_id).cursor()
+    for table in ('lunch_participant', 'attendance_log', 'lunch_session',
+                  'attendance_streak', 'weekly_turnout', 'pair_history'):
+        c.execute(f'DELETE FROM {table}')
+    return channel_id
+
+def pair_history(hirumibot, channel_id: str) -> dict:
+    c = hirumibot.session_connection(channel_id).cursor()
+    c.execute('SELECT user_a, user_b, met_count FROM pair_history '
+              'WHERE channel_id = ?', (channel_id,))
+    return {(user_a, user_b): met_count
+            for user_a, user_b, met_count in c.fetchall()}
+
+def test_single_group_records_pair_history(hirumibot, channel):
+    for username in ('a', 'b', 'c'):
+        hirumibot.participant_registration(username, channel)
+    hirumibot.depart_lunch_meetig(channel)
+    assert pair_history(hirumibot, channel) == {
+        ('a', 'b'): 1, ('a', 'c'): 1, ('b', 'c'): 1
+    }
+
+def test_repeated_single_group_departure_counts_once(hirumibot, channel):
+    for username in ('a', 'b', 'c'):
+        hirumibot.participant_registration(username, channel)
+    hirumibot.depart_lunch_meetig(channel)
+    hirumibot.depart_lunch_meetig(channel)
+    assert pair_history(hirumibot, channel) == {
+        ('a', 'b'): 1, ('a', 'c'): 1, ('b', 'c'): 1
+    }
+    c = hirumibot.session_connection(channel).cursor()
+    c.execute('SELECT turnout, group_count FROM lunch_session')
+    assert c.fetchall() == [(3, 1)]
+
+    # 後から加わった参加者を含むペアだけが増える
+    hirumibot.participant_registration('d', channel)
+    hirumibot.depart_lunch_meetig(channel)
+    assert pair_history(hirumibot, channel) == {
+        ('a', 'b'): 1, ('a', 'c'): 1, ('b', 'c'): 1,
+        ('a', 'd'): 1, ('b', 'd'): 1, ('c', 'd'): 1
+    }
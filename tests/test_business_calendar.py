@@ -0,0 +1,98 @@
+import calendar
+from datetime import date, datetime, timedelta
+
+import jpholiday
+import pytest
+
+import business_calendar
+
+YEARS = range(2019, 2031)
+
+
+@pytest.fixture(autouse=True)
+def no_cache_file():
+    """ 祝日の一覧はファイルに保存せず、毎回 jpholiday から求める """
+    business_calendar.configure(None)
+    business_calendar.year_calendar.cache_clear()
+    yield
+    business_calendar.year_calendar.cache_clear()
+
+def every_day(year: int):
+    day = date(year, 1, 1)
+    while day.year == year:
+        yield day
+        day += timedelta(days=1)
+
+def last_friday_of(year: int, month: int) -> date:
+    """ 月の日付を全て調べて最後の金曜日を求める """
+    return max(date(year, month, d)
+               for d in range(1, calendar.monthrange(year, month)[1] + 1)
+               if date(year, month, d).weekday() == 4)
+
+@pytest.mark.parametrize('year', YEARS)
+def test_is_holiday(year):
+    for day in every_day(year):
+        assert business_calendar.is_holiday(day) == jpholiday.is_holiday(day), day
+
+@pytest.mark.parametrize('year', YEARS)
+def test_is_last_friday(year):
+    for day in every_day(year):
+        expected = day == last_friday_of(day.year, day.month)
+        assert business_calendar.is_last_friday(day) == expected, day
+
+@pytest.mark.parametrize('year', YEARS)
+def test_is_business_day(year):
+    for day in every_day(year):
+        expected = day.weekday() < 5 and not jpholiday.is_holiday(day)
+        assert business_calendar.is_business_day(day) == expected, day
+
+@pytest.mark.parametrize('hour, minute, expected', [
+    (10, 59, False),
+    (11, 0, True),
+    (12, 59, True),
+    (13, 0, False),
+])
+def test_is_reception_possible_boundaries(hour, minute, expected):
+    # 祝日でない水曜日
+    day = date(2026, 10, 21)
+    assert day.weekday() == 2 and not jpholiday.is_holiday(day)
+    posted = datetime.combine(day, datetime.min.time()).replace(
+        hour=hour, minute=minute
+    )
+    assert business_calendar.is_reception_possible(posted) == expected
+
+@pytest.mark.parametrize('day', [date(2026, 2, 11), date(2026, 4, 29)])
+def test_is_reception_possible_on_holiday_wednesday(day):
+    assert day.weekday() == 2 and jpholiday.is_holiday(day)
+    for hour in range(24):
+        posted = datetime(day.year, day.month, day.day, hour, 30)
+        assert not business_calendar.is_reception_possible(posted)
+
+def test_is_reception_possible_other_weekdays():
+    # 水曜日以外は受付時間帯でも受け付けない
+    for offset in (-2, -1, 1, 2):
+        posted = datetime(2026, 10, 21, 11, 30) + timedelta(days=offset)
+        assert not business_calendar.is_reception_possible(posted)
+
+def test_year_rollover():
+    # 大晦日から元日へ替わっても、それぞれの年のカレンダーを参照する
+    new_years_eve = date(2026, 12, 31)
+    new_years_day = date(2027, 1, 1)
+    assert not business_calendar.is_holiday(new_years_eve)
+    assert business_calendar.is_business_day(new_years_eve)
+    assert business_calendar.is_holiday(new_years_day)
+    assert business_calendar.year_calendar(2026).year == 2026
+    assert business_calendar.year_calendar(2027).year == 2027
+
+    # 古い年は破棄され、再び参照すれば構築し直す
+    business_calendar.year_calendar(2028)
+    info = business_calendar.year_calendar.cache_info()
+    assert info.currsize == 2
+    assert business_calendar.is_business_day(new_years_eve)
+    assert business_calendar.year_calendar.cache_info().misses == info.misses + 1
+
+def test_last_friday_across_year_end():
+    # 12月の最終金曜日の翌週は翌年になる
+    assert business_calendar.is_last_friday(date(2026, 12, 25))
+    assert not business_calendar.is_last_friday(date(2027, 1, 1))
+    assert business_calendar.is_last_friday(date(2027, 1, 29))
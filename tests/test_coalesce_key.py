@@ -0,0 +1,25 @@
+import sqlite3
+
+
+def test_count_key_follows_roster_changes_in_other_workers(hirumibot):
+    channel_id = hirumibot.CHANNEL_ID_LUNCH
+    key = hirumibot.coalesce_key('count', 'count', channel_id)
+    assert hirumibot.coalesce_key('count', 'count', channel_id) == key
+
+    # 別のワーカプロセスの参加表明は、このプロセスの版を進めない
+    conn = sqlite3.connect(hirumibot.session_db(channel_id))
+    conn.create_function('hirumibot_now', 0, hirumibot.sql_now)
+    with conn:
+        conn.execute(
+            'INSERT INTO lunch_participant(channel_id, session_date, username) '
+            "VALUES(?, '2026-10-21', 'other-worker')", (channel_id,)
+        )
+    conn.close()
+    assert hirumibot.coalesce_key('count', 'count', channel_id) != key
+
+def test_help_key_ignores_roster(hirumibot):
+    channel_id = hirumibot.CHANNEL_ID_LUNCH
+    assert hirumibot.coalesce_key('help', 'help', channel_id) == (
+        channel_id, 'help'
+    )
+    assert hirumibot.coalesce_key('stats', 'stats', channel_id) is None
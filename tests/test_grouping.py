@@ -0,0 +1,79 @@
+import random
+
+import pytest
+
+import grouping
+
+MAX_MEMBER_NUM = 2000
+GROUP_LIMITS = [(3, 4), (2, 5), (4, 4)]
+
+
+def feasible(member_num: int, min_num: int, max_num: int) -> bool:
+    """ 全ての班を min_num～max_num 名にできるか """
+    return -(-member_num // max_num) <= member_num // min_num
+
+def random_history(members: list, weeks: int, min_num: int, max_num: int,
+                   rng: random.Random) -> dict:
+    """ 毎週ランダムに班分けした場合の、同じ班になった回数 """
+    history = {}
+    for _ in range(weeks):
+        groups = grouping.partition(members, min_num, max_num, rng=rng)
+        for pair in grouping.group_pairs(groups):
+            history[pair] = history.get(pair, 0) + 1
+    return history
+
+def check_groups(groups: list, members: list, min_num: int, max_num: int):
+    assert sorted(sum(groups, [])) == sorted(members)
+    sizes = [len(group) for group in groups]
+    assert all(1 <= size <= max_num for size in sizes)
+    assert max(sizes) - min(sizes) <= 1
+    if feasible(len(members), min_num, max_num):
+        assert all(min_num <= size for size in sizes)
+
+@pytest.mark.parametrize('min_num, max_num', GROUP_LIMITS)
+def test_partition_every_member_once(min_num, max_num):
+    rng = random.Random(min_num * 100 + max_num)
+    for member_num in range(1, MAX_MEMBER_NUM + 1):
+        members = [f'user{idx:05d}' for idx in range(member_num)]
+        groups = grouping.partition(members, min_num, max_num, rng=rng)
+        check_groups(groups, members, min_num, max_num)
+
+def test_partition_duplicates_and_empty():
+    groups = grouping.partition(['a', 'b', 'a', 'c', 'b'], 1, 2,
+                                rng=random.Random(0))
+    assert sorted(sum(groups, [])) == ['a', 'b', 'c']
+    assert grouping.partition([], 3, 4) == []
+
+def test_partition_invalid_limits():
+    with pytest.raises(ValueError):
+        grouping.partition(['a'], 0, 4)
+    with pytest.raises(ValueError):
+        grouping.partition(['a'], 5, 4)
+
+@pytest.mark.parametrize('member_num', [
+    *range(1, 60), 97, 128, 250, 499, 1000, 1999, 2000,
+])
+def test_partition_with_history(member_num):
+    min_num, max_num = 3, 4
+    members = [f'user{idx:05d}' for idx in range(member_num)]
+    history = random_history(members, 8, min_num, max_num,
+                             random.Random(member_num))
+
+    for seed in range(3):
+        # 同じ乱数で始めれば、入れ替え前の班分けは履歴の無い班分けと同じ
+        baseline = grouping.partition(members, min_num, max_num,
+                                      rng=random.Random(seed))
+        groups = grouping.partition(members, min_num, max_num,
+                                    history=history, rng=random.Random(seed))
+        check_groups(groups, members, min_num, max_num)
+        assert (grouping.repeat_pairs(groups, history)
+                <= grouping.repeat_pairs(baseline, history))
+
+def test_partition_avoids_repeated_pairs():
+    # 二班に分けられる参加者で、前回と同じ組み合わせは避けられる
+    members = [f'user{idx}' for idx in range(8)]
+    previous = [members[:4], members[4:]]
+    history = {pair: 1 for pair in grouping.group_pairs(previous)}
+    groups = grouping.partition(members, 4, 4, history=history,
+                                rng=random.Random(0))
+    assert grouping.repeat_pairs(groups, history) == 4
@@ -0,0 +1,72 @@
+import socket
+import subprocess
+import time
+
+import pytest
+
+import database
+from reply_cache import ReplyCache, claim_holder
+
+SCHEMA = '''
+CREATE TABLE webhook_reply(
+    post_id TEXT NOT NULL PRIMARY KEY, reply TEXT, created REAL NOT NULL,
+    holder TEXT
+);
+'''
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / 'reply.sqlite3')
+    database.connection(db_file).executescript(SCHEMA)
+    yield db_file
+    database.close_all()
+
+def set_claim(db_file: str, post_id: str, created: float, holder):
+    database.connection(db_file).execute(
+        'UPDATE webhook_reply SET created = ?, holder = ? WHERE post_id = ?',
+        (created, holder, post_id)
+    )
+
+def dead_pid() -> int:
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_claim_and_stored_reply(db_file):
+    cache = ReplyCache(db_file, wait=0.1)
+    assert cache.claim('p1') == (True, None)
+    cache.store('p1', {'text': 'ok'})
+    assert ReplyCache(db_file, wait=0.1).claim('p1') == (False, {'text': 'ok'})
+
+def test_live_holder_is_not_taken_over(db_file):
+    # 処理中のワーカ(このプロセス)が生きていれば、wait を過ぎても引き継がない
+    assert ReplyCache(db_file, wait=0.1).claim('p1') == (True, None)
+    set_claim(db_file, 'p1', time.time() - 60, claim_holder())
+    cache = ReplyCache(db_file, wait=0.1, takeover=300)
+    assert cache.claim('p1') == (False, {})
+
+def test_dead_holder_is_taken_over(db_file):
+    ReplyCache(db_file, wait=0.1).claim('p1')
+    set_claim(db_file, 'p1', time.time(),
+              f'{socket.gethostname()}:{dead_pid()}')
+    assert ReplyCache(db_file, wait=0.1).claim('p1') == (True, None)
+    # 引き継いだ後は、引き継いだプロセスが処理中として扱われる
+    assert ReplyCache(db_file, wait=0.1).claim('p1') == (False, {})
+
+def test_unknown_holder_is_taken_over_after_takeover(db_file):
+    ReplyCache(db_file, wait=0.1).claim('p1')
+    # 他のホストのワーカや旧形式の行は、takeover 秒を過ぎるまで待つ
+    for holder in ('other-host:1', None):
+        set_claim(db_file, 'p1', time.time() - 60, holder)
+        assert ReplyCache(db_file, wait=0.1, takeover=300).claim('p1') \
+            == (False, {})
+    set_claim(db_file, 'p1', time.time() - 301, 'other-host:1')
+    assert ReplyCache(db_file, wait=0.1, takeover=300).claim('p1') \
+        == (True, None)
+
+def test_released_claim_is_claimed_again(db_file):
+    cache = ReplyCache(db_file, wait=0.1)
+    cache.claim('p1')
+    cache.release('p1')
+    assert ReplyCache(db_file, wait=0.1).claim('p1') == (True, None)
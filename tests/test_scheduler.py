@@ -0,0 +1,50 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from scheduler import CronSchedule, Job, Scheduler
+
+NOW = datetime(2026, 10, 21, 12, 10)
+
+
+def catch_up(last_run: datetime, catchup: float) -> list:
+    """ 登録直後に実行された予定時刻の一覧 """
+    ran = []
+    finished = threading.Event()
+    scheduler = Scheduler(workers=1, clock=lambda: NOW)
+    scheduler.on_run = lambda job, scheduled: finished.set()
+    scheduler.add(Job('hourly', CronSchedule('0 * * * *'), ran.append,
+                      catchup=catchup), last_run)
+
+    thread = threading.Thread(target=scheduler.run)
+    thread.start()
+    finished.wait(1)
+    scheduler.stop()
+    thread.join()
+    return ran
+
+def test_missed_run_within_catchup():
+    assert catch_up(datetime(2026, 10, 21, 11, 0), 3600) == [
+        datetime(2026, 10, 21, 12, 0)
+    ]
+
+def test_downtime_longer_than_interval_runs_latest_only():
+    # 9時以降の実行を逃しているが、猶予時間内の12時の分だけを実行する
+    assert catch_up(datetime(2026, 10, 21, 8, 0), 3600) == [
+        datetime(2026, 10, 21, 12, 0)
+    ]
+
+def test_missed_run_outside_catchup():
+    assert catch_up(datetime(2026, 10, 21, 8, 0), 300) == []
+
+@pytest.mark.parametrize('expression, after, expected', [
+    ('30 9 * * mon-fri', datetime(2026, 10, 23, 9, 30),
+     datetime(2026, 10, 26, 9, 30)),
+    ('*/15 * * * *', datetime(2026, 10, 21, 23, 59),
+     datetime(2026, 10, 22, 0, 0)),
+    ('0 0 1 jan *', datetime(2026, 10, 21),
+     datetime(2027, 1, 1, 0, 0)),
+])
+def test_next_after(expression, after, expected):
+    assert CronSchedule(expression).next_after(after) == expected